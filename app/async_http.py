@@ -0,0 +1,223 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+
+logger = logging.getLogger(__name__)
+
+
+HTTP_EXECUTOR_WORKERS = int(os.getenv('HTTP_EXECUTOR_WORKERS', 8))
+# Request paths (prefixes) answered directly on the event loop: in-memory reads that never
+# touch storage. Every other route, and the streaming of its body, runs on the executor.
+HTTP_INLINE_PATHS = tuple(filter(None, os.getenv(
+    'HTTP_INLINE_PATHS',
+    '/balance/,/metrics,/mine/jobs'
+).split(',')))
+HTTP_MAX_HEADER_BYTES = 64 * 1024
+HTTP_MAX_BODY_BYTES = int(os.getenv('HTTP_MAX_BODY_BYTES', 10 * 1024 * 1024))
+# Seconds an idle keep-alive connection is kept open
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 15))
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status.phrase)
+        self.status = status
+
+
+class AsyncHTTPServer:
+    """
+    Minimal HTTP/1.1 server on an asyncio loop that dispatches to a WSGI app.
+
+    Serving the Flask app this way puts the HTTP API on the P2P event loop. Routes
+    listed in ``HTTP_INLINE_PATHS`` are answered inline without a thread hop; every
+    other route runs on a thread pool, and so does each step of its response body, so
+    signing, storage reads behind ``block.to_dict()`` or a streamed chain never stall
+    gossip and sync. Supports keep-alive, Content-Length request bodies and chunked
+    responses.
+    """
+
+    def __init__(self, app, host='0.0.0.0', port=5000, inline_paths=HTTP_INLINE_PATHS,
+                 workers=HTTP_EXECUTOR_WORKERS):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.inline_paths = inline_paths
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+        self.server = None
+        self.requests_served = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port,
+                                                 limit=HTTP_MAX_HEADER_BYTES)
+        logger.info("Async HTTP API listening on %s:%d", self.host, self.port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    async def _handle_client(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HTTP_KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    return
+                try:
+                    method, target, version, headers = self._parse_head(head)
+                    body = await self._read_body(reader, headers)
+                except HTTPError as e:
+                    await self._write_error(writer, e.status)
+                    return
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                environ = self._environ(method, target, version, headers, body, peer)
+                keep_alive = await self._respond(environ, writer, version, keep_alive)
+                self.requests_served += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_head(head):
+        try:
+            lines = head.decode('latin-1').split("\r\n")
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            raise HTTPError(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise HTTPError(HTTPStatus.BAD_REQUEST)
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED)
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+        if length > HTTP_MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        if length <= 0:
+            return b""
+        try:
+            return await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST)
+
+    def _environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition("?")
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, encoding='latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)) if body else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name not in ('content-type', 'content-length'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    def _runs_inline(self, path):
+        return any(path.startswith(prefix) for prefix in self.inline_paths)
+
+    def _call_app(self, environ):
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = response_headers
+
+        result = self.app(environ, start_response)
+        return response, result, iter(result)
+
+    async def _respond(self, environ, writer, version, keep_alive):
+        """Run the app and write its response. Returns whether the connection stays open."""
+        inline = self._runs_inline(environ['PATH_INFO'])
+        loop = asyncio.get_running_loop()
+        if inline:
+            response, body, chunks = self._call_app(environ)
+        else:
+            response, body, chunks = await loop.run_in_executor(self.executor, self._call_app, environ)
+        try:
+            headers = response['headers']
+            has_length = any(name.lower() == 'content-length' for name, _ in headers)
+            chunked = not has_length and version == 'HTTP/1.1'
+            if not has_length and not chunked:
+                keep_alive = False
+            lines = [f"{version} {response['status']}"]
+            lines += [f"{name}: {value}" for name, value in headers]
+            if chunked:
+                lines.append("Transfer-Encoding: chunked")
+            lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+            if environ['REQUEST_METHOD'] != 'HEAD':
+                while True:
+                    # Streamed bodies produce each chunk where the app ran, e.g. a block read from storage
+                    if inline:
+                        chunk = next(chunks, None)
+                    else:
+                        chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    if not chunk:
+                        continue
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                    # Lets other requests and P2P traffic run between chunks of a streamed body
+                    await writer.drain()
+                if chunked:
+                    writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return keep_alive
+
+    @staticmethod
+    async def _write_error(writer, status):
+        body = status.phrase.encode('latin-1')
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
@@ -0,0 +1,10 @@
+"""
+Offline benchmark suite.
+
+Runs against the in-memory storage backend and deterministic synthetic data,
+and prints a JSON report (ops/sec, p50/p99 latency, peak traced memory per
+scenario). From the ``app`` directory::
+
+    python -m benchmarks --blocks 10000 --output report.json
+    python -m benchmarks --baseline report.json   # exits 1 on a regression
+"""
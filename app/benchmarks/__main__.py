@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import sys
+import time
+import log
+
+
+DEFAULT_DIFFICULTY = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Offline benchmarks of ingest, mining, Merkle trees, validation and sync.",
+    )
+    parser.add_argument('--scenarios', default="all", help="comma-separated scenario names, or 'all'")
+    parser.add_argument('--list', action='store_true', help="list scenarios and exit")
+    parser.add_argument('--blocks', type=int, default=1000, help="height of the synthetic chain (1k-100k)")
+    parser.add_argument('--txs-per-block', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=200, help="transactions per ingest round")
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--mine-blocks', type=int, default=20, help="blocks per mining round")
+    parser.add_argument('--merkle-size', type=int, default=1024, help="leaves per Merkle tree")
+    parser.add_argument('--reorg-depth', type=int, default=50)
+    parser.add_argument('--wallets', type=int, default=50)
+    parser.add_argument('--difficulty', type=int, default=DEFAULT_DIFFICULTY,
+                        help="proof-of-work difficulty of mined and synthetic blocks")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="rounds per scenario")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative throughput drop or memory growth counted as a regression")
+    parser.add_argument('--log-level', default="WARNING")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log.configure(args.log_level)
+    if 'blockchain.miner' in sys.modules:
+        print("warning: blockchain modules were imported before MINING_DIFFICULTY was set", file=sys.stderr)
+    # Module-level settings are read at import time, so the difficulty must be set before importing the node
+    os.environ['MINING_DIFFICULTY'] = str(args.difficulty)
+    from benchmarks import scenarios  # noqa: F401  (registers the scenarios)
+    from benchmarks.harness import REPORT_VERSION, SCENARIOS, compare, environment, run_scenario
+
+    if args.list:
+        for name, function in SCENARIOS.items():
+            print(f"{name:15} {function.__doc__}")
+        return 0
+    names = list(SCENARIOS) if args.scenarios == "all" else args.scenarios.split(",")
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    parameters = {
+        key: value for key, value in vars(args).items()
+        if key not in ('scenarios', 'list', 'no_memory', 'output', 'baseline', 'threshold', 'log_level')
+    }
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "parameters": parameters,
+        "results": {},
+    }
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        result = run_scenario(name, parameters, args.repeat, memory=not args.no_memory)
+        report["results"][name] = result
+        print(f"  {result['ops_per_sec']:.1f} ops/s  p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms",
+              file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+        for name, entry in report["comparison"].items():
+            if name.startswith("_"):
+                print(f"warning: {entry}", file=sys.stderr)
+                continue
+            change = entry["ops_per_sec_change"]
+            print(f"{name:15} throughput {change:+.1%}" + (f"  REGRESSION: {', '.join(entry['regression'])}"
+                                                             if entry["regression"] else ""), file=sys.stderr)
+            if entry["regression"]:
+                regressions.append(name)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
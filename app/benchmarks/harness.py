@@ -0,0 +1,120 @@
+import gc
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+
+REPORT_VERSION = 1
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    """
+    Register a benchmark. The function takes ``(params, repeat)`` and returns a
+    ``Sample``; only the work it wraps in ``Sample.timed`` is measured.
+    """
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+class Sample:
+    """Latencies of the measured operations; ``ops`` counts the units they processed."""
+
+    def __init__(self):
+        self.latencies = []
+        self.ops = 0
+        self.extra = {}
+
+    def timed(self, function, *args, ops=1):
+        started = time.perf_counter()
+        result = function(*args)
+        self.latencies.append(time.perf_counter() - started)
+        self.ops += ops
+        return result
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def run_scenario(name, params, repeat, memory=True):
+    """Run one scenario: a timed pass, then (optionally) a single-repeat pass under tracemalloc."""
+    function = SCENARIOS[name]
+    gc.collect()
+    sample = function(params, repeat)
+    seconds = sum(sample.latencies)
+    result = {
+        "ops": sample.ops,
+        "calls": len(sample.latencies),
+        "seconds": seconds,
+        "ops_per_sec": sample.ops / seconds if seconds else 0.0,
+        "p50_ms": percentile(sample.latencies, 0.50) * 1000,
+        "p99_ms": percentile(sample.latencies, 0.99) * 1000,
+        "peak_memory_bytes": None,
+    }
+    result.update(sample.extra)
+    if memory:
+        # Tracing slows Python code down, so memory is measured on a separate, shorter pass
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function(params, 1)
+            result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def environment():
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare ``report`` with a saved ``baseline``. A scenario regresses when its
+    throughput drops, or its peak memory grows, by more than ``threshold``.
+    """
+    comparison = OrderedDict()
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        entry = {
+            "ops_per_sec_change": _change(result["ops_per_sec"], base["ops_per_sec"]),
+            "p50_ms_change": _change(result["p50_ms"], base["p50_ms"]),
+            "p99_ms_change": _change(result["p99_ms"], base["p99_ms"]),
+            "peak_memory_change": _change(result.get("peak_memory_bytes"), base.get("peak_memory_bytes")),
+        }
+        reasons = []
+        if entry["ops_per_sec_change"] is not None and entry["ops_per_sec_change"] < -threshold:
+            reasons.append("throughput")
+        if entry["peak_memory_change"] is not None and entry["peak_memory_change"] > threshold:
+            reasons.append("memory")
+        entry["regression"] = reasons
+        comparison[name] = entry
+    if baseline.get("parameters") != report["parameters"]:
+        comparison["_warning"] = "baseline was recorded with different parameters"
+    return comparison
+
+
+def _change(current, base):
+    if current is None or not base:
+        return None
+    return (current - base) / base
@@ -0,0 +1,199 @@
+import asyncio
+import shutil
+import tempfile
+from blockchain.block import Block
+from blockchain.blockchain import Blockchain
+from blockchain.merkle_tree import MerkleTree
+from blockchain.miner import Miner
+from blockchain.p2p import P2PNetwork
+from blockchain.validation import ChainValidator
+from benchmarks.harness import Sample, scenario
+from benchmarks.synthetic import BASE_TIMESTAMP, SyntheticData
+from database.log_storage import LogStorage
+from database.memory_storage import MemoryStorage
+
+
+# Chains are expensive to mine, so each distinct shape is built once per run
+_chains = {}
+
+
+def _genesis():
+    return Block(0, [{"sender": "ICO", "recipient": "GENESIS_WALLET", "amount": 1000000}], "0",
+                 timestamp=BASE_TIMESTAMP, difficulty=0)
+
+
+def _chain(params, blocks, salt=0, base=None):
+    key = (params['seed'], params['txs_per_block'], params['difficulty'], blocks, salt, base)
+    if key not in _chains:
+        start = _chains[base] if base else [_genesis()]
+        # Forks spend from the same funded wallets; the salt alone makes their blocks differ
+        data = SyntheticData(params['seed'], params['wallets'])
+        _chains[key] = data.extend_chain(start, blocks - len(start) + 1, params['txs_per_block'],
+                                         params['difficulty'], salt=salt)
+    return key, _chains[key]
+
+
+def _funded_node(data, balance=5000):
+    blockchain = Blockchain(storage=MemoryStorage())
+    for private_key, public_key in data.wallets:
+        blockchain.create_wallet(public_key, private_key)
+        blockchain.update_balance("GENESIS_WALLET", public_key, balance)
+    return blockchain
+
+
+def _unsigned_transactions(count):
+    return [{"sender": f"sender-{i}", "recipient": f"recipient-{i}", "amount": i, "signature": "0" * 88}
+            for i in range(count)]
+
+
+@scenario("ingest")
+def ingest(params, repeat):
+    """validate_and_process_transaction: server-side signing, verification and admission per call."""
+    data = SyntheticData(params['seed'], params['wallets'])
+    blockchain = _funded_node(data)
+    sample = Sample()
+    for round_ in range(repeat):
+        for i in range(params['transactions']):
+            private_key, public_key = data.wallets[data.rng.randrange(len(data.wallets))]
+            sample.timed(blockchain.validate_and_process_transaction,
+                         public_key, f"ingest-{round_}-{i}", 1, private_key)
+    return sample
+
+
+@scenario("ingest_batch")
+def ingest_batch(params, repeat):
+    """submit_transactions with client-signed batches; ops are transactions."""
+    data = SyntheticData(params['seed'], params['wallets'])
+    blockchain = _funded_node(data)
+    size = params['batch_size']
+    sample = Sample()
+    for round_ in range(repeat):
+        transactions = data.transactions(params['transactions'], prefix=f"batch-{round_}")
+        for start in range(0, len(transactions), size):
+            batch = transactions[start:start + size]
+            results, admitted = sample.timed(blockchain.submit_transactions, batch, ops=len(batch))
+            if len(admitted) != len(batch):
+                raise RuntimeError(f"Batch admission failed: {results}")
+    return sample
+
+
+@scenario("mining")
+def mining(params, repeat):
+    """Block.mine (single process) at the configured difficulty; ops are blocks."""
+    pool = SyntheticData(params['seed'], params['wallets']).transaction_pool(params['txs_per_block'])
+    sample = Sample()
+    previous_hash = _genesis().hash()
+    for i in range(repeat * params['mine_blocks']):
+        block = Block(i + 1, pool, previous_hash, timestamp=BASE_TIMESTAMP + i + 1)
+        sample.timed(block.mine, params['difficulty'])
+        previous_hash = block.hash()
+    return sample
+
+
+@scenario("miner")
+def miner(params, repeat):
+    """The multi-process Miner used by Blockchain.mine; ops are blocks."""
+    pool = SyntheticData(params['seed'], params['wallets']).transaction_pool(params['txs_per_block'])
+    engine = Miner()
+    sample = Sample()
+    try:
+        previous_hash = _genesis().hash()
+        for i in range(repeat * params['mine_blocks']):
+            block = Block(i + 1, pool, previous_hash, timestamp=BASE_TIMESTAMP + i + 1)
+            sample.timed(engine.mine, block, params['difficulty'])
+            previous_hash = block.hash()
+        sample.extra["workers"] = engine.workers
+    finally:
+        engine.shutdown()
+    return sample
+
+
+@scenario("merkle_build")
+def merkle_build(params, repeat):
+    """MerkleTree construction; ops are leaves."""
+    transactions = _unsigned_transactions(params['merkle_size'])
+    sample = Sample()
+    for _ in range(repeat):
+        sample.timed(MerkleTree, transactions, ops=len(transactions))
+    return sample
+
+
+@scenario("merkle_proof")
+def merkle_proof(params, repeat):
+    """Inclusion proof generation and verification for every leaf; ops are proofs."""
+    tree = MerkleTree(_unsigned_transactions(params['merkle_size']))
+
+    def prove_all():
+        for index, leaf in enumerate(tree.levels[0]):
+            if not MerkleTree.verify_proof(leaf, tree.get_proof(index), tree.root):
+                raise RuntimeError(f"Proof for leaf {index} does not verify")
+
+    sample = Sample()
+    for _ in range(repeat):
+        sample.timed(prove_all, ops=len(tree.levels[0]))
+    return sample
+
+
+@scenario("validation")
+def validation(params, repeat):
+    """ChainValidator.validate over the whole synthetic chain; ops are blocks."""
+    _, chain = _chain(params, params['blocks'])
+    validator = ChainValidator()
+    sample = Sample()
+    for _ in range(repeat):
+        if not sample.timed(validator.validate, chain, 1, ops=len(chain) - 1):
+            raise RuntimeError(f"Synthetic chain failed validation: {validator.last_report}")
+    return sample
+
+
+@scenario("replace_chain")
+def replace_chain(params, repeat):
+    """Blockchain.replace_chain for a reorg of ``reorg_depth`` blocks; ops are replaced blocks."""
+    shared_height = max(1, params['blocks'] - params['reorg_depth'])
+    shared_key, _ = _chain(params, shared_height)
+    _, ours = _chain(params, params['blocks'], salt=1, base=shared_key)
+    _, theirs = _chain(params, params['blocks'] + 1, salt=2, base=shared_key)
+    sample = Sample()
+    for _ in range(repeat):
+        blockchain = Blockchain(storage=MemoryStorage(ours))
+        if not sample.timed(blockchain.replace_chain, theirs, ops=len(theirs) - shared_height - 1):
+            raise RuntimeError("Reorg chain was rejected")
+    sample.extra["reorg_depth"] = len(ours) - shared_height - 1
+    return sample
+
+
+@scenario("sync")
+def sync(params, repeat):
+    """P2PNetwork.handle_chain_response on a node that has only genesis; ops are blocks."""
+    _, chain = _chain(params, params['blocks'])
+    chain_data = [block.to_dict() for block in chain]
+    sample = Sample()
+    for _ in range(repeat):
+        blockchain = Blockchain(storage=MemoryStorage(chain[:1]))
+        network = P2PNetwork(blockchain=blockchain)
+        sample.timed(asyncio.run, network.handle_chain_response(chain_data), ops=len(chain) - 1)
+        if blockchain.snapshot().height != len(chain) - 1:
+            raise RuntimeError("Synced chain was rejected")
+    return sample
+
+
+@scenario("restart")
+def restart(params, repeat):
+    """Blockchain start-up on a log storage directory holding the synthetic chain; ops are blocks."""
+    _, chain = _chain(params, params['blocks'])
+    directory = tempfile.mkdtemp(prefix="bench-storage-")
+    try:
+        storage = LogStorage(directory)
+        storage.save_blocks(chain)
+        storage.close()
+        sample = Sample()
+        for _ in range(repeat):
+            storage = LogStorage(directory)
+            blockchain = sample.timed(Blockchain, storage, ops=len(chain))
+            if blockchain.snapshot().height != len(chain) - 1:
+                raise RuntimeError("Restarted node lost blocks")
+            sample.extra["blocks_in_memory"] = len(blockchain.chain.recent)
+            storage.close()
+        return sample
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,92 @@
+import base64
+import random
+from Crypto.Signature import eddsa
+from blockchain.block import Block
+from blockchain.transaction import Transaction
+from cryptolib.crypto import Crypto, ED25519_PREFIX
+
+
+# Fixed so that chains built from the same seed hash identically run after run
+BASE_TIMESTAMP = 1700000000.0
+
+
+class SyntheticData:
+    """
+    Deterministic wallets, transactions and chains for benchmarks.
+
+    Wallet keys are derived from ``seed``, so the same parameters always produce
+    the same transactions and block hashes. Chains fund every wallet with its
+    on-chain grant before any transfer, so they pass full validation, balances
+    included. The signatures, Merkle roots and proofs of work are all real.
+    """
+
+    def __init__(self, seed=0, wallets=100):
+        self.rng = random.Random(seed)
+        self.wallets = [self._keypair() for _ in range(wallets)]
+        self._signatures = {}
+
+    def _keypair(self):
+        seed = bytes(self.rng.getrandbits(8) for _ in range(32))
+        key = eddsa.import_private_key(seed)
+        private_key = ED25519_PREFIX + base64.b64encode(seed).decode('utf-8')
+        public_key = ED25519_PREFIX + base64.b64encode(key.public_key().export_key(format='raw')).decode('utf-8')
+        return private_key, public_key
+
+    def transaction(self, sender, recipient, amount, nonce=None):
+        """A signed transfer from wallet ``sender`` (an index) to ``recipient`` (an address)."""
+        private_key, public_key = self.wallets[sender]
+        transaction = Transaction(public_key, recipient, amount, None, nonce).to_dict()
+        key = (sender, recipient, amount, nonce)
+        signature = self._signatures.get(key)
+        if signature is None:
+            signature = Crypto.sign_transaction(private_key, Transaction.signing_message(transaction))
+            self._signatures[key] = signature
+        transaction['signature'] = signature
+        return transaction
+
+    def grant(self, index):
+        """The signed grant of wallet ``index``'s initial funds."""
+        private_key, public_key = self.wallets[index]
+        return Transaction.grant(public_key, private_key)
+
+    def transactions(self, count, amount=1, prefix="recipient"):
+        """``count`` distinct signed transfers from random wallets to fresh recipients."""
+        return [
+            self.transaction(self.rng.randrange(len(self.wallets)), f"{prefix}-{i}", amount)
+            for i in range(count)
+        ]
+
+    def transfer(self, k):
+        """
+        Transfer ``k`` of a fixed schedule: 1 from wallet ``k % wallets``, with nonce ``k`` so
+        no two transfers share an id. Each round of ``wallets`` transfers has every wallet
+        send and receive once, so transfers 0 to n never cost a wallet more than 1.
+        """
+        sender = k % len(self.wallets)
+        recipient = self.wallets[(sender + 1 + k // len(self.wallets)) % len(self.wallets)][1]
+        return self.transaction(sender, recipient, 1, nonce=k)
+
+    def transaction_pool(self, size):
+        """The first ``size`` scheduled transfers, rounded up to whole rounds."""
+        size = -(-size // len(self.wallets)) * len(self.wallets)
+        return [self.transfer(k) for k in range(size)]
+
+    def extend_chain(self, chain, blocks, txs_per_block, difficulty, salt=0):
+        """
+        Return ``chain`` plus ``blocks`` mined blocks of ``txs_per_block`` transfers each.
+        On a bare genesis block the first new block also carries every wallet's grant.
+        Block ``h`` carries the scheduled transfers from ``(h - 1) * txs_per_block``, so a
+        chain never confirms a transaction twice. ``salt`` shifts timestamps so two
+        extensions of the same chain fork.
+        """
+        grants = [self.grant(i) for i in range(len(self.wallets))] if len(chain) == 1 else []
+        chain = list(chain)
+        for _ in range(blocks):
+            first = (len(chain) - 1) * txs_per_block
+            transactions = grants + [self.transfer(k) for k in range(first, first + txs_per_block)]
+            grants = []
+            block = Block(len(chain), transactions, chain[-1].hash(),
+                          timestamp=BASE_TIMESTAMP + len(chain) + salt / 1000.0, difficulty=difficulty)
+            block.mine(difficulty)
+            chain.append(block)
+        return chain
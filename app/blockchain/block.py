@@ -1,16 +1,43 @@
 import time
 from cryptolib.crypto import Crypto
 from blockchain.merkle_tree import MerkleTree
+from blockchain.miner import search_nonce, difficulty_target, MINING_DIFFICULTY
+
+
+def _header_field(name):
+    """Property for a hashed header field; assigning it drops the cached hash."""
+    attr = '_' + name
+
+    def get(self):
+        return getattr(self, attr)
+
+    def set(self, value):
+        setattr(self, attr, value)
+        self._hash = None
+    return property(get, set)
 
 
 class Block:
-    def __init__(self, index, transactions, previous_hash, timestamp=None, nonce=0, merkle_root=None):
+    # Fixed attribute slots instead of a per-instance __dict__ keep long chains small in memory
+    __slots__ = ('_index', '_timestamp', '_previous_hash', '_nonce', '_merkle_root',
+                 'transactions', 'difficulty', '_hash')
+
+    index = _header_field('index')
+    timestamp = _header_field('timestamp')
+    previous_hash = _header_field('previous_hash')
+    nonce = _header_field('nonce')
+    merkle_root = _header_field('merkle_root')
+
+    def __init__(self, index, transactions, previous_hash, timestamp=None, nonce=0, merkle_root=None,
+                 difficulty=MINING_DIFFICULTY):
+        self._hash = None
         self.index = index
         self.transactions = self._prepare_transactions(transactions)
         self.timestamp = timestamp or time.time()
         self.previous_hash = previous_hash
         self.nonce = nonce
         self.merkle_root = merkle_root or self.calculate_merkle_root()
+        self.difficulty = difficulty
 
     def _prepare_transactions(self, transactions):
         if isinstance(transactions, list):
@@ -21,20 +48,30 @@ class Block:
         merkle_tree = MerkleTree(self.transactions)
         return merkle_tree.root
 
-    def hash(self):
-        data = (
+    def header_prefix(self):
+        """Header fields hashed before the nonce."""
+        return (
             str(self.index)
             + str(self.merkle_root)
             + str(self.timestamp)
             + str(self.previous_hash)
-            + str(self.nonce)
         )
-        return Crypto.hash(data)
 
-    def mine(self, difficulty=4):
-        target = '0' * difficulty
-        while not self.hash().startswith(target):
-            self.nonce += 1
+    def hash(self):
+        """Header hash, computed once and cached until a header field changes."""
+        if self._hash is None:
+            self._hash = Crypto.hash(self.header_prefix() + str(self.nonce))
+        return self._hash
+
+    def has_valid_proof(self):
+        """Whether the hash meets the block's stored difficulty."""
+        return int(self.hash(), 16) < difficulty_target(self.difficulty)
+
+    def mine(self, difficulty=MINING_DIFFICULTY):
+        """Single-process nonce search. Blockchain.mine uses the multi-core Miner instead."""
+        nonce, _ = search_nonce(self.header_prefix().encode('utf-8'), difficulty_target(difficulty), self.nonce, 1)
+        self.difficulty = difficulty
+        self.nonce = nonce
 
     def to_dict(self):
         return {
@@ -43,9 +80,27 @@ class Block:
             "timestamp": self.timestamp,
             "previous_hash": self.previous_hash,
             "nonce": self.nonce,
-            "merkle_root": self.merkle_root
+            "merkle_root": self.merkle_root,
+            "difficulty": self.difficulty
         }
 
+    def header(self):
+        """Block fields without the transaction bodies."""
+        header = self.to_dict()
+        del header["transactions"]
+        return header
+
+    def header_only(self):
+        """Body-less copy that shares the cached hash, for keeping old blocks in memory cheaply."""
+        header = Block.from_header(self.header())
+        header._hash = self._hash
+        return header
+
+    @classmethod
+    def from_header(cls, header):
+        """Body-less block for checking header hashes and links during sync."""
+        return cls.from_dict({**header, "transactions": []})
+
     @classmethod
     def from_dict(cls, block_data):
         return cls(
@@ -54,6 +109,6 @@ class Block:
             previous_hash=block_data['previous_hash'],
             timestamp=block_data['timestamp'],
             nonce=block_data['nonce'],
-            merkle_root=block_data.get('merkle_root')
+            merkle_root=block_data.get('merkle_root'),
+            difficulty=block_data.get('difficulty', MINING_DIFFICULTY)
         )
-
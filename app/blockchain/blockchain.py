@@ -1,180 +1,833 @@
+import itertools
+import logging
+import os
+from collections import ChainMap
+import metrics
 from blockchain.block import Block
-from blockchain.transaction import Transaction
+from blockchain.chain_store import ChainStore
+from blockchain.mempool import Mempool, MAX_BLOCK_TRANSACTIONS
+from blockchain.merkle_tree import MerkleTree
+from blockchain.miner import Miner, MINING_DIFFICULTY
+from blockchain.state_engine import StateEngine, Snapshot, serialized, LayeredMap
+from blockchain.transaction import Transaction, GRANT_SENDER, WALLET_GRANT, new_nonce
+from blockchain.tx_index import TransactionIndex, split_ref
+from blockchain.validation import ChainValidator
 from cryptolib.crypto import Crypto
-from database.couchdb_handler import CouchDBHandler
+from database.storage import create_storage
 
 
+logger = logging.getLogger(__name__)
 
+# Number of wallet delta documents written before balances are checkpointed in full
+WALLET_CHECKPOINT_INTERVAL = int(os.getenv('WALLET_CHECKPOINT_INTERVAL', 500))
+# Every this many blocks a balance snapshot is kept so reorgs replay from the fork, not genesis
+CHAIN_CHECKPOINT_INTERVAL = int(os.getenv('CHAIN_CHECKPOINT_INTERVAL', 100))
+CHAIN_CHECKPOINT_RETAIN = int(os.getenv('CHAIN_CHECKPOINT_RETAIN', 20))
+GENESIS_WALLETS = {"GENESIS_WALLET": 1000000}
+
+TX_ADMISSION_SECONDS = metrics.histogram(
+    'blockchain_tx_admission_seconds', 'Time to sign or verify and admit submitted transactions', ('kind',))
+TRANSACTIONS_ADMITTED = metrics.counter('blockchain_transactions_admitted_total', 'Transactions admitted to the mempool')
+SAVE_STATE_SECONDS = metrics.histogram('blockchain_save_state_seconds', 'Time to queue a full state save')
 
 
 class Blockchain:
-    def __init__(self):
-        self.couchdb = CouchDBHandler()
-        self.chain = []
-        self.pending_transactions = []
+    """
+    Chain, balances and mempool of this node.
+
+    Every mutation runs on the state engine's single writer thread (methods marked
+    ``@serialized``); readers use ``snapshot()``, an immutable view published after
+    each batch of writes, and never take a lock.
+
+    ``chain`` is a ``ChainStore``: every header, but only recent blocks in full.
+    ``tx_index`` locates confirmed transactions by id and by address, holding only
+    recent blocks' entries in memory and asking storage for the rest.
+
+    ``storage`` is any ``database.storage.Storage``; by default the backend named by
+    ``STORAGE_BACKEND``.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage if storage is not None else create_storage()
+        self.miner = Miner()
+        self.validator = ChainValidator()
+        self.chain = ChainStore(self.storage)
+        self.mempool = Mempool()
         self.wallets = {}
+        # Addresses whose balance changed in place since the last snapshot
+        self._changed_wallets = set()
+        self.wallet_seq = 0
+        self.checkpoints = {}
+        # Block hash -> height for the current chain
+        self.block_index = {}
+        self.tx_index = TransactionIndex(self.storage)
+        self.engine = StateEngine(self._publish_snapshot)
+        self._snapshot = None
+        self._snapshot_sources = (None, 0, None, None)
         self.load_state()
-        self.ico_funds = {"GENESIS_WALLET": 1000000}
-      
+        self._publish_snapshot()
+        self.engine.start()
+
+    def snapshot(self):
+        """The latest published state. Consistent and immutable; safe to read from any thread."""
+        return self._snapshot
+
+    def _publish_snapshot(self):
+        """Publish the current state, copying only the parts that changed since the last snapshot."""
+        headers, chain_length, wallets, mempool_version = self._snapshot_sources
+        previous = self._snapshot
+        # Holding the source objects (not their ids) means a replaced chain or balance dict is never mistaken for the old one
+        if previous is None or headers is not self.chain.headers or chain_length != len(self.chain.headers):
+            chain_view = self.chain.view()
+        else:
+            chain_view = previous.chain
+        if previous is None or wallets is not self.wallets:
+            wallets_view = LayeredMap(self.wallets)
+        else:
+            # Only the changed balances are copied; the rest is shared with earlier snapshots
+            changes = {address: self.wallets[address] for address in self._changed_wallets}
+            wallets_view = previous.wallets.updated(changes)
+        self._changed_wallets.clear()
+        if previous is None or mempool_version != self.mempool.version:
+            pending_view = tuple(self.mempool)
+        else:
+            pending_view = previous.pending_transactions
+        self._snapshot_sources = (self.chain.headers, len(self.chain.headers), self.wallets, self.mempool.version)
+        # A single reference assignment, so readers see either the old snapshot or the new one
+        self._snapshot = Snapshot(chain_view, wallets_view, pending_view, (previous.version + 1) if previous else 0)
+
 
     def create_genesis_block(self):
         ico_transactions = [{"sender": "ICO", "recipient": "GENESIS_WALLET", "amount": 1000000}]
-        return Block(0, ico_transactions, "0")
+        return Block(0, ico_transactions, "0", difficulty=0)
 
+    @serialized
     def save_state(self):
-        blockchain_state = {
-            "chain": [block.to_dict() for block in self.chain],
-            "pending_transactions": self.pending_transactions,
-            "wallets": self.wallets
-        }
-        self.couchdb.save_blockchain_state(blockchain_state)
+        """
+        Write the mempool and balances in full. Normal mutations persist only what
+        they change; blocks are saved as they are connected.
+        """
+        with SAVE_STATE_SECONDS.time():
+            self.storage.replace_pending_transactions(list(self.mempool.items()))
+            self._checkpoint_wallets()
 
     def load_state(self):
-        state = self.couchdb.load_blockchain_state()
-        if state:
-            self.chain = [Block.from_dict(block_data) for block_data in state.get("chain", [])]
-            self.pending_transactions = state.get("pending_transactions", [])
-            self.wallets = state.get('wallets', {"GENESIS_WALLET": 1000000})
-            print("Blockchain state loaded from CouchDB")
+        legacy_state = self.storage.load_legacy_state()
+        if legacy_state:
+            self._migrate_legacy_state(legacy_state)
+            return
+
+        # Only headers are loaded; block bodies stay in storage until something reads them
+        headers = self.storage.load_headers()
+        if headers:
+            self.chain.reset([Block.from_header(header) for header in headers])
+            self._load_mempool(self.storage.load_pending_transactions())
+            self._load_checkpoints()
+            self.wallet_seq, wallets = self.storage.load_wallets()
+            if wallets is None:
+                # No balance documents: resume from the latest checkpoint and replay the blocks after it
+                height, wallets = self._checkpoint_at_or_below(self.chain.height)
+                self.wallets = wallets
+                self._replay_blocks(self.chain.view()[height + 1:])
+                self._checkpoint_wallets()
+            else:
+                self.wallets = wallets
+            self._index_blocks(0)
+            self._load_tx_index()
+            self._evict_unaffordable(self._pending_addresses())
+            logger.info("Blockchain state loaded from storage (height %d)", self.chain.height)
         else:
-            self.chain = [self.create_genesis_block()]
-            self.pending_transactions = []
-            self.wallets = {"GENESIS_WALLET": 1000000}
-            print("Initialized new blockchain with genesis block")
+            genesis = self.create_genesis_block()
+            self.storage.save_block(genesis)
+            self._connect_block(genesis)
+            self.mempool.clear()
+            self.wallets = dict(GENESIS_WALLETS)
+            self.save_state()
+            logger.info("Initialized new blockchain with genesis block")
+
+    def _migrate_legacy_state(self, state):
+        """Convert the old single ``blockchain_state`` document into per-block/per-entry documents."""
+        blocks = [Block.from_dict(block_data) for block_data in state.get("chain", [])]
+        if not blocks:
+            blocks = [self.create_genesis_block()]
+        self.storage.save_blocks(blocks)
+        for block in blocks:
+            self._connect_block(block)
+        self._load_mempool(state.get("pending_transactions", []))
+        self.wallets = state.get('wallets', dict(GENESIS_WALLETS))
+        self.save_state()
+        self.storage.delete_legacy_state()
+        logger.info("Migrated legacy blockchain state (%d blocks) to the incremental layout", len(blocks))
+
+    def _index_blocks(self, start):
+        for header in self.chain.headers[start:]:
+            self.block_index[header.hash()] = header.index
 
+    def _load_tx_index(self):
+        """
+        Resume the stored transaction index where it still matches the chain: only its
+        recent records are read, and only blocks it is missing or stale for are indexed.
+        """
+        indexed = self._indexed_height()
+        if indexed < self.storage.tx_index_height():
+            self.storage.delete_tx_index_from(indexed + 1)
+        self.tx_index.reset(indexed, self.storage.load_tx_index(max(0, indexed + 1 - self.tx_index.window)))
+        if indexed < self.chain.height:
+            logger.info("Indexing transactions of blocks %d to %d.", indexed + 1, self.chain.height)
+            for block in self.chain.view()[indexed + 1:]:
+                self.tx_index.connect(block)
 
-    def create_wallet(self, public_key):
+    def _indexed_height(self):
         """
-        Create a new wallet and allocate initial funds from the ICO.
+        The highest height whose stored index record matches our chain, or -1. Records
+        are rewritten from a fork up, like blocks, so the matching ones form a prefix.
         """
-        if self.ico_funds["GENESIS_WALLET"] >= 10:
-            if public_key not in self.wallets:
-                self.wallets[public_key] = 10  
-                self.ico_funds["GENESIS_WALLET"] -= 10  
-                print(f"Created wallet {public_key} with 10 coins. Remaining ICO funds: {self.ico_funds['GENESIS_WALLET']}")
-                self.save_state()  
+        low, high = 0, min(self.storage.tx_index_height(), self.chain.height) + 1
+        while low < high:
+            mid = (low + high) // 2
+            if self.storage.tx_index_hash(mid) == self.chain.headers[mid].hash():
+                low = mid + 1
             else:
-                print("Wallet already exists.")
+                high = mid
+        return low - 1
+
+    def _connect_block(self, block):
+        """Append ``block``, already stored, to the chain and index it."""
+        self.chain.append(block)
+        self.block_index[block.hash()] = block.index
+        self.tx_index.connect(block)
+
+    def _disconnect_from(self, height):
+        """Remove heights ``height`` and above from the chain and its indexes, tip first."""
+        blocks = list(reversed(self.chain.view()[height:]))
+        for block in blocks:
+            self.block_index.pop(block.hash(), None)
+        self.tx_index.disconnect_from(height, blocks)
+        self.chain.truncate(height)
+
+    @staticmethod
+    def create_block_from_dict(block_data):
+        return Block.from_dict(block_data)
+
+    def block_locator(self):
+        """
+        Hashes from our tip back to genesis: the last 10 blocks one by one, then
+        with a doubling step, so a peer can find the fork point in O(log n) entries.
+        """
+        snapshot = self.snapshot()
+        chain = snapshot.chain
+        locator = []
+        height = snapshot.height
+        step = 1
+        while height > 0:
+            locator.append(chain.header(height).hash())
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        locator.append(chain.header(0).hash())
+        return locator
+
+    def find_fork_height(self, locator):
+        """Height of the first locator hash that is on our chain, or -1 if none is."""
+        chain = self.snapshot().chain
+        for block_hash in locator:
+            height = self._height_of(block_hash, chain)
+            if height is not None:
+                return height
+        return -1
+
+    def get_headers(self, start, limit):
+        return [header.header() for header in self.snapshot().chain[start:start + limit].headers()]
+
+    def get_blocks(self, start, end):
+        return [block.to_dict() for block in self.snapshot().chain[start:end]]
+
+    def get_block(self, height):
+        snapshot = self.snapshot()
+        if 0 <= height <= snapshot.height:
+            return snapshot.chain[height]
+        return None
+
+    def get_block_by_hash(self, block_hash):
+        chain = self.snapshot().chain
+        height = self._height_of(block_hash, chain)
+        return None if height is None else chain[height]
+
+    def _height_of(self, block_hash, chain):
+        """Height of ``block_hash`` in ``chain``; the index is shared with the writer, so confirm the hit."""
+        height = self.block_index.get(block_hash)
+        if height is None or height >= len(chain) or chain.header(height).hash() != block_hash:
+            return None
+        return height
+
+    def _load_checkpoints(self):
+        """Keep only stored checkpoints that still match a block of the loaded chain."""
+        self.checkpoints = {
+            height: checkpoint
+            for height, checkpoint in self.storage.load_chain_checkpoints().items()
+            if height <= self.chain.height and self.chain.headers[height].hash() == checkpoint["hash"]
+        }
+
+    def _maybe_checkpoint_chain(self, block):
+        if block.index == 0 or block.index % CHAIN_CHECKPOINT_INTERVAL:
+            return
+        block_hash = block.hash()
+        self.checkpoints[block.index] = {"hash": block_hash, "wallets": dict(self.wallets)}
+        self.storage.save_chain_checkpoint(block.index, block_hash, self.wallets)
+        while len(self.checkpoints) > CHAIN_CHECKPOINT_RETAIN:
+            oldest = next(iter(self.checkpoints))
+            del self.checkpoints[oldest]
+            self.storage.delete_chain_checkpoint(oldest)
+
+    def _checkpoint_at_or_below(self, height):
+        """Latest checkpoint at or below ``height`` that is part of our chain, as ``(height, wallets)``."""
+        for checkpoint_height in reversed(list(self.checkpoints)):
+            checkpoint = self.checkpoints[checkpoint_height]
+            if checkpoint_height <= height and self.chain.headers[checkpoint_height].hash() == checkpoint["hash"]:
+                return checkpoint_height, dict(checkpoint["wallets"])
+        return 0, dict(GENESIS_WALLETS)
+
+    def _replay_blocks(self, blocks):
+        """Apply blocks to the in-memory balances, taking checkpoints along the way."""
+        for block in blocks:
+            for tx_data in block.transactions:
+                self._process_transaction_in_block(tx_data['sender'], tx_data['recipient'], tx_data['amount'])
+            self._maybe_checkpoint_chain(block)
+
+    def _load_mempool(self, transactions):
+        self.mempool.clear()
+        for transaction in transactions:
+            self.mempool.add(transaction)
+
+    @property
+    def pending_transactions(self):
+        """Pending transactions in arrival order, as of the latest snapshot."""
+        return list(self.snapshot().pending_transactions)
+
+    def _record_wallet_deltas(self, deltas):
+        """Persist a balance change as a delta, checkpointing full balances every so often."""
+        if not deltas:
+            return
+        self.wallet_seq += 1
+        if self.wallet_seq % WALLET_CHECKPOINT_INTERVAL == 0:
+            self._checkpoint_wallets()
         else:
+            self.storage.save_wallet_delta(self.wallet_seq, deltas)
+
+    def _checkpoint_wallets(self):
+        self.storage.save_wallet_checkpoint(self.wallet_seq, self.wallets)
+
+
+    def create_wallet(self, public_key, private_key):
+        """
+        Allocate a new wallet's initial funds from the ICO. The grant is a transfer
+        from the genesis allocation signed by the new wallet, pending until it is
+        mined like any other. Returns it, or None if the wallet already exists.
+        """
+        return self._admit_grant(Transaction.grant(public_key, private_key))
+
+    @serialized
+    def _admit_grant(self, grant):
+        public_key = grant['recipient']
+        if self._wallet_known(public_key):
+            logger.debug("Wallet %s already exists.", public_key)
+            return None
+        if self._ico_funds() < grant['amount']:
             raise ValueError("ICO funds depleted")
+        if not self.add_transaction(grant):
+            raise ValueError("Mempool full")
+        logger.debug("Granted wallet %s %s coins. Remaining ICO funds: %s", public_key, grant['amount'], self._ico_funds())
+        return grant
+
+    def _wallet_known(self, address):
+        return address in self.wallets or self.mempool.pending_grant(address) is not None
+
+    def _ico_funds(self):
+        return self.wallets.get(GRANT_SENDER, 0) - self.mempool.pending_spend(GRANT_SENDER)
+
+    def ico_funds(self):
+        """Genesis allocation left for wallet grants, net of pending ones."""
+        return self.snapshot().wallets.get(GRANT_SENDER, 0) - self.mempool.pending_spend(GRANT_SENDER)
+
+    def _grant_admissible(self, grant):
+        return isinstance(grant.get('recipient'), str) and grant.get('amount') == WALLET_GRANT \
+            and not self._wallet_known(grant['recipient']) and self._ico_funds() >= grant['amount']
+
+    def _admissible(self, transaction):
+        """Whether a transaction may join the pool: well formed and affordable on top of what is pending."""
+        if Transaction.is_grant(transaction):
+            return self._grant_admissible(transaction)
+        return self._transaction_fields_error(transaction) is None \
+            and self._spendable(transaction['sender']) >= transaction['amount']
+
+    def _available(self, address):
+        """What pending transactions from ``address`` may spend: its balance plus a pending grant."""
+        grant = self.mempool.pending_grant(address)
+        return self.wallets.get(address, 0) + (0 if grant is None else grant['amount'])
+
+    def _spendable(self, address):
+        """Confirmed balance plus a pending grant, less what pending transactions already spend."""
+        return self._available(address) - self.mempool.pending_spend(address)
+
+    def _pending_addresses(self):
+        """Every address whose balance pending transactions depend on."""
+        return {tx['recipient'] if Transaction.is_grant(tx) else tx['sender'] for tx in self.mempool}
+
+    def _evict_unaffordable(self, addresses):
+        """
+        Drop pending transactions that could no longer all be mined, after ``addresses``
+        lost funds or a pending grant: grants to wallets the chain now knows, grants
+        beyond the ICO funds, then each address's newest transfers until the rest are
+        covered. Returns the dropped ids.
+        """
+        addresses = set(addresses)
+        dropped = []
+        for address in addresses:
+            grant = self.mempool.pending_grant(address)
+            # A wallet is funded once, before anything else reaches it
+            if grant is not None and address in self.wallets:
+                dropped.append(Transaction.compute_id(grant))
+        self.mempool.remove(dropped)
+        for tx_id in self.mempool.over_budget(GRANT_SENDER, self.wallets.get(GRANT_SENDER, 0)):
+            addresses.add(self.mempool.get(tx_id)['recipient'])
+            dropped.extend(self.mempool.remove([tx_id]))
+        for address in addresses:
+            dropped.extend(self.mempool.remove(self.mempool.over_budget(address, self._available(address))))
+        if dropped:
+            self.storage.delete_pending_transactions(dropped)
+            logger.info("Evicted %d pending transactions that can no longer be mined.", len(dropped))
+        return dropped
 
     def get_balance(self, wallet_address):
-        return self.wallets.get(wallet_address, 0)
+        return self.snapshot().wallets.get(wallet_address, 0)
 
     def add_transaction(self, transaction):
-        """Add a transaction to the pending transaction pool."""
-        self.pending_transactions.append(transaction)
-        self.save_state()
+        """Add a transaction to the pending transaction pool. Returns False if it was not admitted."""
+        return self.add_pending_transactions([transaction]) == 1
+
+    @serialized
+    def add_pending_transactions(self, transactions):
+        """
+        Add signature-checked transactions to the pool, skipping ones already pending or
+        confirmed, malformed ones and any the sender cannot afford on top of what is
+        already pending. Returns how many were added.
+        """
+        added = []
+        evicted = []
+        tx_ids = [Transaction.compute_id(transaction) for transaction in transactions]
+        confirmed = self.tx_index.locate_all(tx_ids)
+        for tx_id, transaction in zip(tx_ids, transactions):
+            # A confirmed transaction resubmitted would still verify (legacy ones carry no nonce at all)
+            if tx_id in confirmed or not self._admissible(transaction):
+                continue
+            tx_id, dropped = self.mempool.add(transaction, tx_id)
+            evicted.extend(dropped)
+            if tx_id is not None:
+                added.append((tx_id, transaction))
+        self.storage.save_pending_transactions(added)
+        TRANSACTIONS_ADMITTED.inc(amount=len(added))
+        if evicted:
+            self.storage.delete_pending_transactions([tx_id for tx_id, _ in evicted])
+            # Transfers may spend a grant that was evicted to make room
+            self._evict_unaffordable(tx['recipient'] for _, tx in evicted if Transaction.is_grant(tx))
+        return len(added)
+
+
+    def _is_confirmed(self, tx_id):
+        return self.tx_index.locate(tx_id) is not None
+
+    def _confirmed_below(self, height):
+        """For validating a fork at ``height``: which of some txids our chain confirms below it."""
+        def confirmed(tx_ids):
+            return {tx_id for tx_id, (confirmed_at, _) in self.tx_index.locate_all(tx_ids).items()
+                    if confirmed_at < height}
+        return confirmed
 
-        
     def validate_and_process_transaction(self, sender, recipient, amount, private_key):
-        message = f"{sender}{recipient}{amount}"
-        signature = Crypto.sign_transaction(private_key, message)
+        with TX_ADMISSION_SECONDS.time("single"):
+            transaction = Transaction(sender, recipient, amount, None, nonce=new_nonce())
+            message = Transaction.signing_message(transaction.to_dict())
+            transaction.signature = Crypto.sign_transaction(private_key, message)
 
-        if not Crypto.verify_signature(sender, message, signature):
-            raise ValueError("Invalid signature")
+            if not Crypto.verify_signature(sender, message, transaction.signature):
+                raise ValueError("Invalid signature")
 
-        if self.get_balance(sender) < amount:
-            raise ValueError("Insufficient funds")
+            return self._admit_transaction(transaction)
 
-        transaction = Transaction(sender, recipient, amount, signature)
-        self.add_transaction(transaction.to_dict())
+    @serialized
+    def _admit_transaction(self, transaction):
+        """Balance check and admission in one write, so concurrent spends cannot both pass the check."""
+        if self._is_confirmed(Transaction.compute_id(transaction.to_dict())):
+            raise ValueError("Transaction already confirmed")
+        if self._spendable(transaction.sender) < transaction.amount:
+            raise ValueError("Insufficient funds")
+        if not self.add_transaction(transaction.to_dict()):
+            raise ValueError("Transaction already pending or mempool full")
         return transaction
 
+    def submit_transactions(self, transactions, atomic=False):
+        """
+        Admit a batch of client-signed transactions. Signatures are verified together
+        before the write; balance checks (counting earlier transfers of the same batch)
+        and admission are a single write, persisted once. With ``atomic`` nothing is
+        admitted unless every transaction is.
+
+        Returns ``(results, admitted)``: a result dict per transaction, in order, and the
+        admitted transactions.
+        """
+        with TX_ADMISSION_SECONDS.time("batch"):
+            return self._submit_transactions(transactions, atomic)
+
+    def _submit_transactions(self, transactions, atomic):
+        candidates = []
+        errors = []
+        for data in transactions:
+            error = self._transaction_fields_error(data)
+            errors.append(error)
+            candidates.append(None if error else Transaction(
+                data['sender'], data['recipient'], data['amount'], data['signature'], data.get('nonce')).to_dict())
+        checked = [i for i, transaction in enumerate(candidates) if transaction is not None]
+        verified = self.verify_transactions([candidates[i] for i in checked])
+        for i, ok in zip(checked, verified):
+            if not ok:
+                errors[i] = "Invalid signature"
+        return self._admit_batch(candidates, errors, atomic)
+
+    @staticmethod
+    def _transaction_fields_error(data):
+        if not isinstance(data, dict):
+            return "Transaction must be an object"
+        for field in ('sender', 'recipient', 'signature'):
+            if not isinstance(data.get(field), str) or not data[field]:
+                return f"Missing or invalid {field}"
+        if data['sender'] in ("ICO", GRANT_SENDER):
+            return f"{data['sender']} transactions cannot be submitted"
+        amount = data.get('amount')
+        # Written so that NaN fails too
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not amount > 0:
+            return "Amount must be a positive number"
+        nonce = data.get('nonce')
+        if nonce is not None and (isinstance(nonce, bool) or not isinstance(nonce, int) or nonce < 0):
+            return "Nonce must be a non-negative integer"
+        return None
+
+    @serialized
+    def _admit_batch(self, transactions, errors, atomic):
+        spent = {}
+        tx_ids = {}
+        errors = list(errors)
+        candidate_ids = [None if error else Transaction.compute_id(transaction)
+                         for transaction, error in zip(transactions, errors)]
+        confirmed = self.tx_index.locate_all([tx_id for tx_id in candidate_ids if tx_id is not None])
+        for i, transaction in enumerate(transactions):
+            if errors[i] is not None:
+                continue
+            tx_id = candidate_ids[i]
+            sender = transaction['sender']
+            spending = spent.get(sender, 0) + transaction['amount']
+            if tx_id in tx_ids or tx_id in self.mempool:
+                errors[i] = "Transaction already pending"
+            elif tx_id in confirmed:
+                errors[i] = "Transaction already confirmed"
+            elif self._spendable(sender) < spending:
+                errors[i] = "Insufficient funds"
+            elif not self.mempool.has_room(len(tx_ids) + 1):
+                errors[i] = "Mempool full"
+            else:
+                spent[sender] = spending
+                tx_ids[tx_id] = i
+
+        if atomic and len(tx_ids) < len(transactions):
+            errors = [error or "Batch rejected: another transaction failed" for error in errors]
+            tx_ids = {}
+        admitted = [transactions[i] for i in tx_ids.values()]
+        if admitted:
+            self.add_pending_transactions(admitted)
 
+        results = [{"index": i, "status": "rejected", "error": error} for i, error in enumerate(errors)]
+        for tx_id, i in tx_ids.items():
+            results[i] = {"index": i, "status": "accepted", "txid": tx_id}
+        return results, admitted
+
+
+    def _confirmed_block(self, snapshot, height):
+        """The block an index entry points at, or None if the entry is newer than ``snapshot``."""
+        return snapshot.chain[height] if height <= snapshot.height else None
+
+    def find_transaction(self, tx_id):
+        """A confirmed transaction with its location, a pending one, or None."""
+        snapshot = self.snapshot()
+        location = self.tx_index.locate(tx_id)
+        if location is not None:
+            height, position = location
+            block = self._confirmed_block(snapshot, height)
+            # The index is updated by the writer; make sure the entry matches this snapshot's block
+            if block is not None and position < len(block.transactions) \
+                    and Transaction.compute_id(block.transactions[position]) == tx_id:
+                return self._confirmed_entry(snapshot, block, position, tx_id)
+        transaction = self.mempool.get(tx_id)
+        if transaction is not None:
+            return {"txid": tx_id, "status": "pending", "transaction": transaction}
+        return None
+
+    @staticmethod
+    def _confirmed_entry(snapshot, block, position, tx_id):
+        return {
+            "txid": tx_id,
+            "status": "confirmed",
+            "block_index": block.index,
+            "block_hash": block.hash(),
+            "position": position,
+            "timestamp": block.timestamp,
+            "confirmations": snapshot.height - block.index + 1,
+            "transaction": block.transactions[position],
+        }
+
+    def address_history(self, address, limit, before=None):
+        """
+        Confirmed transactions sent or received by ``address``, newest first, at most
+        ``limit`` of them. ``next`` in the result is the ``before`` cursor of the next page.
+        """
+        snapshot = self.snapshot()
+        refs, total, cursor = self.tx_index.history(address, limit, before)
+        transactions = []
+        for ref in refs:
+            height, position = split_ref(ref)
+            block = self._confirmed_block(snapshot, height)
+            if block is None or position >= len(block.transactions):
+                continue
+            transaction = block.transactions[position]
+            if address not in (transaction['sender'], transaction['recipient']):
+                continue
+            transactions.append(self._confirmed_entry(
+                snapshot, block, position, Transaction.compute_id(transaction)))
+        return {
+            "address": address,
+            "total": total,
+            "transactions": transactions,
+            "next": cursor,
+        }
+
+    def get_transaction_proof(self, tx_id):
+        """Merkle inclusion proof for a confirmed transaction, or None if it is not on the chain."""
+        snapshot = self.snapshot()
+        location = self.tx_index.locate(tx_id)
+        block = None if location is None else self._confirmed_block(snapshot, location[0])
+        if block is not None:
+            tree = MerkleTree(block.transactions)
+            if tx_id not in tree.levels[0]:
+                return None
+            if tree.root != block.merkle_root:
+                raise ValueError("Block predates canonical Merkle roots; no proof available")
+            position = tree.levels[0].index(tx_id)
+            return {
+                "txid": tx_id,
+                "block_index": block.index,
+                "block_hash": block.hash(),
+                "merkle_root": block.merkle_root,
+                "position": position,
+                "proof": tree.get_proof(position),
+            }
+        return None
+
+    @staticmethod
+    def verify_transactions(transactions):
+        """
+        Check transaction signatures in one batch; returns a bool per transaction.
+        ICO allocations are unsigned and belong only in the genesis block, so they never pass.
+        """
+        signed = [tx for tx in transactions if tx.get('sender') != "ICO"]
+        verified = iter(Crypto.verify_batch(
+            (Transaction.signer(tx), Transaction.signing_message(tx), tx.get('signature', ''))
+            for tx in signed
+        ))
+        return [tx.get('sender') != "ICO" and next(verified) for tx in transactions]
+
+    @serialized
     def update_balance(self, sender, recipient, amount):
         if self.wallets.get(sender, 0) >= amount:
-            self.wallets[sender] -= amount
-            self.wallets[recipient] = self.wallets.get(recipient, 0) + amount
-            print(f"Transferred {amount} from {sender} to {recipient}")
-            self.save_state()
+            self._process_transaction_in_block(sender, recipient, amount)
+            logger.debug("Transferred %s from %s to %s", amount, sender, recipient)
+            self._record_wallet_deltas(self._transfer_deltas([(sender, recipient, amount)]))
         else:
             raise ValueError("Insufficient funds")
 
     def mine(self):
-        if not self.pending_transactions:
+        """
+        Mine a block of pending transactions. The proof-of-work search runs on the
+        calling thread against a snapshot; only appending the result is a write.
+        """
+        snapshot = self.snapshot()
+        template = self.block_template(snapshot)
+        if not template:
             return None
+        new_block = Block(snapshot.height + 1, template, snapshot.chain.header(-1).hash())
+        if not self.miner.mine(new_block, difficulty=MINING_DIFFICULTY):
+            return None
+        return self._append_mined_block(new_block)
+
+    def block_template(self, snapshot=None):
+        """
+        Pending transactions in arrival order, grants first, up to a block's worth,
+        skipping any the chain could not apply after the ones before them (the
+        validator's balance rules). Grants go first because transfers may spend them
+        and a wallet that has received a transfer can no longer be granted funds.
+        """
+        snapshot = snapshot or self.snapshot()
+        balances = ChainMap({}, snapshot.wallets)
+        template = []
+        pending = snapshot.pending_transactions
+        for transaction in itertools.chain((tx for tx in pending if Transaction.is_grant(tx)),
+                                           (tx for tx in pending if not Transaction.is_grant(tx))):
+            if ChainValidator.transfer_error(transaction, balances) is not None:
+                continue
+            ChainValidator.apply_transfer(transaction, balances)
+            template.append(transaction)
+            if len(template) >= MAX_BLOCK_TRANSACTIONS:
+                break
+        return template
 
-        new_block = Block(len(self.chain), self.pending_transactions, self.chain[-1].hash())
-        new_block.mine(difficulty=4)
-        self.chain.append(new_block)
+    @serialized
+    def _append_mined_block(self, new_block):
+        if new_block.previous_hash != self.chain.tip_hash:
+            logger.info("Discarding mined block %d: chain tip changed while mining.", new_block.index)
+            return None
+        self.storage.save_block(new_block)
+        self._connect_block(new_block)
         # Process transactions in the block
-        for tx_data in self.pending_transactions:
-            sender = tx_data['sender']
-            recipient = tx_data['recipient']
-            amount = tx_data['amount']
-            self._process_transaction_in_block(sender, recipient, amount)
-        self.pending_transactions = []
-        self.save_state()
+        self._apply_block_transactions(new_block)
+        self._remove_pending_transactions(new_block.transactions)
 
         return new_block
 
+    def _remove_pending_transactions(self, transactions):
+        """Drop a connected block's transactions from the pool, then whatever it left unaffordable."""
+        removed = self.mempool.remove_transactions(transactions)
+        self.storage.delete_pending_transactions(removed)
+        self._evict_unaffordable({tx['sender'] for tx in transactions} | {tx['recipient'] for tx in transactions})
+
     def _process_transaction_in_block(self, sender, recipient, amount):
-        self.wallets[sender] -= amount
+        self.wallets[sender] = self.wallets.get(sender, 0) - amount
         self.wallets[recipient] = self.wallets.get(recipient, 0) + amount
+        self._changed_wallets.add(sender)
+        self._changed_wallets.add(recipient)
 
+    def _apply_block_transactions(self, block):
+        """Apply a block's transfers to the wallets and persist them as one delta."""
+        transfers = [(tx['sender'], tx['recipient'], tx['amount']) for tx in block.transactions]
+        for sender, recipient, amount in transfers:
+            self._process_transaction_in_block(sender, recipient, amount)
+        self._record_wallet_deltas(self._transfer_deltas(transfers))
+        self._maybe_checkpoint_chain(block)
 
-    def sync_chain(self, incoming_chain):
-        new_chain = [Block(**block) for block in incoming_chain]
-        if len(new_chain) > len(self.chain):
-            self.chain = new_chain
-            self.save_state()
-            print("Blockchain synchronized with a longer chain from peer.")
+    @staticmethod
+    def _transfer_deltas(transfers):
+        deltas = {}
+        for sender, recipient, amount in transfers:
+            deltas[sender] = deltas.get(sender, 0) - amount
+            deltas[recipient] = deltas.get(recipient, 0) + amount
+        return {address: delta for address, delta in deltas.items() if delta}
+
+
+    def _fork_index(self, new_chain, start=0):
+        """
+        Return the first height at which ``new_chain`` (blocks from height ``start``)
+        differs from the local chain. Each header commits to its predecessor, so
+        matching hashes form a prefix and the fork point can be found by binary search.
+        """
+        low, high = start, min(self.chain.height + 1, start + len(new_chain))
+        while low < high:
+            mid = (low + high) // 2
+            if self.chain.headers[mid].hash() == new_chain[mid - start].hash():
+                low = mid + 1
+            else:
+                high = mid
+        return low
 
     def is_valid_new_block(self, new_block, previous_block):
         if previous_block.index + 1 != new_block.index:
             return False
         elif previous_block.hash() != new_block.previous_hash:
             return False
-        elif new_block.hash() != new_block.hash():
+        elif new_block.difficulty < MINING_DIFFICULTY or not new_block.has_valid_proof():
+            return False
+        elif new_block.merkle_root != new_block.calculate_merkle_root():
             return False
         else:
             return True
 
-    def is_valid_chain(self, chain):
-        for i in range(1, len(chain)):
-            current_block = chain[i]
-            previous_block = chain[i - 1]
-            if current_block.previous_hash != previous_block.hash():
-                return False
-            if current_block.hash() != current_block.hash():
-                return False
-        return True
-
-    def replace_chain(self, new_chain):
-        if len(new_chain) > len(self.chain) and self.is_valid_chain(new_chain):
-            self.chain = new_chain
-            # Recompute balances
-            self.wallets = {"GENESIS_WALLET": 1000000}
-            for block in self.chain[1:]:  # Skip genesis block
-                for tx_data in block.transactions:
-                    sender = tx_data['sender']
-                    recipient = tx_data['recipient']
-                    amount = tx_data['amount']
-                    self._process_transaction_in_block(sender, recipient, amount)
-            self.pending_transactions = []
-            self.save_state()
-            print("Chain replaced with the longer valid chain.")
+    def is_valid_chain(self, chain, start=1, balances=None, confirmed=None):
+        """Full validation (proof of work, Merkle roots, signatures, links, replays, balances) of ``chain[start:]``."""
+        return self.validator.validate(chain, start, balances, confirmed)
+
+    @serialized
+    def replace_chain(self, new_chain, start=0):
+        """
+        Adopt the chain made of our blocks below ``start`` followed by ``new_chain``
+        if it is longer and valid from the fork point. Runs on the writer: other
+        writes wait for the validation, snapshot reads do not.
+        """
+        if start > self.chain.height + 1 or start + len(new_chain) <= self.chain.height + 1:
+            return False
+        fork_index = self._fork_index(new_chain, start)
+        # Balances at the fork: nearest checkpoint plus our blocks after it
+        base_height, base_wallets = self._checkpoint_at_or_below(fork_index - 1)
+        fork_wallets = dict(base_wallets)
+        ChainValidator.replay_balances(self.chain.view()[base_height + 1:fork_index], fork_wallets)
+        # Blocks below the fork are ours and already valid; the validator only needs their headers
+        candidate = self.chain.headers[:fork_index] + list(new_chain[fork_index - start:])
+        if self.is_valid_chain(candidate, start=fork_index, balances=fork_wallets,
+                               confirmed=self._confirmed_below(fork_index)):
+            new_blocks = candidate[fork_index:]
+            orphaned = [tx for block in self.chain.view()[fork_index:] for tx in block.transactions]
+            # Stored first: replaying may evict new blocks from memory and read them back
+            self.storage.save_blocks(new_blocks)
+            # Recompute balances from the nearest checkpoint shared with the new chain
+            self.wallets = base_wallets
+            for height in [h for h in self.checkpoints if h > base_height]:
+                del self.checkpoints[height]
+            self._disconnect_from(fork_index)
+            for block in new_blocks:
+                self._connect_block(block)
+            self._replay_blocks(self.chain.view()[base_height + 1:])
+            logger.info("Replayed %d blocks from checkpoint at height %d.", self.chain.height - base_height, base_height)
+            # Drop what the new chain confirmed and put our orphaned transactions back in the pool
+            self.mempool.remove_transactions([tx for block in new_blocks for tx in block.transactions])
+            # The index now covers the new chain, so this also leaves out anything confirmed below the fork
+            orphaned = [(Transaction.compute_id(tx), tx) for tx in orphaned if tx.get('sender') != "ICO"]
+            confirmed = self.tx_index.locate_all([tx_id for tx_id, _ in orphaned])
+            self.mempool.reinject([tx for tx_id, tx in orphaned if tx_id not in confirmed])
+            # Balances were replayed, so any pending transaction may have lost its funding
+            self._evict_unaffordable(self._pending_addresses())
+            self.storage.replace_pending_transactions(list(self.mempool.items()))
+            self._checkpoint_wallets()
+            logger.info("Chain replaced with the longer valid chain (height %d).", self.chain.height)
             return True
         return False
 
 
-    
+
+    @serialized
     def add_block(self, block):
-        if self.is_valid_new_block(block, self.chain[-1]):
-            self.chain.append(block)
+        """
+        Connect a peer's block on top of our tip. Signatures are checked by the caller;
+        balances are checked here, as full chain validation does.
+        """
+        if self.is_valid_new_block(block, self.chain.headers[-1]):
+            # Replay onto an overlay so a rejected block leaves the balances untouched
+            error = ChainValidator.replayed_transaction([block], self.tx_index.locate_all) \
+                or ChainValidator.replay_balances([block], ChainMap({}, self.wallets), check=True)
+            if error is not None:
+                logger.warning("Rejected block %d: %s", block.index, error[1])
+                return False
+            self.storage.save_block(block)
+            self._connect_block(block)
             # Process transactions in the block
-            for tx_data in block.transactions:
-                sender = tx_data['sender']
-                recipient = tx_data['recipient']
-                amount = tx_data['amount']
-                self._process_transaction_in_block(sender, recipient, amount)
-            self.pending_transactions = [
-                tx for tx in self.pending_transactions if tx not in block.transactions
-            ]
-            self.save_state()
+            self._apply_block_transactions(block)
+            self._remove_pending_transactions(block.transactions)
+            # A peer beat us to this height; stop searching for our own block
+            self.miner.cancel(height=block.index)
             return True
         else:
             return False
 
-   
\ No newline at end of file
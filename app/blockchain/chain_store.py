@@ -0,0 +1,184 @@
+import os
+import threading
+from collections import OrderedDict
+import metrics
+from blockchain.block import Block
+
+
+# Most recent blocks kept in memory in full; older heights keep only their header
+CHAIN_WINDOW = int(os.getenv('CHAIN_WINDOW', 1000))
+# Bound on older block bodies held after being loaded from storage
+BLOCK_CACHE_BYTES = int(os.getenv('BLOCK_CACHE_BYTES', 64 * 1024 * 1024))
+# Approximate in-memory size of a block and of each of its transactions, so the cache need not measure objects
+BLOCK_BASE_BYTES = 1000
+TRANSACTION_BYTES = 600
+
+BLOCK_READS = metrics.counter('chain_block_reads_total', 'Full block lookups by where the block was found', ('source',))
+
+
+def block_size(block):
+    return BLOCK_BASE_BYTES + TRANSACTION_BYTES * len(block.transactions)
+
+
+class BlockCache:
+    """Least recently used blocks by hash, bounded by their estimated size. Safe to use from any thread."""
+
+    def __init__(self, max_bytes=BLOCK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, block_hash):
+        with self._lock:
+            block = self._blocks.get(block_hash)
+            if block is not None:
+                self._blocks.move_to_end(block_hash)
+            return block
+
+    def put(self, block_hash, block):
+        size = block_size(block)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if block_hash in self._blocks:
+                self._blocks.move_to_end(block_hash)
+                return
+            self._blocks[block_hash] = block
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.bytes -= block_size(evicted)
+
+
+class ChainStore:
+    """
+    The active chain with bounded memory: a body-less header per height, the full
+    blocks of the last ``window`` heights, and older bodies loaded from ``storage``
+    on demand through a ``BlockCache``.
+
+    Only the state writer mutates it. Readers get an immutable ``ChainView`` from
+    ``view()``: appends land past the end of every existing view, and truncation
+    replaces the header list rather than editing it. Blocks must be in storage
+    before they can leave the window and the cache.
+    """
+
+    def __init__(self, storage, window=CHAIN_WINDOW, cache_bytes=BLOCK_CACHE_BYTES):
+        self.storage = storage
+        self.window = max(1, window)
+        self.headers = []
+        # Hash -> full block for the last ``window`` heights
+        self.recent = {}
+        self.cache = BlockCache(cache_bytes)
+
+    @property
+    def height(self):
+        return len(self.headers) - 1
+
+    @property
+    def tip(self):
+        return self.block(self.height)
+
+    @property
+    def tip_hash(self):
+        return self.headers[-1].hash()
+
+    def block(self, height, header=None):
+        """
+        Full block at ``height``. ``header`` pins the expected block, for views of
+        a chain the writer has since reorganized away from.
+        """
+        block_hash = (header or self.headers[height]).hash()
+        block = self.recent.get(block_hash)
+        if block is not None:
+            BLOCK_READS.inc("window")
+            return block
+        block = self.cache.get(block_hash)
+        if block is not None:
+            BLOCK_READS.inc("cache")
+            return block
+        data = self.storage.load_block(height)
+        block = None if data is None else Block.from_dict(data)
+        if block is None or block.hash() != block_hash:
+            raise LookupError(f"Block {height} ({block_hash}) is no longer stored")
+        BLOCK_READS.inc("storage")
+        self.cache.put(block_hash, block)
+        return block
+
+    def append(self, block):
+        self.headers.append(block.header_only())
+        self.recent[block.hash()] = block
+        leaving = len(self.headers) - 1 - self.window
+        if leaving >= 0:
+            leaving_hash = self.headers[leaving].hash()
+            evicted = self.recent.pop(leaving_hash, None)
+            if evicted is not None:
+                self.cache.put(leaving_hash, evicted)
+
+    def truncate(self, height):
+        """Drop heights ``height`` and above. Their bodies move to the cache for views still reading them."""
+        for header in self.headers[height:]:
+            block = self.recent.pop(header.hash(), None)
+            if block is not None:
+                self.cache.put(header.hash(), block)
+        self.headers = self.headers[:height]
+
+    def reset(self, headers):
+        """Start over from body-less ``headers`` loaded from storage."""
+        self.headers = list(headers)
+        self.recent = {}
+
+    def view(self):
+        return ChainView(self, self.headers, 0, len(self.headers))
+
+
+class ChainView:
+    """
+    Immutable sequence of the blocks of one chain state, as published in
+    snapshots. Indexing and iteration load full blocks on demand; ``header`` never
+    touches block bodies. Slices are views as well.
+    """
+    __slots__ = ('_store', '_headers', '_start', '_stop')
+
+    def __init__(self, store, headers, start, stop):
+        self._store = store
+        self._headers = headers
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _height(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chain index out of range")
+        return self._start + index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return ChainView(self._store, self._headers, self._start + start, self._start + max(start, stop))
+        height = self._height(index)
+        return self._store.block(height, self._headers[height])
+
+    def __iter__(self):
+        for height in range(self._start, self._stop):
+            yield self._store.block(height, self._headers[height])
+
+    def __reversed__(self):
+        for height in range(self._stop - 1, self._start - 1, -1):
+            yield self._store.block(height, self._headers[height])
+
+    def header(self, index):
+        """Body-less block at ``index``."""
+        return self._headers[self._height(index)]
+
+    def headers(self):
+        return self._headers[self._start:self._stop]
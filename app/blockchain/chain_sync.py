@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+from blockchain.block import Block
+from blockchain.merkle_tree import MerkleTree
+
+
+logger = logging.getLogger(__name__)
+
+
+# Headers returned per GET_HEADERS request
+SYNC_MAX_HEADERS = int(os.getenv('SYNC_MAX_HEADERS', 2000))
+# Blocks per GET_BLOCKS range request
+SYNC_RANGE_SIZE = int(os.getenv('SYNC_RANGE_SIZE', 100))
+# Seconds to wait for a peer to answer a sync request
+SYNC_TIMEOUT = float(os.getenv('SYNC_TIMEOUT', 30))
+
+
+class ChainSync:
+    """
+    Headers-first chain synchronization.
+
+    1. Send our block locator to one peer (GET_HEADERS); it answers with the
+       headers that follow the newest locator hash it shares with us.
+    2. Check the headers link up and, if they describe a longer chain, fetch
+       the bodies in bounded ranges (GET_BLOCKS), spread over all peers with
+       the header peer as the fallback for ranges others cannot serve.
+    3. Hand the downloaded blocks and their start height to
+       ``Blockchain.replace_chain``, which splices them onto our chain at the
+       fork point and validates them in full.
+
+    Only the divergent suffix is transferred and held in memory.
+    """
+
+    def __init__(self, network):
+        self.network = network
+        self._requests = {}
+        self._task = None
+
+    @property
+    def blockchain(self):
+        return self.network.blockchain
+
+    def is_syncing(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, peer):
+        """Start a sync session against ``peer`` unless one is already running."""
+        if self.is_syncing():
+            return self._task
+        self._task = asyncio.ensure_future(self._run(peer))
+        return self._task
+
+    async def _request(self, peer, key, message):
+        future = asyncio.get_running_loop().create_future()
+        self._requests[(id(peer), key)] = future
+        try:
+            self.network.send_message(peer, message)
+            return await asyncio.wait_for(future, SYNC_TIMEOUT)
+        finally:
+            self._requests.pop((id(peer), key), None)
+
+    def _resolve(self, peer, key, value):
+        future = self._requests.get((id(peer), key))
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    # Requests we answer
+
+    async def handle_get_headers(self, data, peer):
+        limit = min(int(data.get('limit', SYNC_MAX_HEADERS)), SYNC_MAX_HEADERS)
+        start = self.blockchain.find_fork_height(data.get('locator', [])) + 1
+        self.network.send_message(peer, {
+            'type': 'HEADERS',
+            'start': start,
+            'tip_height': self.blockchain.snapshot().height,
+            'headers': self.blockchain.get_headers(start, limit),
+        })
+
+    async def handle_get_blocks(self, data, peer):
+        start = int(data['start'])
+        end = min(int(data['end']), start + SYNC_RANGE_SIZE)
+        self.network.send_message(peer, {
+            'type': 'BLOCKS',
+            'start': start,
+            'blocks': self.blockchain.get_blocks(start, end),
+        })
+
+    # Responses to our requests
+
+    def handle_headers(self, data, peer):
+        self._resolve(peer, 'headers', data)
+
+    def handle_blocks(self, data, peer):
+        self._resolve(peer, ('blocks', data['start']), data['blocks'])
+
+    async def _run(self, peer):
+        try:
+            start, headers = await self._fetch_headers(peer)
+            if start + len(headers) <= self.blockchain.snapshot().height + 1:
+                return
+            logger.info("Syncing %d blocks from height %d.", len(headers), start)
+            blocks = await self._fetch_blocks(peer, start, headers)
+            if blocks is None:
+                logger.warning("Sync aborted: could not download all block ranges.")
+                return
+            # replace_chain keeps our blocks below ``start`` and validates proof of work, signatures and balances of the rest
+            if await self.network._replace_chain(blocks, start):
+                logger.info("Blockchain synchronized with peer up to height %d.", start + len(blocks) - 1)
+        except asyncio.TimeoutError:
+            # Peers that predate headers-first sync only answer full-chain requests
+            logger.info("Peer did not answer header sync in time; requesting its full chain.")
+            self.network.send_message(peer, {'type': 'REQUEST_CHAIN'})
+        except Exception as e:
+            logger.warning("Sync failed: %s", e)
+
+    async def _fetch_headers(self, peer):
+        """Collect the peer's headers after the fork point, following up until its tip."""
+        locator = self.blockchain.block_locator()
+        headers = []
+        start = previous_hash = None
+        while True:
+            response = await self._request(peer, 'headers', {
+                'type': 'GET_HEADERS', 'locator': locator, 'limit': SYNC_MAX_HEADERS,
+            })
+            batch = [Block.from_header(header) for header in response['headers']]
+            if start is None:
+                start = response['start']
+                previous_hash = self.blockchain.snapshot().chain.header(start - 1).hash() if start > 0 else "0"
+            for header in batch:
+                if header.index != start + len(headers) or header.previous_hash != previous_hash:
+                    raise ValueError(f"Peer sent unlinked header at height {header.index}")
+                headers.append(header)
+                previous_hash = header.hash()
+            if not batch or start + len(headers) > response['tip_height']:
+                return start, headers
+            # Ask for the next batch, continuing from the last header received
+            locator = [headers[-1].hash()]
+
+    async def _fetch_blocks(self, header_peer, start, headers):
+        end = start + len(headers)
+        ranges = asyncio.Queue()
+        for range_start in range(start, end, SYNC_RANGE_SIZE):
+            ranges.put_nowait((range_start, min(range_start + SYNC_RANGE_SIZE, end)))
+        blocks = {}
+
+        async def download(peer, is_fallback):
+            while not ranges.empty():
+                range_start, range_end = ranges.get_nowait()
+                try:
+                    block_data = await self._request(peer, ('blocks', range_start), {
+                        'type': 'GET_BLOCKS', 'start': range_start, 'end': range_end,
+                    })
+                    blocks[range_start] = self._check_range(block_data, headers[range_start - start:range_end - start])
+                except (asyncio.TimeoutError, ValueError, KeyError) as e:
+                    ranges.put_nowait((range_start, range_end))
+                    if is_fallback:
+                        raise
+                    logger.warning("Peer could not serve blocks %d-%d: %s", range_start, range_end, e)
+                    return
+
+        peers = [p for p in self.network.peers if p is not header_peer]
+        try:
+            await asyncio.gather(download(header_peer, True), *(download(p, False) for p in peers))
+            # Ranges handed back by failing peers after the header peer ran out of work
+            await download(header_peer, True)
+        except (asyncio.TimeoutError, ValueError, KeyError):
+            return None
+        return [block for range_start in sorted(blocks) for block in blocks[range_start]]
+
+    @staticmethod
+    def _check_range(block_data, expected_headers):
+        blocks = [Block.from_dict(data) for data in block_data]
+        if len(blocks) != len(expected_headers):
+            raise ValueError("wrong number of blocks")
+        for block, header in zip(blocks, expected_headers):
+            if block.hash() != header.hash():
+                raise ValueError(f"block {block.index} does not match its header")
+            if block.merkle_root not in (block.calculate_merkle_root(), MerkleTree.legacy_root(block.transactions)):
+                raise ValueError(f"block {block.index} transactions do not match its merkle root")
+        return blocks
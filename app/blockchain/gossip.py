@@ -0,0 +1,65 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+
+# Recently seen relay frames and inventory ids remembered to drop duplicates
+GOSSIP_SEEN_CACHE_SIZE = int(os.getenv('GOSSIP_SEEN_CACHE_SIZE', 20000))
+# Recently announced messages kept to answer GETDATA
+GOSSIP_RELAY_CACHE_SIZE = int(os.getenv('GOSSIP_RELAY_CACHE_SIZE', 2000))
+# Inventory ids per INV message; larger announcements are split
+INV_MAX_ITEMS = int(os.getenv('INV_MAX_ITEMS', 1000))
+# Seconds before an unanswered GETDATA may be sent to another peer
+GETDATA_TIMEOUT = float(os.getenv('GETDATA_TIMEOUT', 10))
+
+# Message types carrying an object that is relayed with INV announcements
+RELAY_TYPES = ("TRANSACTION", "BLOCK")
+
+
+class LRUCache:
+    """Mapping that forgets its least recently used entries beyond ``max_size``."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._entries.pop(key, default)
+
+
+class SeenCache(LRUCache):
+    """Bounded set of recently seen keys."""
+
+    def add(self, key):
+        """Remember ``key``; returns False if it had already been seen."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return False
+        self.put(key, True)
+        return True
+
+
+def frame_id(frame):
+    """Digest of a raw frame, computed before it is parsed."""
+    if isinstance(frame, str):
+        frame = frame.encode('utf-8')
+    return hashlib.blake2b(frame, digest_size=16).digest()
+
@@ -0,0 +1,148 @@
+import os
+from collections import OrderedDict
+from blockchain.transaction import Transaction
+
+
+MEMPOOL_MAX_SIZE = int(os.getenv('MEMPOOL_MAX_SIZE', 50000))
+# "oldest" evicts the earliest transaction to make room, "reject" refuses new ones when full
+MEMPOOL_EVICTION = os.getenv('MEMPOOL_EVICTION', 'oldest')
+MAX_BLOCK_TRANSACTIONS = int(os.getenv('MAX_BLOCK_TRANSACTIONS', 1000))
+
+
+class Mempool:
+    """
+    Pending transactions keyed by transaction id, in arrival order.
+
+    A per-sender index tracks each sender's pending transactions, in admission
+    order, and the total amount they spend, so balance and double-spend checks
+    do not scan the pool.
+    Pending wallet grants are indexed by the wallet they fund.
+    """
+
+    def __init__(self, max_size=MEMPOOL_MAX_SIZE, eviction=MEMPOOL_EVICTION):
+        if eviction not in ("oldest", "reject"):
+            raise ValueError(f"Unknown mempool eviction policy {eviction!r}")
+        self.max_size = max_size
+        self.eviction = eviction
+        self._transactions = OrderedDict()
+        self._by_sender = {}
+        self._pending_spend = {}
+        self._grants = {}
+        # Bumped on every change so readers can tell whether a copy is stale
+        self.version = 0
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __contains__(self, tx_id):
+        return tx_id in self._transactions
+
+    def __iter__(self):
+        return iter(self._transactions.values())
+
+    def items(self):
+        return self._transactions.items()
+
+    def get(self, tx_id):
+        return self._transactions.get(tx_id)
+
+    def add(self, transaction, tx_id=None):
+        """
+        Admit a transaction. Returns ``(tx_id, evicted)``, ``evicted`` being the
+        ``(tx_id, transaction)`` pairs dropped to make room; ``tx_id`` is None if the
+        transaction was already pending or the pool is full under the "reject" policy.
+        """
+        tx_id = tx_id or Transaction.compute_id(transaction)
+        if tx_id in self._transactions:
+            return None, []
+        evicted = []
+        if len(self._transactions) >= self.max_size:
+            if self.eviction == "reject":
+                return None, []
+            oldest_id = next(iter(self._transactions))
+            evicted.append((oldest_id, self._discard(oldest_id)))
+        self._insert(tx_id, transaction)
+        return tx_id, evicted
+
+    def _insert(self, tx_id, transaction):
+        self.version += 1
+        self._transactions[tx_id] = transaction
+        sender = transaction.get('sender')
+        self._by_sender.setdefault(sender, {})[tx_id] = None
+        self._pending_spend[sender] = self._pending_spend.get(sender, 0) + transaction.get('amount', 0)
+        if Transaction.is_grant(transaction):
+            self._grants[transaction.get('recipient')] = tx_id
+
+    def _discard(self, tx_id):
+        transaction = self._transactions.pop(tx_id, None)
+        if transaction is None:
+            return None
+        self.version += 1
+        sender = transaction.get('sender')
+        sender_ids = self._by_sender.get(sender)
+        del sender_ids[tx_id]
+        if sender_ids:
+            self._pending_spend[sender] -= transaction.get('amount', 0)
+        else:
+            del self._by_sender[sender]
+            del self._pending_spend[sender]
+        if self._grants.get(transaction.get('recipient')) == tx_id:
+            del self._grants[transaction.get('recipient')]
+        return transaction
+
+    def remove(self, tx_ids):
+        """Remove transactions by id, returning the ids that were actually pending."""
+        return [tx_id for tx_id in tx_ids if self._discard(tx_id) is not None]
+
+    def remove_transactions(self, transactions):
+        """Remove the given transaction dicts (e.g. those confirmed in a block)."""
+        return self.remove(Transaction.compute_id(tx) for tx in transactions)
+
+    def reinject(self, transactions):
+        """Put transactions from orphaned blocks back at the front of the pool after a reorg."""
+        added = []
+        for transaction in reversed(transactions):
+            tx_id = Transaction.compute_id(transaction)
+            if tx_id in self._transactions:
+                continue
+            self._insert(tx_id, transaction)
+            self._transactions.move_to_end(tx_id, last=False)
+            added.append((tx_id, transaction))
+        # Reinjected transactions were accepted first, so newer arrivals make room for them
+        evicted = []
+        while len(self._transactions) > self.max_size:
+            newest_id = next(reversed(self._transactions))
+            self._discard(newest_id)
+            evicted.append(newest_id)
+        return added, evicted
+
+    def has_room(self, count=1):
+        """Whether ``count`` more transactions would be admitted without being refused."""
+        return self.eviction != "reject" or len(self._transactions) + count <= self.max_size
+
+    def pending_spend(self, sender):
+        """Total amount ``sender`` is already spending in pending transactions."""
+        return self._pending_spend.get(sender, 0)
+
+    def over_budget(self, sender, available):
+        """Ids of ``sender``'s newest pending transactions to drop so the rest spend at most ``available``."""
+        spend = self._pending_spend.get(sender, 0)
+        dropped = []
+        for tx_id in reversed(list(self._by_sender.get(sender, ()))):
+            if spend <= available:
+                break
+            spend -= self._transactions[tx_id].get('amount', 0)
+            dropped.append(tx_id)
+        return dropped
+
+    def pending_grant(self, address):
+        """The pending grant funding ``address``, or None."""
+        tx_id = self._grants.get(address)
+        return None if tx_id is None else self._transactions[tx_id]
+
+    def clear(self):
+        self.version += 1
+        self._transactions.clear()
+        self._by_sender.clear()
+        self._pending_spend.clear()
+        self._grants.clear()
@@ -1,17 +1,62 @@
 from cryptolib.crypto import Crypto
+from blockchain.transaction import Transaction
 
 class MerkleTree:
-    def __init__(self, transactions):
-        self.transactions = transactions
-        self.root = self.build_merkle_tree([Crypto.hash(str(tx)) for tx in transactions])
+    """
+    Merkle tree over transaction ids that keeps every level, so inclusion proofs
+    can be produced for any leaf. An odd node at the end of a level is paired
+    with itself.
+    """
 
-    def build_merkle_tree(self, hashes):
-        if len(hashes) == 1:
-            return hashes[0]
+    def __init__(self, transactions=()):
+        self.transactions = list(transactions)
+        self.levels = [[Transaction.compute_id(tx) for tx in self.transactions]]
+        while len(self.levels[-1]) > 1:
+            self.levels.append(self._parent_level(self.levels[-1]))
+
+    @staticmethod
+    def _parent_level(hashes):
         new_level = []
         for i in range(0, len(hashes), 2):
             left = hashes[i]
             right = hashes[i + 1] if i + 1 < len(hashes) else left
-            combined_hash = Crypto.hash(left + right)
-            new_level.append(combined_hash)
-        return self.build_merkle_tree(new_level)
+            new_level.append(Crypto.hash(left + right))
+        return new_level
+
+    @property
+    def root(self):
+        if not self.levels[0]:
+            return Crypto.hash("")
+        return self.levels[-1][0]
+
+    def get_proof(self, index):
+        """Sibling hashes from leaf ``index`` up to the root, each marked as the left or right operand."""
+        if not 0 <= index < len(self.levels[0]):
+            raise IndexError("Transaction index out of range")
+        proof = []
+        for nodes in self.levels[:-1]:
+            sibling = index ^ 1
+            sibling_hash = nodes[sibling] if sibling < len(nodes) else nodes[index]
+            proof.append({"hash": sibling_hash, "position": "right" if index % 2 == 0 else "left"})
+            index //= 2
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf_hash, proof, root):
+        current = leaf_hash
+        for step in proof:
+            if step["position"] == "right":
+                current = Crypto.hash(current + step["hash"])
+            else:
+                current = Crypto.hash(step["hash"] + current)
+        return current == root
+
+    @staticmethod
+    def legacy_root(transactions):
+        """Root as computed before canonical leaves (hash of ``str(tx)``), for blocks stored back then."""
+        hashes = [Crypto.hash(str(tx)) for tx in transactions]
+        if not hashes:
+            return Crypto.hash("")
+        while len(hashes) > 1:
+            hashes = MerkleTree._parent_level(hashes)
+        return hashes[0]
@@ -0,0 +1,207 @@
+import atexit
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+MINER_WORKERS = int(os.getenv('MINER_WORKERS', os.cpu_count() or 1))
+# Leading hex zeros required of a block hash; also assumed for stored blocks that predate the field
+MINING_DIFFICULTY = int(os.getenv('MINING_DIFFICULTY', 4))
+# Nonces tried between checks of the shared stop flag
+CANCEL_CHECK_INTERVAL = 20000
+# How often a search waiting for results checks that its workers are still alive
+WORKER_CHECK_SECONDS = float(os.getenv('MINER_WORKER_CHECK_SECONDS', 1))
+
+BLOCK_SECONDS = metrics.histogram('miner_block_seconds', 'Proof-of-work search time per mined block',
+                                  buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+HASHES = metrics.counter('miner_hashes_total', 'Nonces tried by the miner workers')
+
+
+def difficulty_target(difficulty):
+    """Numeric target equivalent to ``difficulty`` leading hex zeros in the block hash."""
+    return 1 << (256 - 4 * difficulty)
+
+
+def search_nonce(prefix, target, start, step, stop=None, limit=None):
+    """
+    Scan ``start, start + step, ...`` for a nonce whose header hash is below ``target``.
+
+    ``prefix`` is the encoded header without the nonce; its SHA-256 state is
+    computed once and copied for each attempt, so only the nonce bytes are
+    hashed per try. Returns ``(nonce or None, hashes_tried)``.
+    """
+    base = hashlib.sha256(prefix)
+    nonce = start
+    hashes = 0
+    while stop is None or not stop.is_set():
+        for _ in range(CANCEL_CHECK_INTERVAL):
+            h = base.copy()
+            h.update(str(nonce).encode())
+            hashes += 1
+            if int.from_bytes(h.digest(), 'big') < target:
+                return nonce, hashes
+            nonce += step
+            if limit is not None and hashes >= limit:
+                return None, hashes
+    return None, hashes
+
+
+def _worker_main(worker_id, jobs, results, stop):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, prefix, target, start, step = job
+        started = time.perf_counter()
+        nonce, hashes = search_nonce(prefix, target, start, step, stop=stop)
+        if nonce is not None:
+            stop.set()
+        results.put((job_id, worker_id, nonce, hashes, time.perf_counter() - started))
+
+
+class Miner:
+    """
+    Proof-of-work engine that splits the nonce space across worker processes.
+
+    Worker ``i`` of ``n`` tries nonces ``i, i + n, i + 2n, ...``. The first
+    worker to find a valid nonce sets a shared stop flag, which also lets
+    ``cancel()`` abort a search from another thread (e.g. when a peer's block
+    for the same height is accepted).
+    """
+
+    def __init__(self, workers=MINER_WORKERS):
+        self.workers = max(1, workers)
+        self._ctx = multiprocessing.get_context()
+        self._stop = self._ctx.Event()
+        self._results = self._ctx.Queue()
+        self._job_queues = []
+        self._processes = []
+        self._lock = threading.Lock()
+        self._job_id = 0
+        self._mining_height = None
+        self._cancelled = False
+        self.last_stats = []
+        self.total_hashes = 0
+        self.blocks_found = 0
+
+    def _ensure_workers(self):
+        if self._processes and all(process.is_alive() for process in self._processes):
+            return
+        self._stop_workers()
+        for worker_id in range(self.workers):
+            jobs = self._ctx.Queue()
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, jobs, self._results, self._stop),
+                name=f"miner-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self._job_queues.append(jobs)
+            self._processes.append(process)
+        atexit.register(self.shutdown)
+
+    def mine(self, block, difficulty=MINING_DIFFICULTY):
+        """Search for a nonce for ``block``. Sets ``block.nonce`` and returns True, or False if cancelled."""
+        with self._lock:
+            started = time.perf_counter()
+            self._ensure_workers()
+            self._job_id += 1
+            self._stop.clear()
+            self._cancelled = False
+            self._mining_height = block.index
+            prefix = block.header_prefix().encode('utf-8')
+            target = difficulty_target(difficulty)
+            for worker_id, jobs in enumerate(self._job_queues):
+                jobs.put((self._job_id, prefix, target, worker_id, self.workers))
+
+            found = None
+            stats = []
+            while len(stats) < self.workers:
+                try:
+                    job_id, worker_id, nonce, hashes, seconds = self._results.get(timeout=WORKER_CHECK_SECONDS)
+                except queue.Empty:
+                    if all(process.is_alive() for process in self._processes):
+                        continue
+                    # A dead worker never reports; fail this search and start a new pool next time
+                    logger.error("Miner worker died while mining block %d; restarting the workers.", block.index)
+                    self._mining_height = None
+                    self._stop_workers()
+                    return False
+                if job_id != self._job_id:
+                    continue
+                stats.append({
+                    "worker": worker_id,
+                    "hashes": hashes,
+                    "seconds": seconds,
+                    "hashrate": hashes / seconds if seconds else 0.0,
+                })
+                if nonce is not None and found is None:
+                    found = nonce
+            self._mining_height = None
+            self.last_stats = sorted(stats, key=lambda s: s["worker"])
+            self.total_hashes += sum(s["hashes"] for s in stats)
+            HASHES.inc(amount=sum(s["hashes"] for s in stats))
+
+            if found is None or self._cancelled:
+                logger.info("Mining of block %d cancelled.", block.index)
+                return False
+            block.difficulty = difficulty
+            block.nonce = found
+            self.blocks_found += 1
+            BLOCK_SECONDS.observe(time.perf_counter() - started)
+            logger.info("Mined block %d with nonce %d at %.0f H/s", block.index, found, self.hashrate())
+            return True
+
+    def cancel(self, height=None):
+        """Abort the running search, or only if it is for ``height`` when one is given."""
+        mining_height = self._mining_height
+        if mining_height is None:
+            return False
+        if height is not None and height != mining_height:
+            return False
+        self._cancelled = True
+        self._stop.set()
+        return True
+
+    def hashrate(self):
+        return sum(s["hashrate"] for s in self.last_stats)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "mining_height": self._mining_height,
+            "blocks_found": self.blocks_found,
+            "total_hashes": self.total_hashes,
+            "hashrate": self.hashrate(),
+            "per_worker": self.last_stats,
+        }
+
+    def _stop_workers(self):
+        """Terminate the worker pool. Queues are replaced, since a killed worker may have left one unusable."""
+        self._stop.set()
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join(timeout=1)
+        self._job_queues = []
+        self._processes = []
+        self._stop = self._ctx.Event()
+        self._results = self._ctx.Queue()
+
+    def shutdown(self):
+        self._stop.set()
+        for jobs in self._job_queues:
+            jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=1)
+        self._job_queues = []
+        self._processes = []
@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+# Finished jobs kept around for polling
+MAX_FINISHED_JOBS = 100
+# Seconds a continuous job sleeps when the mempool is empty
+IDLE_POLL_INTERVAL = 1.0
+
+
+class JobAlreadyRunning(ValueError):
+    def __init__(self, job):
+        super().__init__(f"Mining job {job.id} is already running")
+        self.job = job
+
+
+class MiningJob:
+    def __init__(self, continuous=False):
+        self.id = uuid.uuid4().hex
+        self.continuous = continuous
+        self.status = "running"
+        self.blocks = []
+        self.error = None
+        self.message = None
+        self.created = time.time()
+        self.finished = None
+        self.cancel_requested = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "continuous": self.continuous,
+            "blocks_mined": len(self.blocks),
+            "result": self.blocks[-1] if self.blocks else None,
+            "message": self.message,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class MiningJobManager:
+    """
+    Runs ``Blockchain.mine`` in a background thread so HTTP workers are not held
+    for the proof-of-work search. Only one job mines at a time; ``on_block`` is
+    called with each mined block (e.g. to broadcast it).
+    """
+
+    def __init__(self, blockchain, on_block=None):
+        self.blockchain = blockchain
+        self.on_block = on_block
+        self.jobs = OrderedDict()
+        self._active = None
+        self._lock = threading.Lock()
+
+    def start(self, continuous=False):
+        """Start a job and return it, or raise ``JobAlreadyRunning`` carrying the running job."""
+        with self._lock:
+            if self._active is not None:
+                raise JobAlreadyRunning(self._active)
+            job = MiningJob(continuous=continuous)
+            self.jobs[job.id] = job
+            self._active = job
+            self._trim()
+        threading.Thread(target=self._run, args=(job,), name=f"mining-job-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self):
+        """Running and recent jobs, oldest first; copied under the lock ``_trim`` holds."""
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.status == "running":
+            job.cancel_requested.set()
+            self.blockchain.miner.cancel()
+        return job
+
+    def _run(self, job):
+        try:
+            while True:
+                if job.cancel_requested.is_set():
+                    break
+                if not self.blockchain.block_template():
+                    if not job.continuous:
+                        job.message = "No transactions to mine"
+                        break
+                    job.cancel_requested.wait(IDLE_POLL_INTERVAL)
+                    continue
+                block = self.blockchain.mine()
+                if block is not None:
+                    job.blocks.append(block.to_dict())
+                    self._notify(block)
+                    if not job.continuous:
+                        break
+                elif not job.continuous and not job.cancel_requested.is_set():
+                    # Lost the race to a peer's block; retry on the new tip
+                    continue
+            job.status = "cancelled" if job.cancel_requested.is_set() else "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error("Mining job %s failed: %s", job.id, e)
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._active = None
+
+    def _notify(self, block):
+        if self.on_block is None:
+            return
+        try:
+            self.on_block(block)
+        except Exception as e:
+            logger.error("Error announcing mined block %d: %s", block.index, e)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status != "running"]
+        for job_id in finished[:max(0, len(self.jobs) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
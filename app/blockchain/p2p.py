@@ -1,10 +1,35 @@
 import threading
 import asyncio
 import json
+import logging
+import os
+import time
+import metrics
+from log import SampledLogger
 from blockchain.block import Block
+from blockchain.chain_sync import ChainSync
+from blockchain import gossip
+from blockchain.peer import Peer
 import websockets
 from blockchain.transaction import Transaction
 
+
+logger = logging.getLogger(__name__)
+# Per-message lines are sampled; at full rate they cost more than the messages
+sampled = SampledLogger(logger)
+
+# "deflate" negotiates permessage-deflate on the WebSocket handshake, "none" disables it
+P2P_COMPRESSION = os.getenv('P2P_COMPRESSION', 'deflate')
+
+MESSAGE_TYPES = (
+    'HELLO', 'INV', 'GETDATA', 'TRANSACTION', 'BLOCK', 'SYNC', 'PENDING_TRANSACTIONS',
+    'REQUEST_CHAIN', 'RESPONSE_CHAIN', 'REQUEST_PENDING_TRANSACTIONS', 'RESPONSE_PENDING_TRANSACTIONS',
+    'GET_HEADERS', 'HEADERS', 'GET_BLOCKS', 'BLOCKS',
+)
+MESSAGE_SECONDS = metrics.histogram('p2p_message_seconds', 'Time to handle an incoming P2P message', ('type',))
+DUPLICATE_FRAMES = metrics.counter('p2p_duplicate_frames_total', 'Relay frames dropped because they were already seen')
+
+
 class P2PNetwork:
     def __init__(self, host='0.0.0.0', port=5001, blockchain=None):
         self.host = host
@@ -13,6 +38,14 @@ class P2PNetwork:
         self.peers = []
         self.loop = None
         self.loop_ready = threading.Event()
+        self.sync = ChainSync(self)
+        # Raw relay frames and (kind, id) inventory already handled
+        self.seen_frames = gossip.SeenCache(gossip.GOSSIP_SEEN_CACHE_SIZE)
+        self.known_inventory = gossip.SeenCache(gossip.GOSSIP_SEEN_CACHE_SIZE)
+        # Messages we announced, kept to answer GETDATA
+        self.relay_cache = gossip.LRUCache(gossip.GOSSIP_RELAY_CACHE_SIZE)
+        # (kind, id) -> time a GETDATA for it was sent
+        self.requested_inventory = {}
 
     def start(self):
         """Start the WebSocket server in a separate event loop."""
@@ -21,161 +54,289 @@ class P2PNetwork:
 
         def run_server():
             asyncio.set_event_loop(self.loop)
-            start_server = websockets.serve(self.handle_connection, self.host, self.port)
+            start_server = websockets.serve(self.handle_connection, self.host, self.port,
+                                            compression=self._compression())
             self.loop.run_until_complete(start_server)
             self.loop_ready.set()  # Signal that the loop is ready
             self.loop.run_forever()
 
         threading.Thread(target=run_server, daemon=True).start()
-        print(f"P2P Network server started on {self.host}:{self.port}")
+        logger.info("P2P Network server started on %s:%d", self.host, self.port)
 
 
 
 
 
-    async def handle_connection(self, websocket, path):
+    @staticmethod
+    def _compression():
+        return None if P2P_COMPRESSION == 'none' else P2P_COMPRESSION
+
+    async def handle_connection(self, websocket, path=None):
         """Handle incoming connections from peers."""
-        self.peers.append(websocket)
+        peer = self._add_peer(websocket)
+        await self._read_loop(peer)
+
+    def _add_peer(self, websocket):
+        peer = Peer(websocket).start()
+        self.peers.append(peer)
+        self.send_hello(peer)
+        return peer
+
+    async def _read_loop(self, peer):
+        """Dispatch messages from a peer until it disconnects (inbound and outbound alike)."""
         try:
-            async for message in websocket:
-                await self.handle_message(message, websocket)
+            async for message in peer.websocket:
+                peer.bytes_received += len(message)
+                await self.handle_message(message, peer)
         except websockets.ConnectionClosed:
-            self.peers.remove(websocket)
+            pass
+        finally:
+            peer.close()
+            if peer in self.peers:
+                self.peers.remove(peer)
 
+    def send_hello(self, peer):
+        """Advertise the optional protocol features we support; peers that predate HELLO ignore it."""
+        peer.send(json.dumps({"type": "HELLO", "features": ["inv"]}))
 
-    async def handle_message(self, message, websocket):
-        """Handle incoming messages."""
+    def handle_hello(self, data, peer):
+        peer.supports_inv = "inv" in data.get('features', [])
 
+    def send_message(self, peer, data):
+        """Queue a message for one peer; never waits for the socket."""
+        peer.send(json.dumps(data))
+
+    def call_threadsafe(self, callback, *args):
+        """
+        Run a non-blocking network method such as ``broadcast_block`` on the P2P loop
+        from another thread (e.g. an HTTP handler) without waiting for it.
+        """
+        self.loop_ready.wait()
+        self.loop.call_soon_threadsafe(callback, *args)
+
+
+    async def handle_message(self, message, peer):
+        """Handle incoming messages."""
+        started = time.perf_counter()
+        msg_type = None
         try:
+            # Relayed objects arriving again from other peers are dropped before parsing
+            frame_id = gossip.frame_id(message)
+            if frame_id in self.seen_frames:
+                DUPLICATE_FRAMES.inc()
+                return
             data = json.loads(message)
             msg_type = data.get('type')
-            print(f"Received message of type {msg_type}")
-            if msg_type == 'TRANSACTION':
-                await self.handle_incoming_transaction(data['transaction'], websocket)
-            elif msg_type == 'BLOCK':
-                await self.handle_incoming_block(data['block'])
+            if msg_type in gossip.RELAY_TYPES:
+                self.seen_frames.add(frame_id)
+            sampled.debug("Received message of type %s", msg_type)
+            if msg_type == 'HELLO':
+                self.handle_hello(data, peer)
+            elif msg_type == 'INV':
+                await self.handle_inv(data['items'], peer)
+            elif msg_type == 'GETDATA':
+                await self.handle_getdata(data['items'], peer)
             elif msg_type == 'TRANSACTION':
-                await self.handle_incoming_transaction(data['transaction'])
-            elif msg_type == 'WALLET':
-                await self.handle_incoming_wallet(data['public_key'])
+                await self.handle_incoming_transaction(data['transaction'], peer)
+            elif msg_type == 'BLOCK':
+                await self.handle_incoming_block(data['block'], peer)
             elif msg_type == 'SYNC':
                 await self.handle_sync(data['chain'])
             elif msg_type == 'PENDING_TRANSACTIONS':
                 await self.handle_incoming_pending_transactions(data['transactions'])
             elif msg_type == 'REQUEST_CHAIN':
-                await self.handle_chain_request(websocket)
+                await self.handle_chain_request(peer)
             elif msg_type == 'RESPONSE_CHAIN':
                 await self.handle_chain_response(data['chain'])
             elif msg_type == 'REQUEST_PENDING_TRANSACTIONS':
-                await self.handle_pending_transactions_request(websocket)
+                await self.handle_pending_transactions_request(peer)
             elif msg_type == 'RESPONSE_PENDING_TRANSACTIONS':
                 await self.handle_incoming_pending_transactions(data['transactions'])
+            elif msg_type == 'GET_HEADERS':
+                await self.sync.handle_get_headers(data, peer)
+            elif msg_type == 'HEADERS':
+                self.sync.handle_headers(data, peer)
+            elif msg_type == 'GET_BLOCKS':
+                await self.sync.handle_get_blocks(data, peer)
+            elif msg_type == 'BLOCKS':
+                self.sync.handle_blocks(data, peer)
         except Exception as e:
-            print(f"Error handling message: {e}")
+            logger.warning("Error handling message: %s", e)
+        finally:
+            if msg_type is not None:
+                MESSAGE_SECONDS.observe(time.perf_counter() - started,
+                                        msg_type if msg_type in MESSAGE_TYPES else "other")
 
         
 
         
 
-    async def handle_incoming_block(self, block_data):
-        block = Block.from_dict(block_data)
-        if self.blockchain.add_block(block):
-            print("Block added to the chain.")
-            # Broadcast the block to peers
-            await self.broadcast_block(block.to_dict())
-        else:
-            print("Invalid block received. Requesting full chain sync.")
-            await self.request_full_chain()
+    async def _verify_transactions(self, transactions):
+        """Batch-verify signatures off the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.blockchain.verify_transactions, transactions)
 
+    async def _write(self, method, *args):
+        """Run a state-changing blockchain method on its writer thread without blocking the loop."""
+        return await asyncio.wrap_future(self.blockchain.engine.submit(method, *args))
 
+    async def _replace_chain(self, chain, start=0):
+        """Validate and adopt a chain on the writer; full validation of a long chain takes a while."""
+        return await self._write(self.blockchain.replace_chain, chain, start)
 
-    async def handle_incoming_transaction(self, transaction_data, websocket):
-        print(f"Received transaction: {transaction_data}")
-        if transaction_data not in self.blockchain.pending_transactions:
-            self.blockchain.pending_transactions.append(transaction_data)
-            self.blockchain.save_state()
-            print("Transaction added to the pending pool.")
-            # Broadcast the transaction to peers, excluding the sender
-            await self.broadcast_transaction(transaction_data, exclude_peers=[websocket])
+    async def handle_incoming_block(self, block_data, peer=None):
+        block = Block.from_dict(block_data)
+        block_hash = block.hash()
+        if not self._first_sighting("block", block_hash) or block_hash in self.blockchain.block_index:
+            return
+        if not all(await self._verify_transactions(block.transactions)):
+            logger.warning("Rejected block %d: invalid transaction signature.", block.index)
+            return
+        if await self._write(self.blockchain.add_block, block):
+            logger.info("Block %d added to the chain.", block.index)
+            # Announce the block to peers other than the one it came from
+            self.announce("block", block_hash, {"type": "BLOCK", "block": block.to_dict()}, [peer])
+        elif peer is not None and block.index > self.blockchain.snapshot().height:
+            # The sender is ahead of us or on another branch; fetch what we are missing
+            logger.info("Block %d does not extend our chain. Starting header sync with sender.", block.index)
+            self.sync.start(peer)
+        else:
+            logger.warning("Invalid block %d received.", block.index)
+
+
+
+    async def handle_incoming_transaction(self, transaction_data, peer):
+        tx_id = Transaction.compute_id(transaction_data)
+        if not self._first_sighting("tx", tx_id) or tx_id in self.blockchain.mempool:
+            return
+        sampled.debug("Received transaction %s", tx_id)
+        if not self.blockchain.verify_transactions([transaction_data])[0]:
+            logger.warning("Rejected transaction %s with invalid signature.", tx_id)
+            return
+        if await self._write(self.blockchain.add_transaction, transaction_data):
+            sampled.debug("Transaction %s added to the pending pool.", tx_id)
+            # Announce the transaction to peers, excluding the sender
+            self.announce("tx", tx_id, {"type": "TRANSACTION", "transaction": transaction_data}, [peer])
         else:
-            print("Transaction already in pending pool.")
+            sampled.debug("Transaction %s already in pending pool.", tx_id)
 
-    async def broadcast_transaction(self, transaction_data):
+    def broadcast_transaction(self, transaction_data, exclude_peers=None):
         """Broadcast transaction to all connected peers."""
-        message = json.dumps({"type": "TRANSACTION", "transaction": transaction_data})
-        await self._broadcast_message(message)
-
-    async def handle_incoming_wallet(self, public_key):
-        if public_key not in self.blockchain.wallets:
-            self.blockchain.wallets[public_key] = 10
-            self.blockchain.save_state()
-            print(f"Received new wallet: {public_key}")
-            await self.broadcast_wallet(public_key)
-
-    async def broadcast_block(self, block_data):
-        """Broadcast block to all connected peers."""
-        message = json.dumps({"type": "BLOCK", "block": block_data})
-        await self._broadcast_message(message)
-
-    async def _broadcast_message(self, message, exclude_peers=None):
-        """Internal method to broadcast messages to all peers."""
-        if exclude_peers is None:
-            exclude_peers = []
-        print(f"Peers: {self.peers}")
-        for peer in self.peers:
-            if peer in exclude_peers:
-                continue
-            try:
-                await peer.send(message)
-                print(f"Message sent to peer {peer.remote_address}")
-            except Exception as e:
-                print(f"Failed to send message to peer: {e}")
+        self.announce("tx", Transaction.compute_id(transaction_data),
+                            {"type": "TRANSACTION", "transaction": transaction_data}, exclude_peers)
 
+    def broadcast_transactions(self, transactions):
+        """Broadcast a batch of transactions, announcing them together."""
+        self.announce_many("tx", [
+            (Transaction.compute_id(tx), {"type": "TRANSACTION", "transaction": tx}) for tx in transactions
+        ])
 
-    async def broadcast_wallet(self, public_key):
-        """Broadcast wallet creation to all connected peers."""
-        message = json.dumps({"type": "WALLET", "public_key": public_key})
-        await self._broadcast_message(message)
 
-    async def _broadcast_message(self, message, exclude_peers=None):
-        """Internal method to broadcast messages to all peers."""
+    def broadcast_block(self, block_data):
+        """Broadcast block to all connected peers."""
+        self.announce("block", Block.from_dict(block_data).hash(), {"type": "BLOCK", "block": block_data})
+
+    def _first_sighting(self, kind, object_id):
+        """Record that an object arrived; False if it was already handled."""
+        self.requested_inventory.pop((kind, object_id), None)
+        return self.known_inventory.add((kind, object_id))
+
+    def announce(self, kind, object_id, message, exclude_peers=None):
+        """
+        Relay an object: peers that speak INV get only its id and fetch it with
+        GETDATA if they lack it; older peers get the full message.
+        """
+        self.announce_many(kind, [(object_id, message)], exclude_peers)
+
+    def announce_many(self, kind, entries, exclude_peers=None):
+        """Relay several ``(object_id, message)`` entries, sharing INV messages between them."""
+        for object_id, message in entries:
+            self.known_inventory.add((kind, object_id))
+            self.relay_cache.put((kind, object_id), message)
+        exclude_peers = exclude_peers or []
+        legacy_excluded = [peer for peer in self.peers if not peer.supports_inv] + exclude_peers
+        inv_excluded = [peer for peer in self.peers if peer.supports_inv] + exclude_peers
+        for i in range(0, len(entries), gossip.INV_MAX_ITEMS):
+            items = [{"kind": kind, "id": object_id} for object_id, _ in entries[i:i + gossip.INV_MAX_ITEMS]]
+            self._broadcast_message({"type": "INV", "items": items}, legacy_excluded)
+        for _, message in entries:
+            self._broadcast_message(message, inv_excluded)
+
+    def _lacks(self, kind, object_id):
+        if (kind, object_id) in self.known_inventory:
+            return False
+        if kind == "tx":
+            return object_id not in self.blockchain.mempool
+        if kind == "block":
+            return object_id not in self.blockchain.block_index
+        return True
+
+    async def handle_inv(self, items, peer):
+        """Ask the announcing peer for objects we have not seen and are not already fetching elsewhere."""
+        now = time.monotonic()
+        for key, requested_at in list(self.requested_inventory.items()):
+            if now - requested_at > gossip.GETDATA_TIMEOUT:
+                del self.requested_inventory[key]
+        wanted = [
+            item for item in items
+            if self._lacks(item['kind'], item['id']) and (item['kind'], item['id']) not in self.requested_inventory
+        ]
+        if not wanted:
+            return
+        for item in wanted:
+            self.requested_inventory[(item['kind'], item['id'])] = now
+        self.send_message(peer, {"type": "GETDATA", "items": wanted})
+
+    async def handle_getdata(self, items, peer):
+        for item in items:
+            message = self._inventory_message(item['kind'], item['id'])
+            if message is not None:
+                self.send_message(peer, message)
+
+    def _inventory_message(self, kind, object_id):
+        message = self.relay_cache.get((kind, object_id))
+        if message is not None:
+            return message
+        if kind == "tx":
+            transaction = self.blockchain.mempool.get(object_id)
+            return None if transaction is None else {"type": "TRANSACTION", "transaction": transaction}
+        if kind == "block":
+            block = self.blockchain.get_block_by_hash(object_id)
+            return None if block is None else {"type": "BLOCK", "block": block.to_dict()}
+        return None
+
+    def _broadcast_message(self, data, exclude_peers=None):
+        """Queue a message for every peer not excluded, encoding it once for all of them."""
         if exclude_peers is None:
             exclude_peers = []
-        for peer in self.peers:
+        frame = None
+        for peer in list(self.peers):
             if peer in exclude_peers:
                 continue
-            try:
-                await peer.send(message)
-                print(f"Message sent to peer {peer.remote_address}")
-            except Exception as e:
-                print(f"Failed to send message to peer: {e}")
+            if frame is None:
+                frame = json.dumps(data)
+            peer.send(frame)
 
 
-    async def request_full_chain(self):
+    def request_full_chain(self):
         """Request the full chain from all peers."""
-        message = json.dumps({"type": "REQUEST_CHAIN"})
-        await self._broadcast_message(message)
+        self._broadcast_message({"type": "REQUEST_CHAIN"})
 
-    async def request_pending_transactions(self):
+    def request_pending_transactions(self):
         """Request pending transactions from all peers."""
-        message = json.dumps({"type": "REQUEST_PENDING_TRANSACTIONS"})
-        await self._broadcast_message(message)
+        self._broadcast_message({"type": "REQUEST_PENDING_TRANSACTIONS"})
 
     async def handle_sync(self, incoming_chain_data):
         """Handle incoming chain sync request."""
         incoming_chain = [self.blockchain.create_block_from_dict(block) for block in incoming_chain_data]
-        if len(incoming_chain) > len(self.blockchain.chain):
-            self.blockchain.chain = incoming_chain
-            self.blockchain.save_state()
-            print("Blockchain synchronized with peer.")
+        if await self._replace_chain(incoming_chain):
+            logger.info("Blockchain synchronized with peer.")
 
     async def handle_incoming_pending_transactions(self, transactions):
         """Handle incoming pending transactions from peers."""
-        for transaction in transactions:
-            if transaction not in self.blockchain.pending_transactions:
-                self.blockchain.pending_transactions.append(transaction)
-        self.blockchain.save_state()
-        print("Pending transactions synchronized with peer.")
+        verified = await self._verify_transactions(transactions)
+        await self._write(self.blockchain.add_pending_transactions, [tx for tx, ok in zip(transactions, verified) if ok])
+        logger.debug("Pending transactions synchronized with peer.")
 
     def connect_to_peer(self, host, port):
         """Connect to a new peer via WebSocket."""
@@ -184,13 +345,15 @@ class P2PNetwork:
         async def connect():
             try:
                 uri = f"ws://{host}:{port}"
-                websocket = await websockets.connect(uri)
-                self.peers.append(websocket)
-                print(f"Connected to peer at {host}:{port}")
-                await self.request_full_chain()
-                await self.request_pending_transactions()
+                websocket = await websockets.connect(uri, compression=self._compression())
+                logger.info("Connected to peer at %s:%d", host, port)
             except Exception as e:
-                print(f"Failed to connect to peer at {host}:{port}: {e}")
+                logger.warning("Failed to connect to peer at %s:%d: %s", host, port, e)
+                return
+            peer = self._add_peer(websocket)
+            asyncio.ensure_future(self._read_loop(peer))
+            self.sync.start(peer)
+            self.send_message(peer, {"type": "REQUEST_PENDING_TRANSACTIONS"})
 
         # Schedule the coroutine in the P2P network's event loop
         asyncio.run_coroutine_threadsafe(connect(), self.loop)
@@ -201,20 +364,20 @@ class P2PNetwork:
     def get_connected_peers(self):
      return [f"{peer.remote_address[0]}:{peer.remote_address[1]}" for peer in self.peers if peer.open]
 
+    def peer_stats(self):
+        return [peer.stats() for peer in list(self.peers)]
+
 
 
-    async def handle_chain_request(self, websocket):
-        chain_data = [block.to_dict() for block in self.blockchain.chain]
-        message = json.dumps({'type': 'RESPONSE_CHAIN', 'chain': chain_data})
-        await websocket.send(message)
+    async def handle_chain_request(self, peer):
+        chain_data = [block.to_dict() for block in self.blockchain.snapshot().chain]
+        self.send_message(peer, {'type': 'RESPONSE_CHAIN', 'chain': chain_data})
 
     async def handle_chain_response(self, chain_data):
         incoming_chain = [self.blockchain.create_block_from_dict(block_data) for block_data in chain_data]
-        if len(incoming_chain) > len(self.blockchain.chain) and self.blockchain.is_valid_chain(incoming_chain):
-            self.blockchain.replace_chain(incoming_chain)
-            print("Blockchain synchronized with peer.")
+        if await self._replace_chain(incoming_chain):
+            logger.info("Blockchain synchronized with peer.")
 
-    async def handle_pending_transactions_request(self, websocket):
+    async def handle_pending_transactions_request(self, peer):
         """Send pending transactions to the requesting peer."""
-        message = json.dumps({'type': 'RESPONSE_PENDING_TRANSACTIONS', 'transactions': self.blockchain.pending_transactions})
-        await websocket.send(message)
\ No newline at end of file
+        self.send_message(peer, {'type': 'RESPONSE_PENDING_TRANSACTIONS', 'transactions': self.blockchain.pending_transactions})
\ No newline at end of file
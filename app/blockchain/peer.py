@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+# Frames waiting to be written to one peer before the overflow policy applies
+PEER_QUEUE_SIZE = int(os.getenv('PEER_QUEUE_SIZE', 1000))
+# "drop_oldest" discards the oldest queued frame, "disconnect" drops the slow peer
+PEER_OVERFLOW = os.getenv('PEER_OVERFLOW', 'drop_oldest')
+# Seconds a single frame may take to send before the peer is considered dead
+PEER_SEND_TIMEOUT = float(os.getenv('PEER_SEND_TIMEOUT', 10))
+
+
+class Peer:
+    """
+    One peer connection with its own bounded outbound queue.
+
+    ``send`` only enqueues; a writer task per peer drains the queue, so a slow
+    or stalled socket delays nobody but itself. Must be used from the P2P loop.
+    """
+
+    def __init__(self, websocket, max_queue=PEER_QUEUE_SIZE, overflow=PEER_OVERFLOW):
+        if overflow not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Unknown peer overflow policy {overflow!r}")
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.supports_inv = False
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+    @property
+    def remote_address(self):
+        return self.websocket.remote_address
+
+    @property
+    def open(self):
+        return not self.closed and self.websocket.open
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write_loop())
+        return self
+
+    def send(self, frame):
+        """Queue an encoded frame. Returns False if the peer is closed or was disconnected for being slow."""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            if self.overflow == "disconnect":
+                logger.warning("Disconnecting slow peer %s: %d frames queued", self.remote_address, len(self._queue))
+                self.close()
+                return False
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(frame)
+        self._wakeup.set()
+        return True
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                frame = self._queue.popleft()
+                await asyncio.wait_for(self.websocket.send(frame), PEER_SEND_TIMEOUT)
+                self.sent += 1
+                self.bytes_sent += len(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Failed to send message to peer %s: %s", self.remote_address, e)
+            self.close()
+
+    def close(self):
+        """Stop writing and close the socket; the read loop then removes the peer."""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        self._wakeup.set()
+        asyncio.ensure_future(self.websocket.close())
+
+    def stats(self):
+        return {
+            "address": f"{self.remote_address[0]}:{self.remote_address[1]}",
+            "queued": len(self._queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "inv": self.supports_inv,
+        }
@@ -0,0 +1,197 @@
+import functools
+import logging
+import queue
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import Future
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_SECONDS = metrics.histogram('state_engine_batch_seconds', 'Time to apply one batch of queued writes')
+COMMANDS = metrics.counter('state_engine_commands_total', 'Writes applied by the state engine')
+
+
+class Snapshot:
+    """
+    Immutable view of the chain state at one point in time.
+
+    Published by the writer after each batch of commands; readers take the
+    current reference and never see a half-applied change. ``chain`` is a
+    ``ChainView``: headers are in memory, older block bodies load on access.
+    """
+    __slots__ = ('chain', 'wallets', 'pending_transactions', 'version')
+
+    def __init__(self, chain, wallets, pending_transactions, version):
+        self.chain = chain
+        self.wallets = wallets
+        self.pending_transactions = pending_transactions
+        self.version = version
+
+    @property
+    def height(self):
+        return len(self.chain) - 1
+
+    @property
+    def tip(self):
+        return self.chain[-1]
+
+
+class StateEngine:
+    """
+    Runs every state mutation on one writer thread, in submission order.
+
+    Commands queued while the writer is busy are applied as one batch, after
+    which ``publish`` is called once to build a new snapshot; results are handed
+    back only after the snapshot is published, so a caller always reads its own
+    write. Calls made from the writer thread itself (a command calling another
+    serialized method) run inline.
+    """
+
+    def __init__(self, publish, name="state-writer"):
+        self.publish = publish
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self.commands = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def in_writer(self):
+        """True on the writer thread, or before the engine is started (e.g. while loading state)."""
+        return self._thread is None or threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` and return a Future for its result."""
+        future = Future()
+        if self.in_writer():
+            self._execute(fn, args, kwargs, future)
+            return future
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Run ``fn`` on the writer and wait for its result (or exception)."""
+        if self.in_writer():
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            started = time.perf_counter()
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            outcomes = []
+            for fn, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    outcomes.append((future, True, fn(*args, **kwargs)))
+                except BaseException as e:
+                    outcomes.append((future, False, e))
+            self.commands += len(batch)
+            self.batches += 1
+            COMMANDS.inc(amount=len(batch))
+            BATCH_SECONDS.observe(time.perf_counter() - started)
+            try:
+                self.publish()
+            except Exception as e:
+                logger.exception("Failed to publish state snapshot: %s", e)
+            for future, ok, value in outcomes:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    @staticmethod
+    def _execute(fn, args, kwargs, future):
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+
+def serialized(method):
+    """Run a ``Blockchain`` method on its state engine's writer thread."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.engine.call(method, self, *args, **kwargs)
+    return wrapper
+
+
+_MISSING = object()
+
+
+class LayeredMap(Mapping):
+    """
+    Immutable mapping stored as frozen dict layers, newest first.
+
+    ``updated`` returns a new map that shares every older layer, so publishing a
+    change costs the size of the change, not of the map. A layer is merged into
+    the one below it once it is at least as large, like carrying in a binary
+    counter: the stack stays O(log n) deep and each key is copied O(log n) times
+    over its life. Keys are never removed.
+    """
+    __slots__ = ('_layers', '_len')
+
+    def __init__(self, mapping=()):
+        layer = dict(mapping)
+        self._layers = (layer,) if layer else ()
+        self._len = len(layer)
+
+    def __getitem__(self, key):
+        for layer in self._layers:
+            value = layer.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        for layer in self._layers:
+            value = layer.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        return default
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self._layers)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        seen = set()
+        for layer in self._layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def updated(self, changes):
+        """A new map with ``changes`` applied on top of this one."""
+        if not changes:
+            return self
+        added = sum(1 for key in changes if key not in self)
+        layers = [dict(changes)] + list(self._layers)
+        while len(layers) > 1 and len(layers[0]) >= len(layers[1]):
+            merged = dict(layers[1])
+            merged.update(layers[0])
+            layers[:2] = [merged]
+        result = LayeredMap()
+        result._layers = tuple(layers)
+        result._len = self._len + added
+        return result
@@ -1,16 +1,84 @@
+import hashlib
+import json
+import threading
+import time
 from cryptolib.crypto import Crypto
 
+
+# Every new wallet's starting coins are an on-chain transfer from the genesis allocation,
+# signed by the wallet it funds
+GRANT_SENDER = "GENESIS_WALLET"
+WALLET_GRANT = 10
+
+_nonce_lock = threading.Lock()
+_last_nonce = 0
+
+
+def new_nonce():
+    """Nonce for a transaction signed on this node: nanoseconds since the epoch, strictly increasing."""
+    global _last_nonce
+    with _nonce_lock:
+        _last_nonce = max(time.time_ns(), _last_nonce + 1)
+        return _last_nonce
+
+
 class Transaction:
-    def __init__(self, sender, recipient, amount, signature):
+    def __init__(self, sender, recipient, amount, signature, nonce=None):
         self.sender = sender
         self.recipient = recipient
         self.amount = amount
         self.signature = signature
+        self.nonce = nonce
 
     def to_dict(self):
-        return {
+        data = {
             'sender': self.sender,
             'recipient': self.recipient,
             'amount': self.amount,
             'signature': self.signature
         }
+        # Legacy transactions have no nonce; leaving the key out keeps their ids unchanged
+        if self.nonce is not None:
+            data['nonce'] = self.nonce
+        return data
+
+    @staticmethod
+    def signing_message(transaction_data):
+        """
+        The string a transaction's signature covers. With a nonce, repeated payments of the
+        same amount sign (and hash) differently; the message is then canonical JSON, which
+        cannot collide with a legacy sender + recipient + amount message since public keys
+        never start with '{'.
+        """
+        if 'nonce' not in transaction_data:
+            return f"{transaction_data['sender']}{transaction_data['recipient']}{transaction_data['amount']}"
+        return json.dumps({field: transaction_data[field] for field in ('sender', 'recipient', 'amount', 'nonce')},
+                          sort_keys=True)
+
+    @staticmethod
+    def is_grant(transaction_data):
+        return transaction_data.get('sender') == GRANT_SENDER
+
+    @staticmethod
+    def signer(transaction_data):
+        """Public key the signature must verify against: the funded wallet's for a grant, else the sender's."""
+        if Transaction.is_grant(transaction_data):
+            return transaction_data['recipient']
+        return transaction_data['sender']
+
+    @staticmethod
+    def grant(public_key, private_key):
+        """The signed transfer of a new wallet's starting coins."""
+        grant = {'sender': GRANT_SENDER, 'recipient': public_key, 'amount': WALLET_GRANT}
+        grant['signature'] = Crypto.sign_transaction(private_key, Transaction.signing_message(grant))
+        return grant
+
+    @staticmethod
+    def serialize(transaction_data):
+        """Canonical bytes for a transaction dict: JSON with sorted keys, ASCII-escaped."""
+        return json.dumps(transaction_data, sort_keys=True).encode('utf-8')
+
+    @staticmethod
+    def compute_id(transaction_data):
+        """Transaction id: SHA-256 of the canonical serialization. Also the Merkle leaf."""
+        return hashlib.sha256(Transaction.serialize(transaction_data)).hexdigest()
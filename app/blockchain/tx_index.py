@@ -0,0 +1,225 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from blockchain.transaction import Transaction
+
+
+# A reference packs (height, position) into one integer, so address histories are flat arrays
+POSITION_BITS = 24
+# Most recent blocks whose index entries are kept in memory; older lookups go to storage
+TX_INDEX_WINDOW = int(os.getenv('TX_INDEX_WINDOW', 1000))
+# Bound on transaction id lookups answered by storage and remembered
+TX_INDEX_CACHE_SIZE = int(os.getenv('TX_INDEX_CACHE_SIZE', 100000))
+
+_UNCACHED = object()
+
+
+def make_ref(height, position):
+    return (height << POSITION_BITS) | position
+
+
+def split_ref(ref):
+    return ref >> POSITION_BITS, ref & ((1 << POSITION_BITS) - 1)
+
+
+def block_entries(block):
+    """What the index records about a block: ``[txid, sender, recipient]`` per transaction, in block order."""
+    return [[Transaction.compute_id(tx), tx['sender'], tx['recipient']] for tx in block.transactions]
+
+
+class LocationCache:
+    """
+    Least recently used transaction id -> reference lookups, None meaning not
+    confirmed. Safe to use from any thread. ``generation`` changes whenever an
+    entry may have gone stale, so a lookup that started before that does not
+    store what it read.
+    """
+
+    def __init__(self, max_size=TX_INDEX_CACHE_SIZE):
+        self.max_size = max_size
+        self.generation = 0
+        self._refs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._refs)
+
+    def get(self, txid):
+        with self._lock:
+            ref = self._refs.get(txid, _UNCACHED)
+            if ref is not _UNCACHED:
+                self._refs.move_to_end(txid)
+            return ref
+
+    def put_all(self, refs, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._refs.update(refs)
+            while len(self._refs) > self.max_size:
+                self._refs.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._refs.clear()
+
+    def discard_all(self, txids):
+        with self._lock:
+            self.generation += 1
+            for txid in txids:
+                self._refs.pop(txid, None)
+
+
+class TransactionIndex:
+    """
+    Confirmed transactions of the active chain by id and by address.
+
+    The index lives in ``storage``, one record of ``block_entries`` per block,
+    and is written here as blocks are connected and disconnected. The entries of
+    the last ``window`` blocks are also held in memory: ``txids`` maps their
+    transaction ids to references and ``addresses`` an address to the references
+    of the transactions it sent or received, in chain order, so a page of recent
+    history is a bisect and a slice. Ids not found there are looked up in storage
+    through a ``LocationCache``; an id confirmed later enters the window first and
+    leaves the cache when its block leaves the window, so remembering "not
+    confirmed" is safe.
+
+    Only the state writer mutates it; readers check what they find against their snapshot.
+    """
+
+    def __init__(self, storage, window=TX_INDEX_WINDOW, cache_size=TX_INDEX_CACHE_SIZE):
+        self.storage = storage
+        self.window = max(1, window)
+        self.cache = LocationCache(cache_size)
+        self.txids = {}
+        self.addresses = {}
+        # Entries of the blocks in the window, oldest first
+        self.blocks = deque()
+        self.height = -1
+
+    @property
+    def start(self):
+        """Lowest height whose entries are held in memory (``height + 1`` when none are)."""
+        return self.height - len(self.blocks) + 1
+
+    def reset(self, height, records):
+        """Resume from the stored index, which matches the chain up to ``height``; ``records`` end there."""
+        self.txids = {}
+        self.addresses = {}
+        self.blocks = deque()
+        self.cache.clear()
+        self.height = height
+        for record in records[-self.window:]:
+            self._add(record["height"], record["entries"])
+
+    def _add(self, height, entries):
+        for position, (txid, sender, recipient) in enumerate(entries):
+            ref = make_ref(height, position)
+            # A repeated id keeps pointing at its first confirmation
+            self.txids.setdefault(txid, ref)
+            for address in {sender, recipient}:
+                refs = self.addresses.get(address)
+                if refs is None:
+                    refs = self.addresses[address] = array('Q')
+                refs.append(ref)
+        self.blocks.append(entries)
+        self.height = height
+        if len(self.blocks) > self.window:
+            self._forget_oldest()
+
+    def _forget_oldest(self):
+        """Leave the oldest block of the window to storage."""
+        entries = self.blocks.popleft()
+        end = make_ref(self.start, 0)
+        for txid, sender, recipient in entries:
+            if self.txids.get(txid, end) < end:
+                del self.txids[txid]
+            for address in {sender, recipient}:
+                refs = self.addresses.get(address)
+                if refs is None:
+                    continue
+                del refs[:bisect_left(refs, end)]
+                if not refs:
+                    del self.addresses[address]
+        # Lookups made before the block was confirmed may have cached its ids as unconfirmed
+        self.cache.discard_all(txid for txid, _, _ in entries)
+
+    def connect(self, block):
+        """Index ``block`` on top of the indexed chain."""
+        entries = block_entries(block)
+        self.storage.save_tx_index(block.index, block.hash(), entries)
+        self._add(block.index, entries)
+
+    def disconnect_from(self, height, blocks):
+        """Remove heights ``height`` and above; ``blocks`` are the indexed blocks there, tip first."""
+        # Storage first: a lookup racing with this must not cache what is about to be removed
+        self.storage.delete_tx_index_from(height)
+        for block in blocks:
+            entries = block_entries(block)
+            if block.index >= self.start:
+                self._remove_tip(block.index, entries)
+            self.cache.discard_all(txid for txid, _, _ in entries)
+        # Blocks below the window were only in storage
+        self.height = min(self.height, height - 1)
+
+    def _remove_tip(self, height, entries):
+        first = make_ref(height, 0)
+        for txid, sender, recipient in entries:
+            if self.txids.get(txid, -1) >= first:
+                del self.txids[txid]
+            for address in (sender, recipient):
+                refs = self.addresses.get(address)
+                if refs is None:
+                    continue
+                while refs and refs[-1] >= first:
+                    refs.pop()
+                if not refs:
+                    del self.addresses[address]
+        self.blocks.pop()
+        self.height = height - 1
+
+    def locate(self, txid):
+        """``(height, position)`` of a confirmed transaction, or None."""
+        return self.locate_all([txid]).get(txid)
+
+    def locate_all(self, txids):
+        """``{txid: (height, position)}`` for the confirmed ones among ``txids``, with one storage query."""
+        generation = self.cache.generation
+        found = {}
+        missing = []
+        for txid in txids:
+            ref = self.txids.get(txid)
+            if ref is None:
+                ref = self.cache.get(txid)
+            if ref is _UNCACHED:
+                missing.append(txid)
+            elif ref is not None:
+                found[txid] = split_ref(ref)
+        if missing:
+            stored = self.storage.locate_transactions(missing)
+            self.cache.put_all(((txid, make_ref(*stored[txid]) if txid in stored else None) for txid in missing),
+                               generation)
+            found.update(stored)
+        return found
+
+    def history(self, address, limit, before=None):
+        """
+        Up to ``limit`` references for ``address``, newest first, older than the
+        ``before`` reference if given. Returns ``(refs, total, next)``, ``next``
+        being the ``before`` of the following page or None on the last one.
+        """
+        start = self.start
+        recent = self.addresses.get(address, ())
+        end = len(recent) if before is None else bisect_left(recent, before)
+        # One more than a page, to tell whether there is a next one
+        refs = list(reversed(recent[max(0, end - limit - 1):end]))
+        stored_before = split_ref(before) if before is not None and before < make_ref(start, 0) else None
+        locations, stored = self.storage.address_transactions(address, start, limit + 1 - len(refs), stored_before)
+        refs.extend(make_ref(height, position) for height, position in locations)
+        total = len(recent) + stored
+        if len(refs) > limit:
+            return refs[:limit], total, refs[limit - 1]
+        return refs, total, None
@@ -0,0 +1,187 @@
+import atexit
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from blockchain.merkle_tree import MerkleTree
+from blockchain.miner import MINING_DIFFICULTY
+from blockchain.transaction import Transaction, WALLET_GRANT
+from cryptolib.crypto import Crypto
+
+
+logger = logging.getLogger(__name__)
+
+
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', os.cpu_count() or 1))
+# Blocks per segment handed to a validation worker
+VALIDATION_SEGMENT_SIZE = int(os.getenv('VALIDATION_SEGMENT_SIZE', 250))
+# Chains with fewer new blocks than this are validated in the calling process
+VALIDATION_PARALLEL_MIN = int(os.getenv('VALIDATION_PARALLEL_MIN', 64))
+
+_validation_pool = None
+
+
+def _validation_pool_executor():
+    global _validation_pool
+    if _validation_pool is None:
+        _validation_pool = ProcessPoolExecutor(max_workers=VALIDATION_WORKERS)
+        atexit.register(_validation_pool.shutdown, wait=False)
+    return _validation_pool
+
+
+def check_block(block, min_difficulty=MINING_DIFFICULTY):
+    """Checks that need only the block itself. Returns the reason it is invalid, or None."""
+    if block.index > 0 and (block.difficulty < min_difficulty or not block.has_valid_proof()):
+        return "insufficient proof of work"
+    if block.merkle_root != block.calculate_merkle_root() and block.merkle_root != MerkleTree.legacy_root(block.transactions):
+        return "merkle root does not match transactions"
+    for tx in block.transactions:
+        # ICO allocations are not signed, and only the genesis block may make them
+        if tx.get('sender') == "ICO":
+            if block.index > 0:
+                return "ICO allocation outside the genesis block"
+            continue
+        if not Crypto.verify_signature_safe(Transaction.signer(tx), Transaction.signing_message(tx), tx.get('signature', '')):
+            return "invalid transaction signature"
+    return None
+
+
+def _check_segment(blocks, min_difficulty):
+    """Return ``(height, reason)`` for the first invalid block of the segment, or None."""
+    for block in blocks:
+        reason = check_block(block, min_difficulty)
+        if reason:
+            return block.index, reason
+    return None
+
+
+class ChainValidator:
+    """
+    Full validation of an incoming chain.
+
+    Proof of work, Merkle roots and signatures only depend on each block, so the
+    blocks are split into segments checked on a process pool; the first failing
+    segment cancels the rest. Linkage and balances depend on order and are
+    checked afterwards in a single pass, which is cheap compared with hashing
+    and signature checks.
+    """
+
+    def __init__(self, workers=VALIDATION_WORKERS, segment_size=VALIDATION_SEGMENT_SIZE,
+                 min_difficulty=MINING_DIFFICULTY):
+        self.workers = max(1, workers)
+        self.segment_size = max(1, segment_size)
+        self.min_difficulty = min_difficulty
+        self.last_report = None
+
+    def validate(self, chain, start=1, balances=None, confirmed=None):
+        """
+        Validate ``chain[start:]`` against the blocks before it. No transaction may
+        appear twice in it, nor be one that ``confirmed`` (see ``replayed_transaction``)
+        says the blocks before ``start`` confirm. When ``balances`` (the
+        balances after block ``start - 1``) is given, no transaction may spend more
+        than its sender holds. Returns True if the chain is valid.
+        """
+        started = time.perf_counter()
+        start = max(start, 1)
+        blocks = chain[start:]
+        error = self._check_blocks(blocks) or self._check_links(chain, start) \
+            or self.replayed_transaction(blocks, confirmed)
+        if error is None and balances is not None:
+            error = self.replay_balances(blocks, dict(balances), check=True)
+        seconds = time.perf_counter() - started
+        self.last_report = {
+            "blocks": len(blocks),
+            "seconds": seconds,
+            "blocks_per_second": len(blocks) / seconds if seconds else 0.0,
+            "workers": self.workers if len(blocks) >= VALIDATION_PARALLEL_MIN else 1,
+            "valid": error is None,
+            "error": None if error is None else {"height": error[0], "reason": error[1]},
+        }
+        if error is None:
+            logger.info("Validated %d blocks in %.2fs (%.0f blocks/s, %d workers)", len(blocks), seconds,
+                        self.last_report['blocks_per_second'], self.last_report['workers'])
+        else:
+            logger.warning("Chain rejected at block %s: %s", error[0], error[1])
+        return error is None
+
+    def _check_blocks(self, blocks):
+        if len(blocks) < VALIDATION_PARALLEL_MIN or self.workers <= 1:
+            return _check_segment(blocks, self.min_difficulty)
+        segments = [blocks[i:i + self.segment_size] for i in range(0, len(blocks), self.segment_size)]
+        futures = [_validation_pool_executor().submit(_check_segment, segment, self.min_difficulty)
+                   for segment in segments]
+        try:
+            for future in as_completed(futures):
+                error = future.result()
+                if error is not None:
+                    return error
+        finally:
+            for future in futures:
+                future.cancel()
+        return None
+
+    @staticmethod
+    def _check_links(chain, start):
+        for height in range(start, len(chain)):
+            block = chain[height]
+            if block.index != height:
+                return height, "unexpected block index"
+            if block.previous_hash != chain[height - 1].hash():
+                return height, "previous hash does not match"
+        return None
+
+    @staticmethod
+    def replayed_transaction(blocks, confirmed=None):
+        """
+        ``(height, reason)`` for a transaction of ``blocks`` that appears twice in them or
+        that ``confirmed`` (given txids, returns those confirmed before the blocks) says is
+        already confirmed; otherwise None. A signature stays valid forever, so without
+        this a transfer could be mined again.
+        """
+        heights = {}
+        for block in blocks:
+            for tx in block.transactions:
+                tx_id = Transaction.compute_id(tx)
+                if tx_id in heights:
+                    return block.index, f"transaction {tx_id} appears twice"
+                heights[tx_id] = block.index
+        replayed = confirmed(list(heights)) if confirmed is not None and heights else ()
+        if replayed:
+            tx_id = min(replayed, key=heights.get)
+            return heights[tx_id], f"transaction {tx_id} is already confirmed"
+        return None
+
+    @staticmethod
+    def transfer_error(tx, balances):
+        """Why ``tx`` cannot be applied to ``balances``, or None if it can."""
+        sender, amount = tx['sender'], tx['amount']
+        # Written so that NaN fails too
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not amount >= 0:
+            return f"invalid amount {amount!r}"
+        if balances.get(sender, 0) < amount:
+            return f"{sender} cannot afford a transfer of {amount}"
+        # A grant funds a wallet the chain has never seen, so each wallet gets one
+        if Transaction.is_grant(tx) and (amount != WALLET_GRANT or tx['recipient'] in balances):
+            return f"invalid wallet grant to {tx['recipient']}"
+        return None
+
+    @staticmethod
+    def replay_balances(blocks, balances, check=False):
+        """
+        Apply the blocks' transfers to ``balances`` in place. With ``check``, stop at the
+        first transfer that ``transfer_error`` refuses and return ``(height, reason)``.
+        """
+        for block in blocks:
+            for tx in block.transactions:
+                if check:
+                    error = ChainValidator.transfer_error(tx, balances)
+                    if error is not None:
+                        return block.index, error
+                ChainValidator.apply_transfer(tx, balances)
+        return None
+
+    @staticmethod
+    def apply_transfer(tx, balances):
+        sender, amount = tx['sender'], tx['amount']
+        balances[sender] = balances.get(sender, 0) - amount
+        balances[tx['recipient']] = balances.get(tx['recipient'], 0) + amount
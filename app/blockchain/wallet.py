@@ -1,9 +1,13 @@
 from cryptolib.crypto import Crypto
 
 class Wallet:
-    def __init__(self, blockchain):
-        self.private_key, self.public_key = Crypto.generate_keypair()
-        blockchain.create_wallet(self.public_key)
+    def __init__(self, blockchain, scheme=None, key_pool=None):
+        if key_pool is not None:
+            self.private_key, self.public_key = key_pool.take(scheme)
+        else:
+            self.private_key, self.public_key = Crypto.generate_keypair(scheme)
+        # The signed grant of the wallet's initial funds, or None if the wallet already existed
+        self.grant = blockchain.create_wallet(self.public_key, self.private_key)
 
     def export_keys(self, blockchain):
         return {
@@ -1,16 +1,66 @@
 import base64
-from Crypto.PublicKey import RSA
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from Crypto.PublicKey import ECC, RSA
 from Crypto.Hash import SHA256
-from Crypto.Signature import pkcs1_15
+from Crypto.Signature import eddsa, pkcs1_15
+
+
+# Keys and addresses of this scheme carry a tag; untagged keys are base64 PEM RSA keys
+ED25519_PREFIX = "ed25519:"
+KEY_SCHEMES = ("ed25519", "rsa")
+DEFAULT_KEY_SCHEME = os.getenv('WALLET_KEY_SCHEME', 'ed25519')
+# Parsed public keys kept in memory, keyed by their base64 encoding
+KEY_CACHE_SIZE = int(os.getenv('KEY_CACHE_SIZE', 4096))
+VERIFY_WORKERS = int(os.getenv('VERIFY_WORKERS', os.cpu_count() or 1))
+# Batches smaller than this are verified in the calling process
+VERIFY_BATCH_MIN = int(os.getenv('VERIFY_BATCH_MIN', 32))
+
+_verify_pool = None
+
+
+def _verify_pool_executor():
+    global _verify_pool
+    if _verify_pool is None:
+        _verify_pool = ProcessPoolExecutor(max_workers=VERIFY_WORKERS)
+    return _verify_pool
+
+
+def _verify_chunk(items):
+    return [Crypto.verify_signature_safe(*item) for item in items]
+
 
 class Crypto:
     @staticmethod
-    def generate_keypair():
+    def generate_keypair(scheme=None):
+        """
+        Return ``(private_key, public_key)`` as strings. Ed25519 keys are
+        ``"ed25519:" + base64(raw 32 bytes)``; RSA keys are base64 PEM.
+        """
+        scheme = scheme or DEFAULT_KEY_SCHEME
+        if scheme == "ed25519":
+            key = ECC.generate(curve='Ed25519')
+            private_key = ED25519_PREFIX + base64.b64encode(key.seed).decode('utf-8')
+            public_key = ED25519_PREFIX + base64.b64encode(key.public_key().export_key(format='raw')).decode('utf-8')
+            return private_key, public_key
+        if scheme != "rsa":
+            raise ValueError(f"Unknown key scheme {scheme!r}, expected one of {KEY_SCHEMES}")
         key = RSA.generate(2048)
         private_key = base64.b64encode(key.export_key()).decode('utf-8')
         public_key = base64.b64encode(key.publickey().export_key()).decode('utf-8')
         return private_key, public_key
 
+    @staticmethod
+    def key_scheme(encoded_key):
+        return "ed25519" if encoded_key.startswith(ED25519_PREFIX) else "rsa"
+
+    @staticmethod
+    def _decode_key(encoded_key):
+        if encoded_key.startswith(ED25519_PREFIX):
+            encoded_key = encoded_key[len(ED25519_PREFIX):]
+        return base64.b64decode(Crypto.add_padding(encoded_key).encode('utf-8'))
+
     @staticmethod
     def add_padding(base64_string):
         # Add padding to base64 string if required
@@ -21,25 +71,59 @@ class Crypto:
 
     @staticmethod
     def sign_transaction(private_key, message):
-        private_key = Crypto.add_padding(private_key)
-        private_key_bytes = base64.b64decode(private_key.encode('utf-8'))
-        key = RSA.import_key(private_key_bytes)
+        if Crypto.key_scheme(private_key) == "ed25519":
+            key = eddsa.import_private_key(Crypto._decode_key(private_key))
+            signature = eddsa.new(key, 'rfc8032').sign(message.encode('utf-8'))
+            return base64.b64encode(signature).decode('utf-8')
+        key = RSA.import_key(Crypto._decode_key(private_key))
         h = SHA256.new(message.encode('utf-8'))
         signature = pkcs1_15.new(key).sign(h)
         return base64.b64encode(signature).decode('utf-8')
 
+    @staticmethod
+    @functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+    def import_public_key(public_key):
+        """Parse an encoded public key (either scheme), caching the result per encoded key."""
+        if Crypto.key_scheme(public_key) == "ed25519":
+            return eddsa.import_public_key(Crypto._decode_key(public_key))
+        return RSA.import_key(Crypto._decode_key(public_key))
+
     @staticmethod
     def verify_signature(public_key, message, signature):
-        public_key = Crypto.add_padding(public_key)
-        public_key_bytes = base64.b64decode(public_key.encode('utf-8'))
-        key = RSA.import_key(public_key_bytes)
-        h = SHA256.new(message.encode('utf-8'))
+        key = Crypto.import_public_key(public_key)
         try:
-            pkcs1_15.new(key).verify(h, base64.b64decode(Crypto.add_padding(signature)))
+            signature_bytes = base64.b64decode(Crypto.add_padding(signature))
+            if Crypto.key_scheme(public_key) == "ed25519":
+                eddsa.new(key, 'rfc8032').verify(message.encode('utf-8'), signature_bytes)
+            else:
+                pkcs1_15.new(key).verify(SHA256.new(message.encode('utf-8')), signature_bytes)
             return True
         except (ValueError, TypeError):
             return False
-        
+
+    @staticmethod
+    def verify_signature_safe(public_key, message, signature):
+        """Like verify_signature, but a malformed key or signature counts as invalid."""
+        try:
+            return Crypto.verify_signature(public_key, message, signature)
+        except Exception:
+            return False
+
+    @staticmethod
+    def verify_batch(items):
+        """
+        Verify many ``(public_key, message, signature)`` tuples, returning a list of
+        booleans in the same order. Large batches are spread over a process pool.
+        """
+        items = list(items)
+        if len(items) < VERIFY_BATCH_MIN or VERIFY_WORKERS <= 1:
+            return _verify_chunk(items)
+        chunk_size = max(1, -(-len(items) // (VERIFY_WORKERS * 4)))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = []
+        for chunk_result in _verify_pool_executor().map(_verify_chunk, chunks):
+            results.extend(chunk_result)
+        return results
 
     @staticmethod
     def hash(data):
@@ -0,0 +1,113 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cryptolib.crypto import Crypto, DEFAULT_KEY_SCHEME
+
+
+logger = logging.getLogger(__name__)
+
+
+KEYPOOL_RESERVE = int(os.getenv('KEYPOOL_RESERVE', 100))
+KEYPOOL_WORKERS = int(os.getenv('KEYPOOL_WORKERS', os.cpu_count() or 1))
+# Keys generated per refill round
+KEYPOOL_BATCH = int(os.getenv('KEYPOOL_BATCH', 32))
+
+
+def _generate_keypairs(scheme, count):
+    return [Crypto.generate_keypair(scheme) for _ in range(count)]
+
+
+class KeyPool:
+    """
+    Keeps a reserve of ready keypairs so wallet creation does not wait for key
+    generation. A background thread tops the reserve up using worker processes;
+    ``take`` falls back to generating inline only when the reserve is empty.
+    """
+
+    def __init__(self, scheme=None, reserve=KEYPOOL_RESERVE, workers=KEYPOOL_WORKERS, batch=KEYPOOL_BATCH):
+        self.scheme = scheme or DEFAULT_KEY_SCHEME
+        self.reserve = reserve
+        self.workers = max(1, workers)
+        self.batch = max(1, batch)
+        self._keys = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._executor = None
+        self.generated = 0
+        self.taken = 0
+        self.fallbacks = 0
+        self.refill_rate = 0.0
+
+    def start(self):
+        if self._thread is not None or self.reserve <= 0:
+            return self
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._thread = threading.Thread(target=self._refill_loop, name="key-pool-refill", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def take(self, scheme=None):
+        """Return a ``(private_key, public_key)`` pair, from the reserve when possible."""
+        if scheme is None or scheme == self.scheme:
+            with self._cond:
+                if self._keys:
+                    self.taken += 1
+                    keypair = self._keys.popleft()
+                    self._cond.notify()
+                    return keypair
+                self.fallbacks += 1
+        return Crypto.generate_keypair(scheme or self.scheme)
+
+    def _refill_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and len(self._keys) >= self.reserve:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                needed = self.reserve - len(self._keys)
+            # One batch per worker process, at most what the reserve is missing
+            rounds = min(self.workers, -(-needed // self.batch))
+            counts = [min(self.batch, needed - i * self.batch) for i in range(rounds)]
+            started = time.perf_counter()
+            try:
+                batches = list(self._executor.map(_generate_keypairs, [self.scheme] * len(counts), counts))
+            except Exception as e:
+                logger.error("Key pool refill failed: %s", e)
+                time.sleep(1)
+                continue
+            elapsed = time.perf_counter() - started
+            produced = sum(len(keys) for keys in batches)
+            with self._cond:
+                for keys in batches:
+                    self._keys.extend(keys)
+                self.generated += produced
+                self.refill_rate = produced / elapsed if elapsed else 0.0
+
+    def stats(self):
+        with self._cond:
+            return {
+                "scheme": self.scheme,
+                "depth": len(self._keys),
+                "reserve": self.reserve,
+                "workers": self.workers,
+                "generated": self.generated,
+                "taken": self.taken,
+                "fallbacks": self.fallbacks,
+                "refill_rate": self.refill_rate,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,606 @@
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from array import array
+from database.storage import Storage
+
+
+logger = logging.getLogger(__name__)
+
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'data')
+# Seconds between fsyncs; writes in between share one. 0 fsyncs after every write
+STORAGE_FSYNC_INTERVAL = float(os.getenv('STORAGE_FSYNC_INTERVAL', 0.1))
+# The state log is rewritten once it holds this many records per live key (and at least STATE_COMPACT_MIN)
+STATE_COMPACT_RATIO = int(os.getenv('STORAGE_STATE_COMPACT_RATIO', 4))
+STATE_COMPACT_MIN = 10000
+
+# Block record header: payload length and CRC32. The payload is the block header as JSON, a newline,
+# then the transactions as JSON, so headers can be read without parsing bodies
+RECORD_HEADER = struct.Struct("<II")
+# One index entry per height: offset and length of the block's record in the log
+INDEX_ENTRY = struct.Struct("<QI")
+
+MEMPOOL_PREFIX = "mempool:"
+WALLET_DELTA_PREFIX = "wallet_delta:"
+WALLET_CHECKPOINT_KEY = "wallets_checkpoint"
+CHAIN_CHECKPOINT_PREFIX = "checkpoint:"
+# Host parameters per lookup statement; SQLite's limit is 999 in older builds
+SQL_BATCH = 500
+
+TX_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (height INTEGER PRIMARY KEY, hash TEXT NOT NULL, entries TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS txids (txid TEXT PRIMARY KEY, height INTEGER NOT NULL, position INTEGER NOT NULL)
+    WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS txids_by_height ON txids (height);
+CREATE TABLE IF NOT EXISTS addresses (address TEXT NOT NULL, height INTEGER NOT NULL, position INTEGER NOT NULL,
+    PRIMARY KEY (address, height, position)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS addresses_by_height ON addresses (height);
+"""
+
+
+def _open(path):
+    """Open ``path`` for reading and writing, creating it if needed but never truncating it."""
+    return open(path, "r+b" if os.path.exists(path) else "w+b")
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class BlockLog:
+    """
+    Records (blocks, by default) appended to ``<name>.log`` in height order and
+    located through ``<name>.idx``, a flat array of (offset, length) entries, so finding a height
+    is arithmetic rather than a search. Reads go through a memory map of the log.
+    Rewriting a height truncates both files there, so the log never holds blocks
+    orphaned by a reorg.
+    """
+
+    def __init__(self, directory, name="blocks"):
+        self.name = name
+        self.log = _open(os.path.join(directory, name + ".log"))
+        self.index = _open(os.path.join(directory, name + ".idx"))
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.size = 0
+        self._map = None
+        self._recover()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _recover(self):
+        """Load the index, dropping whatever a crash left half-written at the end of either file."""
+        data = self.index.read()
+        data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+        for offset, length in INDEX_ENTRY.iter_unpack(data):
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        log_size = self.log.seek(0, os.SEEK_END)
+        count = len(self.offsets)
+        while count and not self._intact(count - 1, log_size):
+            count -= 1
+        if count < len(self.offsets):
+            logger.warning("Dropping %d incomplete records from the end of %s.log", len(self.offsets) - count, self.name)
+        del self.offsets[count:]
+        del self.lengths[count:]
+        self.size = self.offsets[-1] + self.lengths[-1] if count else 0
+        self.log.truncate(self.size)
+        self.index.truncate(count * INDEX_ENTRY.size)
+
+    def _intact(self, height, log_size):
+        offset, length = self.offsets[height], self.lengths[height]
+        if offset + length > log_size:
+            return False
+        self.log.seek(offset)
+        return self._payload(self.log.read(length)) is not None
+
+    @staticmethod
+    def _payload(record):
+        """The payload of ``record``, or None if its length or checksum is wrong."""
+        if len(record) < RECORD_HEADER.size:
+            return None
+        length, checksum = RECORD_HEADER.unpack_from(record)
+        payload = record[RECORD_HEADER.size:]
+        if length != len(payload) or zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def append(self, height, payload):
+        if height < len(self.offsets):
+            self.truncate(height)
+        elif height > len(self.offsets):
+            raise ValueError(f"Height {height} would leave a gap after height {len(self.offsets) - 1} in {self.name}.log")
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        self.log.seek(self.size)
+        self.log.write(record)
+        self.index.seek(height * INDEX_ENTRY.size)
+        self.index.write(INDEX_ENTRY.pack(self.size, len(record)))
+        self.offsets.append(self.size)
+        self.lengths.append(len(record))
+        self.size += len(record)
+
+    def truncate(self, height):
+        """Drop the records at ``height`` and above."""
+        if height >= len(self.offsets):
+            return
+        self._unmap()
+        self.size = self.offsets[height]
+        del self.offsets[height:]
+        del self.lengths[height:]
+        self.log.truncate(self.size)
+        self.index.truncate(height * INDEX_ENTRY.size)
+
+    def read(self, height):
+        offset, length = self.offsets[height], self.lengths[height]
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        payload = self._payload(self._map[offset:offset + length])
+        if payload is None:
+            raise ValueError(f"Height {height} is corrupt in {self.name}.log")
+        return payload
+
+    def read_header(self, height):
+        """The payload up to its first newline. Skips the checksum, which would mean reading the whole body."""
+        offset, length = self.offsets[height], self.lengths[height]
+        if self._map is None or offset + length > len(self._map):
+            self._remap()
+        start, stop = offset + RECORD_HEADER.size, offset + length
+        newline = self._map.find(b"\n", start, stop)
+        return self._map[start:stop if newline == -1 else newline]
+
+    def _remap(self):
+        # Appends may still sit in the file object's buffer, where the map cannot see them
+        self.log.flush()
+        self._unmap()
+        self._map = mmap.mmap(self.log.fileno(), self.size, access=mmap.ACCESS_READ)
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def sync(self):
+        # The log first, so a durable index entry never points past durable data
+        for f in (self.log, self.index):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self._unmap()
+        self.log.close()
+        self.index.close()
+
+
+class StateLog:
+    """
+    Small mutable records (pending transactions, balances, chain checkpoints) kept
+    as JSON put/delete lines and replayed into a dict at startup. Once superseded
+    lines dominate, the live records are written to a new file that atomically
+    replaces the old one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        self.records = 0
+        if os.path.exists(path):
+            self._replay()
+        self.file = open(path, "ab")
+
+    def _replay(self):
+        intact = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("no line terminator")
+                    record = json.loads(line)
+                except ValueError:
+                    # Only the last line can be torn, by a crash mid-write; cut it off so appends start clean
+                    logger.warning("Discarding a torn record at the end of %s", self.path)
+                    break
+                if "v" in record:
+                    self.values[record["k"]] = record["v"]
+                else:
+                    self.values.pop(record["k"], None)
+                self.records += 1
+                intact += len(line)
+        os.truncate(self.path, intact)
+
+    @staticmethod
+    def _line(record):
+        return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+    def put(self, key, value):
+        self.values[key] = value
+        self.file.write(self._line({"k": key, "v": value}))
+        self.records += 1
+
+    def delete(self, key):
+        if self.values.pop(key, None) is not None:
+            self.file.write(self._line({"k": key}))
+            self.records += 1
+
+    def with_prefix(self, prefix):
+        return [(key, value) for key, value in self.values.items() if key.startswith(prefix)]
+
+    def maybe_compact(self):
+        if self.records > max(STATE_COMPACT_MIN, STATE_COMPACT_RATIO * len(self.values)):
+            self.compact()
+
+    def compact(self):
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            for key, value in self.values.items():
+                f.write(self._line({"k": key, "v": value}))
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temporary, self.path)
+        _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+        self.file = open(self.path, "ab")
+        logger.debug("Compacted %s from %d to %d records", self.path, self.records, len(self.values))
+        self.records = len(self.values)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class IndexDatabase:
+    """
+    The transaction index in SQLite: each block's record, plus tables of
+    transaction ids (first confirmation only) and of the transactions each
+    address sent or received, so lookups never load the whole index. Callers
+    serialize access; ``sync`` checkpoints the write-ahead log to disk.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Durability comes from ``sync``, as for the logs
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(TX_INDEX_SCHEMA)
+
+    def save(self, height, block_hash, entries):
+        with self.db:
+            self._delete_from(height)
+            self.db.execute("INSERT INTO blocks VALUES (?, ?, ?)",
+                            (height, block_hash, json.dumps(entries, separators=(",", ":"))))
+            self.db.executemany("INSERT OR IGNORE INTO txids VALUES (?, ?, ?)",
+                                [(txid, height, position) for position, (txid, _, _) in enumerate(entries)])
+            self.db.executemany("INSERT OR IGNORE INTO addresses VALUES (?, ?, ?)",
+                                [(address, height, position) for position, (_, sender, recipient) in enumerate(entries)
+                                 for address in {sender, recipient}])
+
+    def delete_from(self, height):
+        with self.db:
+            self._delete_from(height)
+
+    def _delete_from(self, height):
+        for table in ("blocks", "txids", "addresses"):
+            self.db.execute(f"DELETE FROM {table} WHERE height >= ?", (height,))
+
+    def height(self):
+        return self.db.execute("SELECT COALESCE(MAX(height), -1) FROM blocks").fetchone()[0]
+
+    def block_hash(self, height):
+        row = self.db.execute("SELECT hash FROM blocks WHERE height = ?", (height,)).fetchone()
+        return None if row is None else row[0]
+
+    def records(self, start):
+        rows = self.db.execute("SELECT height, hash, entries FROM blocks WHERE height >= ? ORDER BY height", (start,))
+        return [{"height": height, "hash": block_hash, "entries": json.loads(entries)}
+                for height, block_hash, entries in rows]
+
+    def locate(self, txids):
+        txids = list(txids)
+        found = {}
+        for i in range(0, len(txids), SQL_BATCH):
+            batch = txids[i:i + SQL_BATCH]
+            rows = self.db.execute(f"SELECT txid, height, position FROM txids WHERE txid IN ({','.join('?' * len(batch))})",
+                                   batch)
+            found.update((txid, (height, position)) for txid, height, position in rows)
+        return found
+
+    def address_page(self, address, below, limit, before):
+        total = self.db.execute("SELECT COUNT(*) FROM addresses WHERE address = ? AND height < ?",
+                                (address, below)).fetchone()[0]
+        height, position = before if before is not None else (below, 0)
+        rows = self.db.execute(
+            "SELECT height, position FROM addresses WHERE address = ? AND (height < ? OR (height = ? AND position < ?))"
+            " AND height < ? ORDER BY height DESC, position DESC LIMIT ?",
+            (address, height, height, position, below, limit))
+        return [tuple(row) for row in rows], total
+
+    def sync(self):
+        self.db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self.db.close()
+
+
+class LogStorage(Storage):
+    """
+    Embedded storage in a local directory; no database server needed.
+
+    * ``blocks.log`` / ``blocks.idx``    blocks and their height index (see ``BlockLog``)
+    * ``txindex.db``                   the transaction index (see ``IndexDatabase``)
+    * ``state.log``                    mempool, balances and checkpoints (see ``StateLog``)
+
+    Writes reach the OS immediately and a background thread fsyncs every
+    ``fsync_interval`` seconds, so a burst of writes shares one fsync; ``flush``
+    forces it. A crash loses at most the last interval of writes.
+    """
+
+    def __init__(self, path=None, fsync_interval=None):
+        self.path = path or STORAGE_PATH
+        os.makedirs(self.path, exist_ok=True)
+        self.fsync_interval = STORAGE_FSYNC_INTERVAL if fsync_interval is None else fsync_interval
+        self.blocks = BlockLog(self.path)
+        self.tx_index = IndexDatabase(os.path.join(self.path, "txindex.db"))
+        self._remove_old_tx_index()
+        self.state = StateLog(os.path.join(self.path, "state.log"))
+        # Deltas recorded since the last wallet checkpoint, deleted when the next one lands
+        self._wallet_delta_keys = sorted(key for key, _ in self.state.with_prefix(WALLET_DELTA_PREFIX))
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # Writes since the last fsync
+        self._dirty = 0
+        self._closed = False
+        self._syncer = None
+        if self.fsync_interval > 0:
+            self._syncer = threading.Thread(target=self._sync_loop, name="storage-fsync", daemon=True)
+            self._syncer.start()
+        logger.info("Opened log storage in %s (%d blocks)", self.path, len(self.blocks))
+
+    def _remove_old_tx_index(self):
+        """Drop the transaction index of older versions, a log of records; the node rebuilds it from the blocks."""
+        for name in ("txindex.log", "txindex.idx"):
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                os.remove(path)
+                logger.info("Removed the old transaction index file %s", path)
+
+    def _sync_loop(self):
+        with self._lock:
+            while not self._closed:
+                self._wake.wait(self.fsync_interval)
+                if self._dirty:
+                    self._sync()
+
+    def _sync(self):
+        try:
+            self.blocks.sync()
+            self.tx_index.sync()
+            self.state.sync()
+            self._dirty = 0
+        except Exception as e:
+            logger.error("Error syncing log storage: %s", e)
+
+    def _wrote(self, count=1):
+        """Account for writes just made; the caller holds the lock."""
+        self._dirty += count
+        if self.fsync_interval <= 0:
+            self._sync()
+
+    def pending_writes(self):
+        return self._dirty
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._sync()
+        return self._dirty == 0
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            self._sync()
+            self.blocks.close()
+            self.tx_index.close()
+            self.state.close()
+
+    @staticmethod
+    def _encode(block):
+        # json.dumps escapes newlines inside strings, so the first newline always ends the header
+        return (json.dumps(block.header(), separators=(",", ":")).encode() + b"\n"
+                + json.dumps(block.transactions, separators=(",", ":")).encode())
+
+    @staticmethod
+    def _decode(payload):
+        header, newline, transactions = payload.partition(b"\n")
+        block = json.loads(header)
+        # Records written before headers were split out hold the whole block on one line
+        if newline:
+            block["transactions"] = json.loads(transactions)
+        return block
+
+    def save_block(self, block):
+        self.save_blocks([block])
+
+    def save_blocks(self, blocks):
+        try:
+            with self._lock:
+                for block in blocks:
+                    self.blocks.append(block.index, self._encode(block))
+                self._wrote(len(blocks))
+            logger.debug("Saved %d blocks to the block log.", len(blocks))
+        except Exception as e:
+            logger.error("Error saving blocks: %s", e)
+
+    def load_blocks(self):
+        try:
+            with self._lock:
+                return [self._decode(self.blocks.read(height)) for height in range(len(self.blocks))]
+        except Exception as e:
+            logger.error("Error loading blocks: %s", e)
+            return []
+
+    def load_block(self, height):
+        try:
+            with self._lock:
+                if height >= len(self.blocks):
+                    return None
+                return self._decode(self.blocks.read(height))
+        except Exception as e:
+            logger.error("Error loading block %d: %s", height, e)
+            return None
+
+    def load_headers(self):
+        try:
+            with self._lock:
+                headers = [json.loads(self.blocks.read_header(height)) for height in range(len(self.blocks))]
+            for header in headers:
+                header.pop("transactions", None)
+            return headers
+        except Exception as e:
+            logger.error("Error loading block headers: %s", e)
+            return []
+
+    def save_tx_index(self, height, block_hash, entries):
+        try:
+            with self._lock:
+                self.tx_index.save(height, block_hash, entries)
+                self._wrote()
+        except Exception as e:
+            logger.error("Error saving transaction index: %s", e)
+
+    def delete_tx_index_from(self, height):
+        try:
+            with self._lock:
+                self.tx_index.delete_from(height)
+                self._wrote()
+        except Exception as e:
+            logger.error("Error deleting transaction index: %s", e)
+
+    def tx_index_height(self):
+        try:
+            with self._lock:
+                return self.tx_index.height()
+        except Exception as e:
+            logger.error("Error reading the transaction index height: %s", e)
+            return -1
+
+    def tx_index_hash(self, height):
+        try:
+            with self._lock:
+                return self.tx_index.block_hash(height)
+        except Exception as e:
+            logger.error("Error reading transaction index record %d: %s", height, e)
+            return None
+
+    def load_tx_index(self, start=0):
+        try:
+            with self._lock:
+                return self.tx_index.records(start)
+        except Exception as e:
+            logger.error("Error loading transaction index: %s", e)
+            return []
+
+    def locate_transactions(self, txids):
+        with self._lock:
+            return self.tx_index.locate(txids)
+
+    def address_transactions(self, address, below, limit, before=None):
+        with self._lock:
+            return self.tx_index.address_page(address, below, limit, before)
+
+    def _update_state(self, puts=(), deletes=()):
+        with self._lock:
+            for key in deletes:
+                self.state.delete(key)
+            for key, value in puts:
+                self.state.put(key, value)
+            self.state.maybe_compact()
+            self._wrote()
+
+    def save_pending_transactions(self, transactions):
+        try:
+            self._update_state(puts=[(MEMPOOL_PREFIX + tx_id, tx) for tx_id, tx in transactions])
+        except Exception as e:
+            logger.error("Error saving pending transactions: %s", e)
+
+    def delete_pending_transactions(self, tx_ids):
+        try:
+            self._update_state(deletes=[MEMPOOL_PREFIX + tx_id for tx_id in tx_ids])
+        except Exception as e:
+            logger.error("Error deleting pending transactions: %s", e)
+
+    def replace_pending_transactions(self, transactions):
+        try:
+            wanted = {MEMPOOL_PREFIX + tx_id: tx for tx_id, tx in transactions}
+            stale = [key for key, _ in self.state.with_prefix(MEMPOOL_PREFIX) if key not in wanted]
+            self._update_state(puts=wanted.items(), deletes=stale)
+        except Exception as e:
+            logger.error("Error replacing pending transactions: %s", e)
+
+    def load_pending_transactions(self):
+        return [tx for _, tx in self.state.with_prefix(MEMPOOL_PREFIX)]
+
+    def save_wallet_delta(self, seq, deltas):
+        try:
+            key = f"{WALLET_DELTA_PREFIX}{seq:012d}"
+            self._update_state(puts=[(key, {"seq": seq, "deltas": deltas})])
+            self._wallet_delta_keys.append(key)
+        except Exception as e:
+            logger.error("Error saving wallet delta: %s", e)
+
+    def save_wallet_checkpoint(self, seq, wallets):
+        try:
+            self._update_state(puts=[(WALLET_CHECKPOINT_KEY, {"seq": seq, "wallets": dict(wallets)})],
+                               deletes=self._wallet_delta_keys)
+            self._wallet_delta_keys = []
+        except Exception as e:
+            logger.error("Error saving wallet checkpoint: %s", e)
+
+    def load_wallets(self):
+        checkpoint = self.state.values.get(WALLET_CHECKPOINT_KEY)
+        if checkpoint is None:
+            return 0, None
+        seq, wallets = checkpoint["seq"], dict(checkpoint["wallets"])
+        for _, delta in sorted(self.state.with_prefix(WALLET_DELTA_PREFIX)):
+            if delta["seq"] <= checkpoint["seq"]:
+                continue
+            for address, amount in delta["deltas"].items():
+                wallets[address] = wallets.get(address, 0) + amount
+            seq = delta["seq"]
+        return seq, wallets
+
+    def save_chain_checkpoint(self, height, block_hash, wallets):
+        try:
+            self._update_state(puts=[(f"{CHAIN_CHECKPOINT_PREFIX}{height:010d}",
+                                      {"height": height, "hash": block_hash, "wallets": dict(wallets)})])
+        except Exception as e:
+            logger.error("Error saving chain checkpoint: %s", e)
+
+    def delete_chain_checkpoint(self, height):
+        try:
+            self._update_state(deletes=[f"{CHAIN_CHECKPOINT_PREFIX}{height:010d}"])
+        except Exception as e:
+            logger.error("Error deleting chain checkpoint: %s", e)
+
+    def load_chain_checkpoints(self):
+        return {
+            checkpoint["height"]: {"hash": checkpoint["hash"], "wallets": checkpoint["wallets"]}
+            for _, checkpoint in sorted(self.state.with_prefix(CHAIN_CHECKPOINT_PREFIX))
+        }
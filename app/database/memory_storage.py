@@ -0,0 +1,109 @@
+from bisect import bisect_left
+from database.storage import Storage
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps everything in dicts and persists nothing. For benchmarks, throwaway
+    nodes and tests; ``chain`` preloads blocks as if the node were restarting on
+    an existing chain.
+    """
+
+    def __init__(self, chain=()):
+        self.blocks = {block.index: block.to_dict() for block in chain}
+        self.tx_index = {}
+        # Txid -> (height, position) of its first confirmation, and address -> sorted (height, position)
+        self.tx_locations = {}
+        self.address_locations = {}
+        self.pending = {}
+        self.wallet_seq = 0
+        self.wallets = None
+        self.wallet_deltas = {}
+        self.chain_checkpoints = {}
+
+    def save_block(self, block):
+        self.blocks[block.index] = block.to_dict()
+
+    def load_blocks(self):
+        return [dict(self.blocks[height]) for height in sorted(self.blocks)]
+
+    def load_block(self, height):
+        return self.blocks.get(height)
+
+    def save_tx_index(self, height, block_hash, entries):
+        self.delete_tx_index_from(height)
+        self.tx_index[height] = {"hash": block_hash, "entries": entries}
+        for position, (txid, sender, recipient) in enumerate(entries):
+            self.tx_locations.setdefault(txid, (height, position))
+            for address in {sender, recipient}:
+                self.address_locations.setdefault(address, []).append((height, position))
+
+    def delete_tx_index_from(self, height):
+        for indexed in sorted((h for h in self.tx_index if h >= height), reverse=True):
+            for txid, sender, recipient in self.tx_index.pop(indexed)["entries"]:
+                if self.tx_locations.get(txid, (-1,))[0] == indexed:
+                    del self.tx_locations[txid]
+                for address in (sender, recipient):
+                    locations = self.address_locations.get(address, [])
+                    while locations and locations[-1][0] >= indexed:
+                        locations.pop()
+
+    def tx_index_height(self):
+        return max(self.tx_index, default=-1)
+
+    def tx_index_hash(self, height):
+        record = self.tx_index.get(height)
+        return None if record is None else record["hash"]
+
+    def load_tx_index(self, start=0):
+        return [dict(self.tx_index[height], height=height) for height in sorted(self.tx_index) if height >= start]
+
+    def locate_transactions(self, txids):
+        return {txid: self.tx_locations[txid] for txid in txids if txid in self.tx_locations}
+
+    def address_transactions(self, address, below, limit, before=None):
+        locations = self.address_locations.get(address, [])
+        total = bisect_left(locations, (below, 0))
+        end = total if before is None else bisect_left(locations, tuple(before), 0, total)
+        return locations[max(0, end - limit):end][::-1], total
+
+    def save_pending_transactions(self, transactions):
+        for tx_id, transaction in transactions:
+            self.pending[tx_id] = transaction
+
+    def delete_pending_transactions(self, tx_ids):
+        for tx_id in tx_ids:
+            self.pending.pop(tx_id, None)
+
+    def replace_pending_transactions(self, transactions):
+        self.pending = dict(transactions)
+
+    def load_pending_transactions(self):
+        return list(self.pending.values())
+
+    def save_wallet_delta(self, seq, deltas):
+        self.wallet_deltas[seq] = dict(deltas)
+
+    def save_wallet_checkpoint(self, seq, wallets):
+        self.wallet_seq = seq
+        self.wallets = dict(wallets)
+        self.wallet_deltas = {}
+
+    def load_wallets(self):
+        if self.wallets is None:
+            return 0, None
+        seq, wallets = self.wallet_seq, dict(self.wallets)
+        for delta_seq in sorted(self.wallet_deltas):
+            for address, delta in self.wallet_deltas[delta_seq].items():
+                wallets[address] = wallets.get(address, 0) + delta
+            seq = delta_seq
+        return seq, wallets
+
+    def save_chain_checkpoint(self, height, block_hash, wallets):
+        self.chain_checkpoints[height] = {"hash": block_hash, "wallets": dict(wallets)}
+
+    def delete_chain_checkpoint(self, height):
+        self.chain_checkpoints.pop(height, None)
+
+    def load_chain_checkpoints(self):
+        return {height: self.chain_checkpoints[height] for height in sorted(self.chain_checkpoints)}
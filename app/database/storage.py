@@ -0,0 +1,148 @@
+import os
+
+
+# "couchdb" (default), "log" for the embedded append-only engine, or "memory" (nothing persisted)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'couchdb')
+STORAGE_BACKENDS = ("couchdb", "log", "memory")
+
+
+class Storage:
+    """
+    What ``Blockchain`` needs from a storage backend.
+
+    Blocks are stored by height. Saving a height that is already stored replaces
+    that block and may discard the blocks above it, so after a reorg callers save
+    every block from the fork up. Transaction index records follow the same rule
+    and are also searchable by transaction id and by address.
+    Pending transactions are keyed by transaction id. Balances are a full
+    checkpoint plus numbered deltas recorded after it; chain checkpoints are
+    balances as of a block height. Write methods may return before the data is
+    durable; ``flush`` waits for it.
+    """
+
+    def save_block(self, block):
+        raise NotImplementedError
+
+    def save_blocks(self, blocks):
+        for block in blocks:
+            self.save_block(block)
+
+    def load_blocks(self):
+        """Every stored block as a dict, in height order."""
+        raise NotImplementedError
+
+    def load_block(self, height):
+        """The block at ``height`` as a dict, or None."""
+        raise NotImplementedError
+
+    def load_headers(self):
+        """Every stored block without its transactions, in height order."""
+        headers = []
+        for block in self.load_blocks():
+            del block["transactions"]
+            headers.append(block)
+        return headers
+
+    def save_tx_index(self, height, block_hash, entries):
+        """Store the transaction index entries (``[txid, sender, recipient]`` each) of the block at ``height``."""
+        raise NotImplementedError
+
+    def delete_tx_index_from(self, height):
+        raise NotImplementedError
+
+    def tx_index_height(self):
+        """Height of the highest stored index record, or -1."""
+        raise NotImplementedError
+
+    def tx_index_hash(self, height):
+        """Hash of the block the index record at ``height`` was made from, or None."""
+        raise NotImplementedError
+
+    def load_tx_index(self, start=0):
+        """Index records from ``start`` up as ``{"height": ..., "hash": ..., "entries": ...}``, in height order."""
+        raise NotImplementedError
+
+    def locate_transactions(self, txids):
+        """
+        ``{txid: (height, position)}`` for the indexed ones among ``txids``, at their first
+        confirmation. Errors are raised, not logged: "not confirmed" must be a real answer.
+        """
+        raise NotImplementedError
+
+    def address_transactions(self, address, below, limit, before=None):
+        """
+        Up to ``limit`` ``(height, position)`` of indexed transactions sent or received by
+        ``address`` below height ``below``, newest first and older than ``before`` (a
+        ``(height, position)``) if given. Returns ``(locations, total)``, ``total`` counting
+        all of them below ``below``.
+        """
+        raise NotImplementedError
+
+    def save_pending_transactions(self, transactions):
+        """Store ``(tx_id, transaction)`` pairs."""
+        raise NotImplementedError
+
+    def delete_pending_transactions(self, tx_ids):
+        raise NotImplementedError
+
+    def replace_pending_transactions(self, transactions):
+        """Make the stored mempool match the ``(tx_id, transaction)`` pairs exactly."""
+        raise NotImplementedError
+
+    def load_pending_transactions(self):
+        raise NotImplementedError
+
+    def save_wallet_delta(self, seq, deltas):
+        raise NotImplementedError
+
+    def save_wallet_checkpoint(self, seq, wallets):
+        """Store full balances as of ``seq``; the deltas it supersedes may be dropped."""
+        raise NotImplementedError
+
+    def load_wallets(self):
+        """Return ``(seq, wallets)`` rebuilt from the checkpoint plus later deltas, or ``(0, None)``."""
+        raise NotImplementedError
+
+    def save_chain_checkpoint(self, height, block_hash, wallets):
+        raise NotImplementedError
+
+    def delete_chain_checkpoint(self, height):
+        raise NotImplementedError
+
+    def load_chain_checkpoints(self):
+        """Return ``{height: {"hash": ..., "wallets": ...}}`` in ascending height order."""
+        raise NotImplementedError
+
+    def load_legacy_state(self):
+        """The single-document state of old CouchDB deployments; other backends never have one."""
+        return None
+
+    def delete_legacy_state(self):
+        pass
+
+    def pending_writes(self):
+        """Writes accepted but not yet durable."""
+        return 0
+
+    def flush(self):
+        """Block until every write so far is durable."""
+        return True
+
+    def close(self):
+        self.flush()
+
+
+def create_storage(backend=None):
+    """Build the backend named by ``backend`` or ``STORAGE_BACKEND``."""
+    backend = backend or STORAGE_BACKEND
+    # Imported here so a node only needs the client library of the backend it uses
+    if backend == "couchdb":
+        from database.couchdb_handler import CouchDBHandler
+        return CouchDBHandler()
+    if backend == "log":
+        from database.log_storage import LogStorage
+        return LogStorage()
+    if backend == "memory":
+        from database.memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {STORAGE_BACKENDS}")
@@ -0,0 +1,268 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+DURABILITY_MODES = ("sync", "group", "async")
+
+COMMIT_SECONDS = metrics.histogram('couchdb_commit_seconds', 'Latency of one _bulk_docs commit')
+COMMITTED_DOCS = metrics.counter('couchdb_committed_docs_total', 'Documents written or deleted in CouchDB')
+FLUSH_ERRORS = metrics.counter('couchdb_flush_errors_total', 'Flushes that failed and were requeued')
+
+
+class WriteConflict(Exception):
+    """Documents CouchDB still refused after their revisions were refreshed and the write retried."""
+
+    def __init__(self, docs):
+        super().__init__(f"{len(docs)} documents conflicted twice: {', '.join(doc['_id'] for doc in docs[:5])}")
+        self.docs = docs
+
+
+class WriteBehindQueue:
+    """
+    Buffers CouchDB document writes and commits them with ``_bulk_docs`` from a
+    background thread.
+
+    Writes to the same document id are coalesced so only the latest version is
+    sent. Revisions returned by CouchDB are cached, so an update never needs a
+    read first. ``durability`` controls what ``put`` waits for:
+
+    * ``sync``   commit the write in the caller's thread before returning
+    * ``group``  wait for the background flush that includes the write, so
+                 concurrent writers share one request
+    * ``async``  return immediately; the write is committed on the next flush
+
+    In ``sync`` and ``group`` mode a write that could not be committed raises
+    from ``put``/``delete``; the documents are requeued for the next flush.
+    """
+
+    def __init__(self, db, durability="async", flush_interval=0.5, flush_bytes=1024 * 1024):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}, expected one of {DURABILITY_MODES}")
+        self.db = db
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.revs = {}
+        self._pending = {}
+        # The batch being committed, readable through ``queued`` until CouchDB has it
+        self._in_flight = {}
+        self._pending_bytes = 0
+        self._waiters = 0
+        self._queued_generation = 0
+        # (generation, future) of writes whose caller waits for the outcome of their flush
+        self._outcomes = []
+        self._flush_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        if durability != "sync":
+            self._thread = threading.Thread(target=self._run, name="couchdb-write-behind", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, doc):
+        """Queue a full document for writing."""
+        self._enqueue(doc, len(json.dumps(doc)))
+
+    def delete(self, doc_id):
+        """Queue a deletion; the revision is resolved from the cache at flush time."""
+        self._enqueue({"_id": doc_id, "_deleted": True}, len(doc_id))
+
+    def _enqueue(self, doc, size):
+        with self._cond:
+            previous = self._pending.get(doc["_id"])
+            if previous is not None:
+                self._pending_bytes -= previous[1]
+            if doc.get("_deleted") and previous is not None and doc["_id"] not in self.revs:
+                # Created and deleted between flushes: nothing ever needs to reach CouchDB
+                del self._pending[doc["_id"]]
+                return
+            self._pending[doc["_id"]] = (doc, size)
+            self._pending_bytes += size
+            self._queued_generation += 1
+            outcome = None
+            if self.durability != "async":
+                outcome = Future()
+                self._outcomes.append((self._queued_generation, outcome))
+            if self._pending_bytes >= self.flush_bytes:
+                self._cond.notify_all()
+
+        if self.durability == "sync" or self._closed:
+            self.flush()
+        if outcome is not None:
+            self._wait_for(outcome)
+
+    def _wait_for(self, outcome):
+        """Wait for the flush that includes a write; raises if that flush failed."""
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                while not outcome.done() and not self._closed:
+                    self._cond.wait(self.flush_interval)
+            finally:
+                self._waiters -= 1
+        if not outcome.done():
+            # Closed with the write still queued; no background flush will pick it up
+            self.flush()
+        outcome.result()
+
+    def _settle(self, generation, error=None):
+        """Resolve the waiting writes flushed up to ``generation``: committed, or failed with ``error``."""
+        with self._cond:
+            settled = [future for queued, future in self._outcomes if queued <= generation]
+            self._outcomes = [(queued, future) for queued, future in self._outcomes if queued > generation]
+            self._cond.notify_all()
+        for future in settled:
+            if error is None:
+                future.set_result(True)
+            else:
+                future.set_exception(error)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def queued(self, doc_id):
+        """
+        The newest version of a document not yet committed to CouchDB (a deletion is
+        ``{"_id": ..., "_deleted": True}``), or None if no write of it is outstanding.
+        """
+        with self._cond:
+            entry = self._pending.get(doc_id)
+            return entry[0] if entry is not None else self._in_flight.get(doc_id)
+
+    def queued_in_range(self, startkey, endkey):
+        """Outstanding writes of the documents with ids from ``startkey`` to ``endkey``, by id."""
+        with self._cond:
+            docs = {doc_id: doc for doc_id, doc in self._in_flight.items() if startkey <= doc_id <= endkey}
+            docs.update((doc_id, doc) for doc_id, (doc, _) in self._pending.items() if startkey <= doc_id <= endkey)
+            return docs
+
+    def flush(self):
+        """Commit everything queued so far in one ``_bulk_docs`` request."""
+        with self._flush_lock:
+            with self._cond:
+                batch = [doc for doc, _ in self._pending.values()]
+                generation = self._queued_generation
+                self._in_flight = {doc["_id"]: doc for doc in batch}
+                self._pending = {}
+                self._pending_bytes = 0
+            if batch:
+                try:
+                    with COMMIT_SECONDS.time():
+                        self._commit(batch)
+                    COMMITTED_DOCS.inc(amount=len(batch))
+                except WriteConflict as e:
+                    FLUSH_ERRORS.inc()
+                    COMMITTED_DOCS.inc(amount=len(batch) - len(e.docs))
+                    logger.error("Lost a write race in CouchDB; requeued: %s", e)
+                    self._requeue(e.docs)
+                    self._settle(generation, e)
+                    return False
+                except Exception as e:
+                    FLUSH_ERRORS.inc()
+                    logger.error("Error flushing %d documents to CouchDB: %s", len(batch), e)
+                    self._requeue(batch)
+                    self._settle(generation, e)
+                    return False
+            with self._cond:
+                self._in_flight = {}
+            self._settle(generation)
+            return True
+
+    def _requeue(self, batch):
+        with self._cond:
+            for doc in batch:
+                if doc["_id"] not in self._pending:
+                    self._pending[doc["_id"]] = (doc, 0)
+            self._in_flight = {}
+
+    def _commit(self, batch):
+        missing = [doc["_id"] for doc in batch if doc["_id"] not in self.revs and doc.get("_deleted")]
+        if missing:
+            self._refresh_revs(missing)
+        docs = self._with_revs(batch)
+        conflicts = self._apply_results(docs, self.db.update(docs))
+        if conflicts:
+            # Another writer changed these documents; pick up their revisions and retry once
+            self._refresh_revs([doc["_id"] for doc in conflicts])
+            docs = self._with_revs(conflicts)
+            conflicts = self._apply_results(docs, self.db.update(docs))
+            if conflicts:
+                raise WriteConflict(conflicts)
+
+    def _with_revs(self, batch):
+        docs = []
+        for doc in batch:
+            rev = self.revs.get(doc["_id"])
+            if doc.get("_deleted") and rev is None:
+                continue
+            doc = dict(doc)
+            if rev is not None:
+                doc["_rev"] = rev
+            else:
+                doc.pop("_rev", None)
+            docs.append(doc)
+        return docs
+
+    def _apply_results(self, docs, results):
+        by_id = {doc["_id"]: doc for doc in docs}
+        conflicts = []
+        for success, doc_id, result in results:
+            doc = by_id[doc_id]
+            if success:
+                if doc.get("_deleted"):
+                    self.revs.pop(doc_id, None)
+                else:
+                    self.revs[doc_id] = result
+            elif doc.get("_deleted") and self.revs.get(doc_id) is None:
+                continue
+            else:
+                conflicts.append(doc)
+        return conflicts
+
+    def _refresh_revs(self, doc_ids):
+        for row in self.db.view('_all_docs', keys=list(doc_ids)):
+            if row.value and not row.value.get("deleted"):
+                self.revs[row.key] = row.value["rev"]
+            else:
+                self.revs.pop(row.key, None)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._closed:
+                    elapsed = time.monotonic() - last_flush
+                    if self._pending and (
+                        elapsed >= self.flush_interval
+                        or self._pending_bytes >= self.flush_bytes
+                        or self._waiters
+                    ):
+                        break
+                    self._cond.wait(max(self.flush_interval - elapsed, 0.001) if self._pending else self.flush_interval)
+                closed = self._closed
+            self.flush()
+            last_flush = time.monotonic()
+            if closed:
+                return
+
+    def close(self):
+        """Flush outstanding writes and stop the background thread (also run at interpreter exit)."""
+        if self._closed:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,41 @@
+import logging
+import os
+
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Per-message and per-frame log lines are written once every this many occurrences
+LOG_SAMPLE_RATE = int(os.getenv('LOG_SAMPLE_RATE', 100))
+
+
+def configure(level=LOG_LEVEL):
+    logging.basicConfig(
+        level=getattr(logging, level, logging.INFO),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+class SampledLogger:
+    """
+    Wraps a logger for hot paths: each message template is logged on its first
+    occurrence and then once every ``rate`` times. Nothing is formatted when the
+    level is disabled.
+    """
+
+    def __init__(self, logger, rate=LOG_SAMPLE_RATE):
+        self.logger = logger
+        self.rate = max(1, rate)
+        self._counts = {}
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        count = self._counts.get(msg, 0)
+        self._counts[msg] = count + 1
+        if count % self.rate == 0:
+            self.logger.log(level, msg + (f" [1 in {self.rate}]" if self.rate > 1 else ""), *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
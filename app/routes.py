@@ -1,30 +1,82 @@
-import asyncio
-import threading
-from flask import request, jsonify
-from blockchain.blockchain import Blockchain
+import json
+import os
+import metrics
+from flask import request, jsonify, Response
+from blockchain.transaction import Transaction
 from blockchain.wallet import Wallet
-from database.couchdb_handler import CouchDBHandler
+from blockchain.mining_jobs import MiningJobManager, JobAlreadyRunning
+from cryptolib.key_pool import KeyPool
 
 
+BLOCKS_PAGE_DEFAULT = int(os.getenv('BLOCKS_PAGE_DEFAULT', 100))
+BLOCKS_PAGE_MAX = int(os.getenv('BLOCKS_PAGE_MAX', 1000))
+TX_BATCH_MAX = int(os.getenv('TX_BATCH_MAX', 5000))
+HISTORY_PAGE_DEFAULT = int(os.getenv('HISTORY_PAGE_DEFAULT', 50))
+HISTORY_PAGE_MAX = int(os.getenv('HISTORY_PAGE_MAX', 500))
 
 
+def register_gauges(blockchain, p2p_network):
+    """Gauges read from live state when /metrics is scraped, so they cost nothing in between."""
+    def per_peer(attribute):
+        def read():
+            return {
+                (f"{peer.remote_address[0]}:{peer.remote_address[1]}",): attribute(peer)
+                for peer in list(p2p_network.peers)
+            }
+        return read
+
+    metrics.gauge('blockchain_height', 'Height of the chain tip', function=lambda: blockchain.snapshot().height)
+    metrics.gauge('mempool_size', 'Pending transactions',
+                  function=lambda: len(blockchain.snapshot().pending_transactions))
+    metrics.gauge('wallets', 'Known wallet addresses', function=lambda: len(blockchain.snapshot().wallets))
+    metrics.gauge('miner_hashrate', 'Hashes per second over the last search', function=blockchain.miner.hashrate)
+    metrics.gauge('state_engine_queue_depth', 'Writes waiting for the state engine', function=blockchain.engine.pending)
+    metrics.gauge('block_cache_bytes', 'Estimated size of older block bodies cached in memory',
+                  function=lambda: blockchain.chain.cache.bytes)
+    metrics.gauge('chain_window_blocks', 'Recent blocks held in memory in full',
+                  function=lambda: len(blockchain.chain.recent))
+    metrics.gauge('tx_index_window_transactions', 'Confirmed transactions of recent blocks indexed in memory',
+                  function=lambda: len(blockchain.tx_index.txids))
+    metrics.gauge('tx_index_cache_entries', 'Transaction id lookups from storage remembered in memory',
+                  function=lambda: len(blockchain.tx_index.cache))
+    metrics.gauge('storage_pending_writes', 'Writes accepted by the storage backend but not yet durable',
+                  function=blockchain.storage.pending_writes)
+    metrics.gauge('p2p_peers', 'Connected peers', function=lambda: len(p2p_network.peers))
+    metrics.gauge('p2p_peer_queue_depth', 'Frames queued for a peer', ('peer',),
+                  function=per_peer(lambda peer: peer.queue_depth()))
+    metrics.gauge('p2p_peer_sent_bytes', 'Bytes written to a peer', ('peer',),
+                  function=per_peer(lambda peer: peer.bytes_sent))
+    metrics.gauge('p2p_peer_received_bytes', 'Bytes read from a peer', ('peer',),
+                  function=per_peer(lambda peer: peer.bytes_received))
+    metrics.gauge('p2p_peer_dropped_frames', 'Frames dropped from a full peer queue', ('peer',),
+                  function=per_peer(lambda peer: peer.dropped))
 
-blockchain = Blockchain()
-couchdb = CouchDBHandler()
 
 def setup_routes(app, blockchain, p2p_network):
-    loop = p2p_network.loop  
+    key_pool = KeyPool().start()
+    register_gauges(blockchain, p2p_network)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Counters, gauges and latency histograms in the Prometheus text format."""
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
     @app.route('/wallet/create', methods=['POST'])
     def create_wallet():
-        wallet = Wallet(blockchain)
-        def broadcast():
-            asyncio.run_coroutine_threadsafe(
-                p2p_network.broadcast_wallet(wallet.public_key), loop
-            )
-        threading.Thread(target=broadcast).start()
+        data = request.get_json(silent=True) or {}
+        try:
+            wallet = Wallet(blockchain, scheme=data.get('scheme'), key_pool=key_pool)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if wallet.grant is not None:
+            p2p_network.call_threadsafe(p2p_network.broadcast_transaction, wallet.grant)
         return jsonify(wallet.export_keys(blockchain))
 
+    @app.route('/wallet/pool', methods=['GET'])
+    def get_key_pool_stats():
+        """Depth and refill rate of the pre-generated keypair reserve."""
+        return jsonify(key_pool.stats())
+
     @app.route('/transaction/create', methods=['POST'])
     def create_transaction():
         data = request.json
@@ -38,42 +90,208 @@ def setup_routes(app, blockchain, p2p_network):
 
         try:
             transaction = blockchain.validate_and_process_transaction(sender, recipient, amount, private_key)
-            # Broadcast the transaction to peers in a new thread
-            def broadcast():
-                asyncio.run_coroutine_threadsafe(
-                    p2p_network.broadcast_transaction(transaction.to_dict()), p2p_network.loop
-                )
-            threading.Thread(target=broadcast).start()
-            return jsonify(transaction.to_dict())
+            # Queue the announcement on the P2P loop; the request does not wait for peers
+            p2p_network.call_threadsafe(p2p_network.broadcast_transaction, transaction.to_dict())
+            return jsonify({**transaction.to_dict(), "txid": Transaction.compute_id(transaction.to_dict())})
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
-        
 
-        
+    @app.route('/transactions/batch', methods=['POST'])
+    def submit_transaction_batch():
+        """
+        Admit many pre-signed transactions in one call. Body:
+        ``{"transactions": [{"sender", "recipient", "amount", "nonce", "signature"}, ...], "atomic": false}``
+        where ``nonce`` is a non-negative integer that keeps repeated payments distinct and each
+        signature covers ``Transaction.signing_message`` (plain sender + recipient + amount for
+        legacy transactions without a nonce). Returns a result per transaction.
+        """
+        data = request.get_json(silent=True) or {}
+        transactions = data.get('transactions')
+        if not isinstance(transactions, list) or not transactions:
+            return jsonify({"error": "transactions must be a non-empty list"}), 400
+        if len(transactions) > TX_BATCH_MAX:
+            return jsonify({"error": f"At most {TX_BATCH_MAX} transactions per batch"}), 413
+
+        results, admitted = blockchain.submit_transactions(transactions, atomic=bool(data.get('atomic', False)))
+        if admitted:
+            p2p_network.call_threadsafe(p2p_network.broadcast_transactions, admitted)
+        return jsonify({
+            "accepted": len(admitted),
+            "rejected": len(results) - len(admitted),
+            "results": results,
+        })
+
     @app.route('/peers', methods=['GET'])
     def get_peers():
         peers = p2p_network.get_connected_peers()
         return jsonify({"connected_peers": peers})
 
+    @app.route('/peers/stats', methods=['GET'])
+    def get_peer_stats():
+        """Outbound queue depth, sent and dropped frames per peer."""
+        return jsonify({"peers": p2p_network.peer_stats()})
+
+
+    def broadcast_block(block):
+        p2p_network.call_threadsafe(p2p_network.broadcast_block, block.to_dict())
+
+    mining_jobs = MiningJobManager(blockchain, on_block=broadcast_block)
+
+    def start_mining_job(continuous=False):
+        if not continuous and not blockchain.snapshot().pending_transactions:
+            return jsonify({"message": "No transactions to mine"})
+        try:
+            job = mining_jobs.start(continuous=continuous)
+        except JobAlreadyRunning as e:
+            return jsonify({"error": str(e), "job_id": e.job.id}), 409
+        return jsonify(job.to_dict()), 202
 
     @app.route('/mine', methods=['GET'])
     def mine_block():
-        new_block = blockchain.mine()
-        if new_block:
-            couchdb.save_block(new_block)
-            def broadcast():
-                asyncio.run_coroutine_threadsafe(
-                    p2p_network.broadcast_block(new_block.to_dict()), p2p_network.loop
-                )
-            threading.Thread(target=broadcast).start()
-            return jsonify(new_block.to_dict())
-        return jsonify({"message": "No transactions to mine"})
+        """Start mining the pending transactions in the background and return the job id."""
+        return start_mining_job()
+
+    @app.route('/mine/jobs', methods=['POST'])
+    def create_mining_job():
+        data = request.get_json(silent=True) or {}
+        return start_mining_job(continuous=bool(data.get('continuous', False)))
+
+    @app.route('/mine/jobs', methods=['GET'])
+    def list_mining_jobs():
+        return jsonify({"jobs": [job.to_dict() for job in mining_jobs.list()]})
+
+    @app.route('/mine/jobs/<job_id>', methods=['GET'])
+    def get_mining_job(job_id):
+        job = mining_jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown mining job"}), 404
+        return jsonify(job.to_dict())
+
+    @app.route('/mine/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_mining_job(job_id):
+        job = mining_jobs.cancel(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown mining job"}), 404
+        return jsonify(job.to_dict())
+
 
+    @app.route('/mining/stats', methods=['GET'])
+    def mining_stats():
+        """Hashrate per miner worker from the last search, for sizing mining nodes."""
+        return jsonify(blockchain.miner.stats())
+
+    @app.route('/validation/stats', methods=['GET'])
+    def validation_stats():
+        """Throughput of the last full chain validation, in blocks per second."""
+        return jsonify({"last_validation": blockchain.validator.last_report})
 
     @app.route('/chain', methods=['GET'])
     def get_chain():
-        chain_data = [block.to_dict() for block in blockchain.chain]
-        return jsonify(chain_data)
+        """Whole chain as a JSON array, streamed block by block. Prefer /blocks for large chains."""
+        blocks = blockchain.snapshot().chain
+
+        def generate():
+            yield "["
+            for i, block in enumerate(blocks):
+                yield ("," if i else "") + json.dumps(block.to_dict())
+            yield "]"
+        return Response(generate(), mimetype='application/json')
+
+    def block_response(block):
+        # A block's hash commits to its whole content, so it is a strong validator
+        response = jsonify(block.to_dict())
+        response.set_etag(block.hash())
+        return response.make_conditional(request)
+
+    @app.route('/blocks', methods=['GET'])
+    def get_blocks():
+        """
+        Blocks from height ``from``, ``limit`` at a time. ``format=ndjson`` streams one
+        block per line instead, up to the tip unless ``limit`` is given.
+        """
+        try:
+            start = max(0, int(request.args.get('from', 0)))
+            limit = request.args.get('limit')
+            limit = None if limit is None else max(0, int(limit))
+        except ValueError:
+            return jsonify({"error": "from and limit must be integers"}), 400
+
+        # One snapshot per request, so the page and the reported height agree
+        snapshot = blockchain.snapshot()
+        chain = snapshot.chain
+        if request.args.get('format') == 'ndjson':
+            blocks = chain[start:] if limit is None else chain[start:start + limit]
+
+            def generate():
+                for block in blocks:
+                    yield json.dumps(block.to_dict()) + "\n"
+            return Response(generate(), mimetype='application/x-ndjson')
+
+        limit = min(BLOCKS_PAGE_DEFAULT if limit is None else limit, BLOCKS_PAGE_MAX)
+        blocks = chain[start:start + limit]
+        tip = snapshot.height
+        end = start + len(blocks)
+        response = jsonify({
+            "blocks": [block.to_dict() for block in blocks],
+            "from": start,
+            "limit": limit,
+            "height": tip,
+            "next": end if end <= tip else None,
+        })
+        if len(blocks) == limit and blocks:
+            # A full page's blocks are fixed by its last block's hash, which commits to the blocks
+            # before it; the tip height is part of the tag too, since "height" and "next" follow it
+            response.set_etag(f"{blocks[-1].hash()}-{start}-{limit}-{tip}")
+            return response.make_conditional(request)
+        return response
+
+    @app.route('/block/<int:height>', methods=['GET'])
+    def get_block_by_height(height):
+        block = blockchain.get_block(height)
+        if block is None:
+            return jsonify({"error": "Block not found"}), 404
+        return block_response(block)
+
+    @app.route('/block/<block_hash>', methods=['GET'])
+    def get_block_by_hash(block_hash):
+        block = blockchain.get_block_by_hash(block_hash)
+        if block is None:
+            return jsonify({"error": "Block not found"}), 404
+        return block_response(block)
+
+    @app.route('/proof/<tx_id>', methods=['GET'])
+    def get_transaction_proof(tx_id):
+        """Merkle inclusion proof of a confirmed transaction against its block's merkle_root."""
+        try:
+            proof = blockchain.get_transaction_proof(tx_id)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
+        if proof is None:
+            return jsonify({"error": "Transaction not found in chain"}), 404
+        return jsonify(proof)
+
+    @app.route('/tx/<tx_id>', methods=['GET'])
+    def get_transaction(tx_id):
+        """A transaction by id: its block, position and confirmations, or pending in the mempool."""
+        transaction = blockchain.find_transaction(tx_id)
+        if transaction is None:
+            return jsonify({"error": "Transaction not found"}), 404
+        return jsonify(transaction)
+
+    @app.route('/wallet/<address>/transactions', methods=['GET'])
+    def get_wallet_transactions(address):
+        """
+        Confirmed transactions of ``address``, newest first, ``limit`` at a time.
+        Pass the previous page's ``next`` as ``before`` for the following page.
+        """
+        try:
+            limit = int(request.args.get('limit', HISTORY_PAGE_DEFAULT))
+            before = request.args.get('before')
+            before = None if before is None else int(before)
+        except ValueError:
+            return jsonify({"error": "limit and before must be integers"}), 400
+        limit = min(max(1, limit), HISTORY_PAGE_MAX)
+        return jsonify(blockchain.address_history(address, limit, before))
 
     @app.route('/balance/<wallet_address>', methods=['GET'])
     def get_balance(wallet_address):
@@ -100,4 +318,4 @@ def setup_routes(app, blockchain, p2p_network):
         """
         Get the remaining ICO funds.
         """
-        return jsonify({"ICO_funds_remaining": blockchain.ico_funds["GENESIS_WALLET"]}), 200
+        return jsonify({"ICO_funds_remaining": blockchain.ico_funds()}), 200
@@ -2,9 +2,18 @@ from flask import Flask
 from routes import setup_routes
 from blockchain.blockchain import Blockchain
 from blockchain.p2p import P2PNetwork
+from async_http import AsyncHTTPServer
+import asyncio
+import log
 import os
+import threading
 
 
+# "flask" runs Flask's threaded server; "async" serves the same routes on the P2P event loop
+HTTP_MODE = os.getenv('HTTP_MODE', 'flask')
+
+
+log.configure()
 app = Flask(__name__)
 
 # Initialize the blockchain and P2P network
@@ -27,4 +36,12 @@ for peer in peers:
 setup_routes(app, blockchain, p2p_network)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
+    port = int(os.getenv('PORT', 5000))
+    if HTTP_MODE == 'async':
+        p2p_network.loop_ready.wait()
+        http_server = AsyncHTTPServer(app, host='0.0.0.0', port=port)
+        asyncio.run_coroutine_threadsafe(http_server.start(), p2p_network.loop).result()
+        # The P2P loop thread serves both protocols; keep the main thread alive
+        threading.Event().wait()
+    else:
+        app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,102 @@
+"""
+The asyncio HTTP server: inline routes stay on the loop, the rest run and stream on the executor.
+"""
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+from flask import Flask, Response, jsonify, request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from async_http import AsyncHTTPServer  # noqa: E402
+
+
+def make_app(threads):
+    app = Flask(__name__)
+
+    @app.route('/balance/<address>')
+    def balance(address):
+        threads['balance'] = threading.current_thread().name
+        return jsonify({"address": address})
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        threads['echo'] = threading.current_thread().name
+        return jsonify(request.get_json())
+
+    @app.route('/stream')
+    def stream():
+        def chunks():
+            for i in range(3):
+                threads.setdefault('stream', set()).add(threading.current_thread().name)
+                yield f"{i}\n"
+        return Response(chunks(), mimetype='text/plain')
+
+    return app
+
+
+class AsyncHTTPServerTest(unittest.TestCase):
+    def setUp(self):
+        self.threads = {}
+
+    def serve(self, requests):
+        """Send each raw request on its own connection and return the raw responses."""
+        async def run():
+            server = AsyncHTTPServer(make_app(self.threads), host='127.0.0.1', port=0,
+                                     inline_paths=('/balance/',), workers=2)
+            listening = await server.start()
+            port = listening.sockets[0].getsockname()[1]
+            responses = []
+            try:
+                for raw in requests:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                    writer.write(raw)
+                    await writer.drain()
+                    responses.append(await reader.read())
+                    writer.close()
+            finally:
+                await server.close()
+            return responses, threading.current_thread().name
+        return asyncio.run(run())
+
+    @staticmethod
+    def get(path):
+        return f"GET {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n".encode()
+
+    def test_inline_paths_run_on_the_loop_and_others_on_the_executor(self):
+        (inline, other), loop_thread = self.serve([self.get('/balance/alice'), self.get('/stream')])
+        self.assertTrue(inline.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b'"address":"alice"', inline.replace(b" ", b""))
+        self.assertEqual(self.threads['balance'], loop_thread)
+        # The streamed body is produced on worker threads too, in chunked encoding
+        self.assertIn(b"Transfer-Encoding: chunked", other)
+        self.assertTrue(other.endswith(b"2\r\n0\n\r\n2\r\n1\n\r\n2\r\n2\n\r\n0\r\n\r\n"))
+        self.assertTrue(all(name.startswith("http-worker") for name in self.threads['stream']))
+
+    def test_request_bodies_reach_the_app(self):
+        body = b'{"amount": 3}'
+        raw = (b"POST /echo HTTP/1.1\r\nHost: test\r\nContent-Type: application/json\r\n"
+               b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(body), body))
+        (response,), _ = self.serve([raw])
+        self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b'"amount":3', response.replace(b" ", b""))
+        self.assertTrue(self.threads['echo'].startswith("http-worker"))
+
+    def test_malformed_requests_are_refused(self):
+        responses, _ = self.serve([
+            b"GARBAGE\r\n\r\n",
+            b"GET / HTTP/2.0\r\nHost: test\r\n\r\n",
+            b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n",
+        ])
+        self.assertEqual([response.split(b"\r\n")[0] for response in responses], [
+            b"HTTP/1.1 400 Bad Request",
+            b"HTTP/1.1 505 HTTP Version Not Supported",
+            b"HTTP/1.1 411 Length Required",
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
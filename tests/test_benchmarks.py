@@ -0,0 +1,83 @@
+"""
+The benchmark report: its fields, and the regression check against a baseline.
+"""
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from benchmarks.__main__ import main  # noqa: E402
+from benchmarks.harness import REPORT_VERSION, compare, percentile  # noqa: E402
+
+RESULT_FIELDS = {"ops", "calls", "seconds", "ops_per_sec", "p50_ms", "p99_ms", "peak_memory_bytes"}
+
+
+class BenchmarkReportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def run_benchmarks(self, *extra):
+        output = os.path.join(self.directory, "report.json")
+        argv = ["--scenarios", "merkle_build,merkle_proof", "--merkle-size", "16", "--repeat", "2",
+                "--difficulty", os.environ['MINING_DIFFICULTY'], "--output", output] + list(extra)
+        with contextlib.redirect_stderr(io.StringIO()):
+            status = main(argv)
+        with open(output) as f:
+            return status, json.load(f)
+
+    def test_report_schema(self):
+        status, report = self.run_benchmarks()
+        self.assertEqual(status, 0)
+        self.assertEqual(report["version"], REPORT_VERSION)
+        self.assertEqual(set(report), {"version", "created", "environment", "parameters", "results"})
+        self.assertEqual(set(report["environment"]), {"python", "implementation", "platform", "cpu_count"})
+        self.assertEqual(report["parameters"]["merkle_size"], 16)
+        self.assertNotIn("output", report["parameters"])
+        self.assertEqual(list(report["results"]), ["merkle_build", "merkle_proof"])
+        for result in report["results"].values():
+            self.assertLessEqual(RESULT_FIELDS, set(result))
+            self.assertEqual(result["calls"], 2)
+            self.assertEqual(result["ops"], 32)
+            self.assertGreater(result["ops_per_sec"], 0)
+            self.assertGreater(result["peak_memory_bytes"], 0)
+
+    def test_a_slower_run_than_the_baseline_is_a_regression(self):
+        _, baseline = self.run_benchmarks("--no-memory")
+        for result in baseline["results"].values():
+            result["ops_per_sec"] *= 1000
+        path = os.path.join(self.directory, "baseline.json")
+        with open(path, "w") as f:
+            json.dump(baseline, f)
+        status, report = self.run_benchmarks("--no-memory", "--baseline", path)
+        self.assertEqual(status, 1)
+        self.assertEqual(report["comparison"]["merkle_build"]["regression"], ["throughput"])
+        self.assertIsNone(report["results"]["merkle_build"]["peak_memory_bytes"])
+
+    def test_compare_flags_memory_growth_and_parameter_changes(self):
+        result = {"ops_per_sec": 100.0, "p50_ms": 1.0, "p99_ms": 2.0, "peak_memory_bytes": 1000}
+        baseline = {"parameters": {"blocks": 10}, "results": {"merkle_build": dict(result, peak_memory_bytes=500)}}
+        report = {"parameters": {"blocks": 20}, "results": {"merkle_build": result, "sync": result}}
+        comparison = compare(report, baseline, 0.10)
+        self.assertEqual(comparison["merkle_build"]["regression"], ["memory"])
+        self.assertEqual(comparison["merkle_build"]["ops_per_sec_change"], 0.0)
+        self.assertNotIn("sync", comparison)
+        self.assertIn("_warning", comparison)
+
+    def test_percentile_is_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 0.5), 3)
+        self.assertEqual(percentile(values, 0.99), 5)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
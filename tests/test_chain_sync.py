@@ -0,0 +1,102 @@
+"""
+Syncing chains that spend wallet grants. Run from the repository root with
+``python -m unittest discover tests`` (or pytest).
+"""
+import os
+import sys
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.block import Block  # noqa: E402
+from blockchain.blockchain import Blockchain  # noqa: E402
+from blockchain.transaction import Transaction  # noqa: E402
+from blockchain.wallet import Wallet  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+class ChainSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.miner.shutdown()
+
+    def node(self, blocks=()):
+        node = Blockchain(storage=MemoryStorage(blocks))
+        self.nodes.append(node)
+        return node
+
+    def funded_chain(self):
+        """Node A creates a wallet, spends 5 of its grant and mines it all into one block."""
+        a = self.node()
+        wallet = Wallet(a)
+        a.validate_and_process_transaction(wallet.public_key, "bob", 5, wallet.private_key)
+        self.assertIsNotNone(a.mine())
+        self.assertEqual(a.get_balance(wallet.public_key), 5)
+        return a, wallet
+
+    def test_fresh_node_adopts_chain_with_funded_transfer(self):
+        a, wallet = self.funded_chain()
+        b = self.node()
+        self.assertTrue(b.replace_chain(list(a.snapshot().chain)))
+        self.assertEqual(b.snapshot().height, 1)
+        self.assertEqual(dict(b.snapshot().wallets), dict(a.snapshot().wallets))
+        self.assertEqual(b.get_balance(wallet.public_key), 5)
+        self.assertEqual(b.get_balance("bob"), 5)
+
+    def test_fresh_node_accepts_relayed_block_with_funded_transfer(self):
+        a, wallet = self.funded_chain()
+        # Genesis blocks are timestamped at creation, so B starts from A's
+        b = self.node(list(a.snapshot().chain[:1]))
+        block = a.snapshot().tip
+        self.assertTrue(all(b.verify_transactions(block.transactions)))
+        self.assertTrue(b.add_block(Block.from_dict(block.to_dict())))
+        self.assertEqual(b.get_balance("bob"), 5)
+
+    def test_second_grant_to_a_wallet_is_rejected(self):
+        a, wallet = self.funded_chain()
+        tip = a.snapshot().tip
+        block = Block(tip.index + 1, [Transaction.grant(wallet.public_key, wallet.private_key)], tip.hash())
+        block.mine(1)
+        self.assertFalse(a.add_block(block))
+        self.assertFalse(a.replace_chain([block], start=tip.index + 1))
+        self.assertEqual(a.get_balance(wallet.public_key), 5)
+
+    def test_block_replaying_a_confirmed_transaction_is_rejected(self):
+        a, wallet = self.funded_chain()
+        tip = a.snapshot().tip
+        transfer = next(tx for tx in tip.transactions if tx['recipient'] == "bob")
+        block = Block(tip.index + 1, [transfer], tip.hash())
+        block.mine(1)
+        self.assertFalse(a.add_block(block))
+        self.assertFalse(a.replace_chain([block], start=tip.index + 1))
+        self.assertEqual(a.get_balance(wallet.public_key), 5)
+        self.assertEqual(a.get_balance("bob"), 5)
+
+    def test_block_repeating_a_transaction_is_rejected(self):
+        a, wallet = self.funded_chain()
+        transfer = a.validate_and_process_transaction(wallet.public_key, "bob", 2, wallet.private_key).to_dict()
+        tip = a.snapshot().tip
+        block = Block(tip.index + 1, [transfer, transfer], tip.hash())
+        block.mine(1)
+        self.assertFalse(a.add_block(block))
+        self.assertEqual(a.get_balance("bob"), 5)
+
+    def test_fork_may_confirm_the_transactions_it_replaces(self):
+        a, wallet = self.funded_chain()
+        genesis, mined = a.snapshot().chain[0], a.snapshot().tip
+        fork = [Block(1, mined.transactions, genesis.hash(), timestamp=mined.timestamp + 1)]
+        fork[0].mine(1)
+        fork.append(Block(2, [], fork[0].hash()))
+        fork[1].mine(1)
+        self.assertTrue(a.replace_chain(fork, start=1))
+        self.assertEqual(a.snapshot().tip.hash(), fork[1].hash())
+        self.assertEqual(a.get_balance("bob"), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Mempool admission on every path and eviction of transactions that can no longer be mined.
+"""
+import os
+import sys
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.block import Block  # noqa: E402
+from blockchain.blockchain import Blockchain  # noqa: E402
+from blockchain.mempool import Mempool  # noqa: E402
+from blockchain.transaction import Transaction, new_nonce  # noqa: E402
+from blockchain.wallet import Wallet  # noqa: E402
+from cryptolib.crypto import Crypto  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+def signed(wallet, recipient, amount):
+    transaction = Transaction(wallet.public_key, recipient, amount, None, new_nonce()).to_dict()
+    transaction['signature'] = Crypto.sign_transaction(wallet.private_key, Transaction.signing_message(transaction))
+    return transaction
+
+
+def transfer(sender, amount, nonce):
+    return Transaction(sender, "bob", amount, "sig", nonce).to_dict()
+
+
+class MempoolTest(unittest.TestCase):
+    def test_a_full_pool_evicts_its_oldest_transaction(self):
+        pool = Mempool(max_size=2)
+        first, _ = pool.add(transfer("alice", 1, 1))
+        pool.add(transfer("alice", 2, 2))
+        tx_id, evicted = pool.add(transfer("carol", 3, 3))
+        self.assertEqual([evicted_id for evicted_id, _ in evicted], [first])
+        self.assertEqual(len(pool), 2)
+        self.assertIn(tx_id, pool)
+        self.assertEqual(pool.pending_spend("alice"), 2)
+
+    def test_a_full_pool_under_the_reject_policy_refuses(self):
+        pool = Mempool(max_size=1, eviction="reject")
+        pool.add(transfer("alice", 1, 1))
+        self.assertFalse(pool.has_room())
+        self.assertEqual(pool.add(transfer("alice", 2, 2)), (None, []))
+        self.assertEqual(len(pool), 1)
+
+    def test_a_repeated_transaction_is_not_added_twice(self):
+        pool = Mempool()
+        transaction = transfer("alice", 1, 1)
+        pool.add(transaction)
+        self.assertEqual(pool.add(dict(transaction)), (None, []))
+        self.assertEqual(pool.pending_spend("alice"), 1)
+
+    def test_over_budget_drops_the_newest_spends_first(self):
+        pool = Mempool()
+        ids = [pool.add(transfer("alice", amount, nonce))[0] for nonce, amount in enumerate((4, 3, 2))]
+        self.assertEqual(pool.over_budget("alice", 9), [])
+        self.assertEqual(pool.over_budget("alice", 5), [ids[2], ids[1]])
+        self.assertEqual(pool.over_budget("alice", 0), list(reversed(ids)))
+        pool.remove(ids[:1])
+        self.assertEqual(pool.pending_spend("alice"), 5)
+
+    def test_reinjected_transactions_go_first_and_push_out_the_newest(self):
+        pool = Mempool(max_size=2)
+        pool.add(transfer("alice", 1, 1))
+        newest, _ = pool.add(transfer("alice", 2, 2))
+        orphaned = transfer("carol", 3, 3)
+        added, evicted = pool.reinject([orphaned])
+        self.assertEqual(evicted, [newest])
+        self.assertEqual(next(iter(pool)), orphaned)
+
+
+class MempoolAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Blockchain(storage=MemoryStorage())
+        self.addCleanup(self.node.miner.shutdown)
+
+    def wallet(self):
+        return Wallet(self.node, scheme="ed25519")
+
+    def peer_block(self, transactions):
+        """A block on our tip, as a peer would relay it."""
+        tip = self.node.snapshot().tip
+        block = Block(tip.index + 1, transactions, tip.hash())
+        block.mine(1)
+        return block
+
+    def test_relayed_transfer_is_checked_against_the_balance(self):
+        alice = self.wallet()
+        self.assertFalse(self.node.add_transaction(signed(alice, "bob", 11)))
+        self.assertTrue(self.node.add_transaction(signed(alice, "bob", 6)))
+        self.assertFalse(self.node.add_transaction(signed(alice, "bob", 6)))
+        self.assertEqual(len(self.node.mempool), 2)
+
+    def test_relayed_transfer_with_a_bad_amount_is_refused(self):
+        alice = self.wallet()
+        for amount in ("5", -1, 0, True, float("nan")):
+            self.assertFalse(self.node.add_transaction(signed(alice, "bob", amount)), amount)
+
+    def test_grant_is_mined_before_a_transfer_to_the_same_wallet(self):
+        alice = self.wallet()
+        self.assertIsNotNone(self.node.mine())
+        # A wallet paid before its grant was admitted, then spending the grant
+        carol_private, carol = Crypto.generate_keypair("ed25519")
+        self.node.validate_and_process_transaction(alice.public_key, carol, 2, alice.private_key)
+        self.node.create_wallet(carol, carol_private)
+        self.node.validate_and_process_transaction(carol, "dave", 10, carol_private)
+        self.assertIsNotNone(self.node.mine())
+        self.assertEqual(len(self.node.mempool), 0)
+        self.assertEqual(self.node.get_balance(carol), 2)
+        self.assertEqual(self.node.get_balance("dave"), 10)
+
+    def test_peer_block_spending_the_same_funds_evicts_the_pending_transfer(self):
+        alice = self.wallet()
+        self.assertIsNotNone(self.node.mine())
+        self.node.validate_and_process_transaction(alice.public_key, "bob", 8, alice.private_key)
+        self.assertTrue(self.node.add_block(self.peer_block([signed(alice, "carol", 5)])))
+        self.assertEqual(len(self.node.mempool), 0)
+        self.assertEqual(self.node.get_balance(alice.public_key), 5)
+
+    def test_transfer_confirmed_before_a_grant_evicts_the_grant_and_its_spends(self):
+        alice = self.wallet()
+        self.assertIsNotNone(self.node.mine())
+        bob = self.wallet()
+        self.node.validate_and_process_transaction(bob.public_key, "carol", 4, bob.private_key)
+        self.assertTrue(self.node.add_block(self.peer_block([signed(alice, bob.public_key, 1)])))
+        self.assertEqual(len(self.node.mempool), 0)
+        self.assertEqual(self.node.block_template(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Merkle inclusion proofs checked against the roots blocks commit to.
+"""
+import os
+import sys
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.block import Block  # noqa: E402
+from blockchain.blockchain import Blockchain  # noqa: E402
+from blockchain.merkle_tree import MerkleTree  # noqa: E402
+from blockchain.transaction import Transaction  # noqa: E402
+from blockchain.wallet import Wallet  # noqa: E402
+from cryptolib.crypto import Crypto  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+def transactions(count):
+    return [Transaction("alice", "bob", 1, "sig", nonce).to_dict() for nonce in range(count)]
+
+
+class MerkleTreeTest(unittest.TestCase):
+    def test_every_leaf_proves_against_the_root(self):
+        # Odd sizes exercise the last node of a level being paired with itself
+        for size in range(1, 10):
+            batch = transactions(size)
+            tree = MerkleTree(batch)
+            for index, transaction in enumerate(batch):
+                proof = tree.get_proof(index)
+                self.assertTrue(MerkleTree.verify_proof(Transaction.compute_id(transaction), proof, tree.root),
+                                (size, index))
+
+    def test_a_proof_fails_for_another_leaf_or_root(self):
+        batch = transactions(5)
+        tree = MerkleTree(batch)
+        proof = tree.get_proof(2)
+        self.assertFalse(MerkleTree.verify_proof(Transaction.compute_id(batch[3]), proof, tree.root))
+        self.assertFalse(MerkleTree.verify_proof(Transaction.compute_id(batch[2]), proof,
+                                                 MerkleTree(batch[:4]).root))
+
+    def test_the_root_is_the_one_blocks_commit_to(self):
+        batch = transactions(3)
+        self.assertEqual(Block(1, batch, "0" * 64).merkle_root, MerkleTree(batch).root)
+        self.assertEqual(MerkleTree().root, Crypto.hash(""))
+        with self.assertRaises(IndexError):
+            MerkleTree(batch).get_proof(3)
+
+    def test_legacy_root_differs_from_the_canonical_one(self):
+        batch = transactions(2)
+        self.assertNotEqual(MerkleTree.legacy_root(batch), MerkleTree(batch).root)
+        self.assertEqual(MerkleTree.legacy_root([]), MerkleTree().root)
+
+    def test_node_proof_verifies_against_the_mined_block(self):
+        node = Blockchain(storage=MemoryStorage())
+        self.addCleanup(node.miner.shutdown)
+        wallet = Wallet(node, scheme="ed25519")
+        self.assertIsNotNone(node.mine())
+        transaction = node.validate_and_process_transaction(wallet.public_key, "bob", 1, wallet.private_key)
+        tx_id = Transaction.compute_id(transaction.to_dict())
+        block = node.mine()
+        proof = node.get_transaction_proof(tx_id)
+        self.assertEqual((proof["block_index"], proof["merkle_root"]), (block.index, block.merkle_root))
+        self.assertTrue(MerkleTree.verify_proof(tx_id, proof["proof"], block.merkle_root))
+
+
+if __name__ == '__main__':
+    unittest.main()
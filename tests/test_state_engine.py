@@ -0,0 +1,98 @@
+"""
+The state writer's batching and publish order, and the layered maps snapshots share.
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.state_engine import LayeredMap, StateEngine  # noqa: E402
+
+
+class StateEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.state = {"value": 0, "published": None}
+        self.engine = StateEngine(self.publish, name="test-writer")
+
+    def publish(self):
+        self.state["published"] = self.state["value"]
+
+    def write(self, value):
+        self.state["value"] = value
+        return value
+
+    def test_a_caller_reads_its_own_write(self):
+        self.engine.start()
+        self.assertEqual(self.engine.call(self.write, 5), 5)
+        # The result is handed back only after the snapshot holding it was published
+        self.assertEqual(self.state["published"], 5)
+
+    def test_commands_queued_while_busy_are_applied_as_one_batch(self):
+        gate = threading.Event()
+        self.engine.start()
+        blocked = self.engine.submit(gate.wait)
+        futures = [self.engine.submit(self.write, value) for value in range(1, 4)]
+        gate.set()
+        self.assertEqual([future.result() for future in futures], [1, 2, 3])
+        blocked.result()
+        self.assertEqual(self.state["published"], 3)
+        self.assertEqual(self.engine.commands, 4)
+        self.assertLessEqual(self.engine.batches, 2)
+
+    def test_exceptions_reach_the_caller_and_the_batch_still_publishes(self):
+        self.engine.start()
+
+        def fail():
+            self.write(7)
+            raise ValueError("rejected")
+        with self.assertRaises(ValueError):
+            self.engine.call(fail)
+        self.assertEqual(self.state["published"], 7)
+
+    def test_calls_run_inline_before_start_and_on_the_writer(self):
+        self.assertTrue(self.engine.in_writer())
+        self.assertEqual(self.engine.call(self.write, 1), 1)
+        self.assertIsNone(self.state["published"])
+
+        self.engine.start()
+        nested = self.engine.call(lambda: (self.engine.in_writer(), self.engine.call(self.write, 2)))
+        self.assertEqual(nested, (True, 2))
+        self.assertFalse(self.engine.in_writer())
+
+
+class LayeredMapTest(unittest.TestCase):
+    def test_updated_leaves_the_original_untouched(self):
+        base = LayeredMap({"a": 1})
+        changed = base.updated({"a": 2, "b": 3})
+        self.assertEqual(dict(base), {"a": 1})
+        self.assertEqual(dict(changed), {"a": 2, "b": 3})
+        self.assertEqual((len(base), len(changed)), (1, 2))
+        self.assertIs(base.updated({}), base)
+
+    def test_lookups_see_the_newest_layer(self):
+        current = LayeredMap()
+        expected = {}
+        for step in range(100):
+            changes = {f"k{step % 17}": step, f"n{step}": -step}
+            current = current.updated(changes)
+            expected.update(changes)
+        self.assertEqual(dict(current), expected)
+        self.assertEqual(len(current), len(expected))
+        self.assertEqual(current["k3"], expected["k3"])
+        self.assertNotIn("missing", current)
+        self.assertIsNone(current.get("missing"))
+        with self.assertRaises(KeyError):
+            current["missing"]
+
+    def test_layers_stay_logarithmic(self):
+        current = LayeredMap()
+        for step in range(1024):
+            current = current.updated({step: step})
+        self.assertLessEqual(len(current._layers), 11)
+        self.assertEqual(len(current), 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+The memory and log storage backends: what is saved reads back, and rewriting a height drops what was above it.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.block import Block  # noqa: E402
+from blockchain.transaction import Transaction  # noqa: E402
+from database.log_storage import LogStorage  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+def chain(length, tag="a"):
+    blocks = [Block(0, [Transaction("ICO", "alice", 10, "").to_dict()], "0" * 64, timestamp=1)]
+    for height in range(1, length):
+        transactions = [Transaction("alice", f"{tag}{height}", 1, "sig", height).to_dict()]
+        blocks.append(Block(height, transactions, blocks[-1].hash(), timestamp=1 + height))
+    return blocks
+
+
+def entries(block):
+    return [[Transaction.compute_id(tx), tx["sender"], tx["recipient"]] for tx in block.transactions]
+
+
+class StorageContract:
+    """Checks every backend must pass; ``reopen`` returns storage that reads what was saved."""
+
+    def storage(self):
+        raise NotImplementedError
+
+    def reopen(self, storage):
+        return storage
+
+    def test_blocks_round_trip(self):
+        storage = self.storage()
+        blocks = chain(3)
+        storage.save_blocks(blocks)
+        storage = self.reopen(storage)
+        self.assertEqual([Block.from_dict(data).hash() for data in storage.load_blocks()],
+                         [block.hash() for block in blocks])
+        self.assertEqual(Block.from_dict(storage.load_block(1)).transactions, blocks[1].transactions)
+        self.assertIsNone(storage.load_block(3))
+        self.assertEqual([header["index"] for header in storage.load_headers()], [0, 1, 2])
+        self.assertNotIn("transactions", storage.load_headers()[1])
+
+    def test_rewriting_a_height_replaces_the_block(self):
+        storage = self.storage()
+        storage.save_blocks(chain(3))
+        fork = chain(2, tag="b")
+        storage.save_block(fork[1])
+        storage = self.reopen(storage)
+        self.assertEqual(Block.from_dict(storage.load_block(1)).hash(), fork[1].hash())
+
+    def test_tx_index_round_trips_and_truncates(self):
+        storage = self.storage()
+        blocks = chain(4)
+        for block in blocks:
+            storage.save_tx_index(block.index, block.hash(), entries(block))
+        storage = self.reopen(storage)
+        self.assertEqual(storage.tx_index_height(), 3)
+        self.assertEqual(storage.tx_index_hash(2), blocks[2].hash())
+        self.assertEqual([record["height"] for record in storage.load_tx_index(2)], [2, 3])
+        txids = [entries(block)[0][0] for block in blocks]
+        self.assertEqual(storage.locate_transactions(txids[1:3] + ["missing"]), {txids[1]: (1, 0), txids[2]: (2, 0)})
+        self.assertEqual(storage.address_transactions("alice", 4, 2), ([(3, 0), (2, 0)], 4))
+        self.assertEqual(storage.address_transactions("alice", 3, 10, (2, 0)), ([(1, 0), (0, 0)], 3))
+
+        storage.delete_tx_index_from(2)
+        storage = self.reopen(storage)
+        self.assertEqual(storage.tx_index_height(), 1)
+        self.assertIsNone(storage.tx_index_hash(2))
+        self.assertEqual(storage.locate_transactions(txids), {txids[0]: (0, 0), txids[1]: (1, 0)})
+        self.assertEqual(storage.address_transactions("alice", 4, 10)[1], 2)
+
+    def test_a_repeated_txid_keeps_its_first_location(self):
+        storage = self.storage()
+        record = [["t1", "alice", "bob"]]
+        storage.save_tx_index(0, "h0", record)
+        storage.save_tx_index(1, "h1", record)
+        self.assertEqual(storage.locate_transactions(["t1"]), {"t1": (0, 0)})
+        storage.delete_tx_index_from(1)
+        self.assertEqual(storage.locate_transactions(["t1"]), {"t1": (0, 0)})
+
+    def test_pending_transactions_round_trip(self):
+        storage = self.storage()
+        pending = [(f"id{n}", {"sender": "alice", "amount": n}) for n in range(3)]
+        storage.save_pending_transactions(pending)
+        storage.delete_pending_transactions(["id0"])
+        storage = self.reopen(storage)
+        self.assertEqual(sorted(tx["amount"] for tx in storage.load_pending_transactions()), [1, 2])
+        storage.replace_pending_transactions(pending[:1])
+        storage = self.reopen(storage)
+        self.assertEqual(storage.load_pending_transactions(), [pending[0][1]])
+
+    def test_wallets_are_a_checkpoint_plus_later_deltas(self):
+        storage = self.storage()
+        self.assertEqual(storage.load_wallets(), (0, None))
+        storage.save_wallet_checkpoint(1, {"alice": 10})
+        storage.save_wallet_delta(2, {"alice": -3, "bob": 3})
+        storage.save_wallet_delta(3, {"bob": 1})
+        storage.save_chain_checkpoint(5, "h5", {"alice": 7})
+        storage = self.reopen(storage)
+        self.assertEqual(storage.load_wallets(), (3, {"alice": 7, "bob": 4}))
+        self.assertEqual(storage.load_chain_checkpoints(), {5: {"hash": "h5", "wallets": {"alice": 7}}})
+        storage.delete_chain_checkpoint(5)
+        self.assertEqual(storage.load_chain_checkpoints(), {})
+
+
+class MemoryStorageTest(StorageContract, unittest.TestCase):
+    def storage(self):
+        return MemoryStorage()
+
+
+class LogStorageTest(StorageContract, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def storage(self):
+        storage = LogStorage(self.directory)
+        self.addCleanup(storage.close)
+        return storage
+
+    def reopen(self, storage):
+        storage.close()
+        return self.storage()
+
+    def test_rewriting_a_height_drops_the_blocks_above(self):
+        storage = self.storage()
+        storage.save_blocks(chain(4))
+        storage.save_block(chain(2, tag="b")[1])
+        storage = self.reopen(storage)
+        self.assertEqual(len(storage.load_blocks()), 2)
+        self.assertIsNone(storage.load_block(2))
+
+    def test_a_torn_write_at_the_end_of_the_log_is_dropped(self):
+        storage = self.storage()
+        storage.save_blocks(chain(3))
+        storage.close()
+        with open(os.path.join(self.directory, "blocks.log"), "r+b") as f:
+            f.truncate(f.seek(0, os.SEEK_END) - 1)
+        storage = self.storage()
+        self.assertEqual(len(storage.load_blocks()), 2)
+        storage.save_block(chain(3)[2])
+        self.assertEqual(Block.from_dict(storage.load_block(2)).hash(), chain(3)[2].hash())
+
+
+if __name__ == '__main__':
+    unittest.main()
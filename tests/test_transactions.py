@@ -0,0 +1,61 @@
+"""
+Admitting and mining transfers, including repeated identical payments.
+"""
+import os
+import sys
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.blockchain import Blockchain  # noqa: E402
+from blockchain.transaction import Transaction  # noqa: E402
+from blockchain.wallet import Wallet  # noqa: E402
+from cryptolib.crypto import Crypto  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+class RepeatedPaymentTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Blockchain(storage=MemoryStorage())
+        self.addCleanup(self.node.miner.shutdown)
+        self.wallet = Wallet(self.node, scheme="ed25519")
+
+    def signed(self, amount, nonce=None):
+        transaction = Transaction(self.wallet.public_key, "bob", amount, None, nonce).to_dict()
+        transaction['signature'] = Crypto.sign_transaction(
+            self.wallet.private_key, Transaction.signing_message(transaction))
+        return transaction
+
+    def test_the_same_payment_twice_is_two_transactions(self):
+        first = self.node.validate_and_process_transaction(self.wallet.public_key, "bob", 2, self.wallet.private_key)
+        second = self.node.validate_and_process_transaction(self.wallet.public_key, "bob", 2, self.wallet.private_key)
+        self.assertNotEqual(Transaction.compute_id(first.to_dict()), Transaction.compute_id(second.to_dict()))
+        self.assertIsNotNone(self.node.mine())
+        self.assertEqual(self.node.get_balance("bob"), 4)
+        self.assertEqual(self.node.get_balance(self.wallet.public_key), 6)
+
+    def test_client_signed_payments_differ_by_nonce(self):
+        results, admitted = self.node.submit_transactions([self.signed(3, nonce=1), self.signed(3, nonce=2),
+                                                           self.signed(3, nonce=2)])
+        self.assertEqual([result["status"] for result in results], ["accepted", "accepted", "rejected"])
+        self.assertIsNotNone(self.node.mine())
+        self.assertEqual(self.node.get_balance("bob"), 6)
+
+    def test_legacy_transaction_without_a_nonce_still_verifies(self):
+        legacy = self.signed(1)
+        self.assertNotIn('nonce', legacy)
+        self.assertEqual(Transaction.signing_message(legacy), f"{self.wallet.public_key}bob1")
+        self.assertEqual(self.node.verify_transactions([legacy]), [True])
+        results, admitted = self.node.submit_transactions([legacy])
+        self.assertEqual(results[0]["status"], "accepted")
+
+    def test_a_nonce_signature_does_not_verify_with_a_different_nonce(self):
+        transaction = self.signed(1, nonce=7)
+        transaction['nonce'] = 8
+        self.assertEqual(self.node.verify_transactions([transaction]), [False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+The transaction index: recent blocks in memory, older ones answered by storage.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('MINING_DIFFICULTY', '1')
+os.environ.setdefault('MINER_WORKERS', '1')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from blockchain.block import Block  # noqa: E402
+from blockchain.blockchain import Blockchain  # noqa: E402
+from blockchain.transaction import Transaction  # noqa: E402
+from blockchain.wallet import Wallet  # noqa: E402
+from database.log_storage import LogStorage  # noqa: E402
+from database.memory_storage import MemoryStorage  # noqa: E402
+
+
+class TransactionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.miner.shutdown()
+
+    def node(self, storage, window=2):
+        node = Blockchain(storage=storage)
+        node.tx_index.window = window
+        self.nodes.append(node)
+        return node
+
+    def pay_in_blocks(self, node, count):
+        """Mine a grant, then ``count`` blocks each paying bob 1. Returns the transfer ids, oldest first."""
+        wallet = Wallet(node, scheme="ed25519")
+        self.assertIsNotNone(node.mine())
+        tx_ids = []
+        for _ in range(count):
+            transaction = node.validate_and_process_transaction(wallet.public_key, "bob", 1, wallet.private_key)
+            tx_ids.append(Transaction.compute_id(transaction.to_dict()))
+            self.assertIsNotNone(node.mine())
+        return tx_ids
+
+    def test_old_transactions_are_found_in_storage(self):
+        node = self.node(MemoryStorage())
+        tx_ids = self.pay_in_blocks(node, 4)
+        self.assertNotIn(tx_ids[0], node.tx_index.txids)
+        found = node.find_transaction(tx_ids[0])
+        self.assertEqual((found["status"], found["block_index"]), ("confirmed", 2))
+        self.assertIsNotNone(node.get_transaction_proof(tx_ids[0]))
+        self.assertIsNone(node.find_transaction("0" * 64))
+
+    def test_history_pages_across_memory_and_storage(self):
+        node = self.node(MemoryStorage())
+        tx_ids = self.pay_in_blocks(node, 4)
+        seen = []
+        before = None
+        while True:
+            page = node.address_history("bob", 3, before)
+            self.assertEqual(page["total"], 4)
+            seen.extend(entry["txid"] for entry in page["transactions"])
+            before = page["next"]
+            if before is None:
+                break
+        self.assertEqual(seen, list(reversed(tx_ids)))
+
+    def test_replaying_a_transaction_older_than_the_window_is_refused(self):
+        node = self.node(MemoryStorage())
+        tx_ids = self.pay_in_blocks(node, 3)
+        replay = node.find_transaction(tx_ids[0])["transaction"]
+        self.assertFalse(node.add_transaction(replay))
+        tip = node.snapshot().tip
+        block = Block(tip.index + 1, [replay], tip.hash())
+        block.mine(1)
+        self.assertFalse(node.add_block(block))
+
+    def test_restart_resumes_the_stored_index(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        storage = LogStorage(directory)
+        tx_ids = self.pay_in_blocks(self.node(storage), 3)
+        storage.close()
+
+        storage = LogStorage(directory)
+        self.addCleanup(storage.close)
+        node = self.node(storage)
+        self.assertEqual(node.tx_index.height, node.snapshot().height)
+        self.assertEqual(node.find_transaction(tx_ids[0])["block_index"], 2)
+        self.assertEqual(node.address_history("bob", 10)["total"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+The CouchDB write-behind queue against an in-process stand-in for the database.
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from database.write_behind import WriteBehindQueue, WriteConflict  # noqa: E402
+
+
+class FakeDatabase:
+    """Answers ``update`` and ``_all_docs`` like couchdb.Database; ``conflicting`` ids always lose."""
+
+    def __init__(self):
+        self.docs = {}
+        self.conflicting = set()
+        self.updates = 0
+
+    def update(self, docs):
+        self.updates += 1
+        results = []
+        for doc in docs:
+            if doc["_id"] in self.conflicting:
+                results.append((False, doc["_id"], Exception("conflict")))
+                continue
+            rev = f"{int(doc.get('_rev', '0-x').split('-')[0]) + 1}-x"
+            self.docs[doc["_id"]] = dict(doc, _rev=rev)
+            results.append((True, doc["_id"], rev))
+        return results
+
+    def view(self, name, keys=()):
+        return [SimpleNamespace(key=key, value={"rev": self.docs[key]["_rev"]} if key in self.docs else None)
+                for key in keys]
+
+
+class WriteBehindQueueTest(unittest.TestCase):
+    def queue(self, db, durability, flush_interval=0.01):
+        queue = WriteBehindQueue(db, durability=durability, flush_interval=flush_interval)
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_group_commit_waits_for_the_write(self):
+        db = FakeDatabase()
+        queue = self.queue(db, "group")
+        queue.put({"_id": "block:1", "index": 1})
+        self.assertEqual(db.docs["block:1"]["index"], 1)
+        self.assertEqual(queue.pending_count(), 0)
+
+    def test_a_write_that_conflicts_twice_fails_its_waiter_and_is_requeued(self):
+        db = FakeDatabase()
+        db.conflicting.add("wallets_checkpoint")
+        queue = self.queue(db, "sync")
+        with self.assertRaises(WriteConflict):
+            queue.put({"_id": "wallets_checkpoint", "seq": 1})
+        self.assertNotIn("wallets_checkpoint", db.docs)
+        self.assertEqual(queue.pending_count(), 1)
+
+        db.conflicting.clear()
+        self.assertTrue(queue.flush())
+        self.assertEqual(db.docs["wallets_checkpoint"]["seq"], 1)
+
+    def test_documents_committed_beside_a_conflict_stay_committed(self):
+        db = FakeDatabase()
+        db.conflicting.add("b")
+        # Long enough that only the explicit flush below commits anything
+        queue = self.queue(db, "async", flush_interval=60)
+        queue.put({"_id": "a"})
+        queue.put({"_id": "b"})
+        self.assertFalse(queue.flush())
+        self.assertIn("a", db.docs)
+        self.assertEqual(queue.pending_count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()